@@ -0,0 +1,43 @@
+#Compares analytic normals from the forward mode DE against the tetrahedral finite difference
+#on the CPU renderer. Both are evaluated at the primary ray hits of each demo fractal and the
+#report shows their timings and the angle between them. On the GPU the same comparison is
+#made by toggling the ANALYTIC_NORMALS camera option.
+#  python benchmarks/analytic_normals.py [width] [height]
+
+import sys, time
+import numpy as np
+from common import FRACTALS, load_scene
+from pyspace.camera import Camera
+from pyspace.renderer import Renderer
+
+def surface_points(renderer, mat, size):
+	frag, _ = renderer.frag_coords(size, None)
+	zero = np.zeros((2,), dtype=renderer.dtype)
+	p, ray, _ = renderer.camera_rays(mat, size, frag, zero, np.zeros((4,), dtype=renderer.dtype))
+	d, _, _, _ = renderer.ray_march(p, ray, 1.0, 0.0)
+	return p[d < renderer.cam['MIN_DIST']]
+
+def timed_normals(renderer, p, analytic):
+	renderer.cam['ANALYTIC_NORMALS'] = analytic
+	t = time.time()
+	n = renderer.calc_normal(p, renderer.cam['MIN_DIST'] * 10)
+	return n, time.time() - t
+
+def main():
+	size = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) > 2 else (160, 90)
+	print('%-24s %8s %10s %10s %8s %12s' % ('fractal', 'hits', 'tetra ms', 'grad ms', 'ratio', 'median deg'))
+	for name in FRACTALS:
+		obj, mat = load_scene(name)
+		renderer = Renderer(obj, Camera())
+		p = surface_points(renderer, mat, size)
+		if p.shape[0] == 0:
+			print('%-24s %8d' % (name, 0))
+			continue
+		n_tetra, t_tetra = timed_normals(renderer, p, False)
+		n_grad, t_grad = timed_normals(renderer, p, True)
+		deg = np.degrees(np.arccos(np.clip(np.sum(n_tetra * n_grad, axis=1), -1.0, 1.0)))
+		print('%-24s %8d %10.1f %10.1f %8.2f %12.3f' % (name, p.shape[0], t_tetra * 1000.0,
+			t_grad * 1000.0, t_grad / max(t_tetra, 1e-9), np.median(deg)))
+
+if __name__ == '__main__':
+	main()
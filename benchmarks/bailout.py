@@ -0,0 +1,47 @@
+#Compares rendering with an escape radius bailout against the full fold chain on the CPU
+#renderer. Reports the fraction of fold evaluations saved, the render times and the image
+#error for each demo fractal. Escaped points skip the rest of their iteration run and go
+#straight to the primitives after it, so the error depends on the radius.
+#  python benchmarks/bailout.py [radius] [width] [height]
+
+import sys, time
+import numpy as np
+from common import FRACTALS, load_scene
+from pyspace.camera import Camera
+from pyspace.renderer import Renderer
+
+def count_folds(obj, counter):
+	#Counts the points every fold of the chain transforms
+	for t in set(obj.trans):
+		if hasattr(t, 'fold_batch'):
+			def fold_batch(p, fold=t.fold_batch):
+				counter[0] += p.shape[0]
+				fold(p)
+			t.fold_batch = fold_batch
+
+def timed_render(renderer, mat, size, counter):
+	counter[0] = 0
+	t = time.time()
+	img = renderer.render(mat, size)
+	return img, time.time() - t, counter[0]
+
+def main():
+	radius = float(sys.argv[1]) if len(sys.argv) > 1 else 16.0
+	size = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else (160, 90)
+	print('%-24s %8s %10s %10s %10s %10s' % ('fractal', 'saved', 'full s', 'bailout s', 'mean err', 'max err'))
+	for name in FRACTALS:
+		obj, mat = load_scene(name)
+		counter = [0]
+		count_folds(obj, counter)
+		renderer = Renderer(obj, Camera())
+		ref, t_ref, n_ref = timed_render(renderer, mat, size, counter)
+
+		obj.bailout = radius
+		img, t_img, n_img = timed_render(renderer, mat, size, counter)
+
+		err = np.abs(img - ref)
+		print('%-24s %8.3f %10.2f %10.2f %10.4f %10.4f' % (name, 1.0 - n_img / max(n_ref, 1),
+			t_ref, t_img, np.mean(err), np.max(err)))
+
+if __name__ == '__main__':
+	main()
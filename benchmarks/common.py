@@ -0,0 +1,20 @@
+import os, sys
+import numpy as np
+
+#Benchmarks are run from the repository root or this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ray_marcher_demo as demo
+
+FRACTALS = ['infinite_spheres', 'butterweed_hills', 'mandelbox', 'mausoleum', 'menger',
+	'tree_planet', 'sierpinski_tetrahedron', 'snow_stadium', 'test_fractal']
+
+def load_scene(name):
+	#Builds a demo fractal with the demo's starting parameters and camera matrix
+	obj = getattr(demo, name)()
+	mat = np.identity(4, np.float32)
+	mat[3,:3] = demo.start_pos
+	for i in range(3):
+		obj.params.set(str(i), demo.keyvars[i])
+	obj.params.set('v', demo.keyvars[3:6])
+	obj.params.set('pos', mat[3,:3])
+	return obj, mat
@@ -0,0 +1,83 @@
+#Measures what it costs to make the numeric camera params live uniforms instead of constants.
+#Each demo fractal is drawn with every float and vec3 camera param as a constant and again
+#with all of them live. The report shows the frame times of both, the time to rebuild the
+#constant shader after a change and the time to update the live uniforms instead.
+#  python benchmarks/live_params.py [width] [height] [frames]
+
+import sys, time
+import numpy as np
+from common import FRACTALS, load_scene
+from pyspace.camera import Camera
+from pyspace.shader import Shader
+
+import pygame
+from pygame.locals import *
+from OpenGL.GL import *
+
+LIVE_PARAMS = ['MAX_DIST', 'MIN_DIST', 'LOD_MULTIPLIER', 'SHADOW_SHARPNESS', 'SHADOW_DARKNESS',
+	'EXPOSURE', 'FIELD_OF_VIEW', 'AMBIENT_OCCLUSION_STRENGTH', 'LIGHT_DIRECTION', 'LIGHT_COLOR',
+	'BACKGROUND_COLOR', 'STEP_MULTIPLIER', 'VIGNETTE_STRENGTH', 'SUN_SIZE', 'SUN_SHARPNESS']
+
+def build(obj, cam, size):
+	#Time until the first frame is done, drivers may defer compiling until the first draw
+	t = time.time()
+	shader = Shader(obj)
+	program = shader.compile(cam)
+	glUseProgram(program)
+	glUniform2fv(shader.location('iResolution'), 1, np.array(size, dtype=np.float32))
+	shader.flush()
+	draw(shader, np.identity(4, np.float32))
+	return shader, time.time() - t
+
+def draw(shader, mat):
+	glUniformMatrix4fv(shader.location('iMat'), 1, False, mat)
+	glUniformMatrix4fv(shader.location('iPrevMat'), 1, False, mat)
+	glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+	glFinish()
+
+def frame_time(shader, mat, frames):
+	glUseProgram(shader.program)
+	shader.flush()
+	t = time.time()
+	for _ in range(frames):
+		draw(shader, mat)
+	return (time.time() - t) / frames
+
+def main():
+	size = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) > 2 else (320, 180)
+	frames = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+	pygame.init()
+	pygame.display.set_mode(size, OPENGL | DOUBLEBUF | HIDDEN)
+	quad = np.array([-1.0, -1.0, 0.0, 1.0, -1.0, 0.0, -1.0, 1.0, 0.0, 1.0, 1.0, 0.0], dtype=np.float32)
+	glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, quad)
+	glEnableVertexAttribArray(0)
+
+	print('%-24s %10s %10s %9s %11s %10s' % ('fractal', 'const ms', 'live ms', 'overhead', 'rebuild s', 'update us'))
+	for name in FRACTALS:
+		obj, mat = load_scene(name)
+		cam = Camera()
+		const_shader, _ = build(obj, cam, size)
+		t_const = frame_time(const_shader, mat, frames)
+
+		#A changed constant means generating and compiling the shader again
+		cam['EXPOSURE'] = 1.1
+		_, t_rebuild = build(obj, cam, size)
+
+		live_cam = Camera()
+		for k in LIVE_PARAMS:
+			live_cam.set_live(k)
+		live_shader, _ = build(obj, live_cam, size)
+		t_live = frame_time(live_shader, mat, frames)
+
+		#The live shader only uploads the changed uniform
+		t = time.time()
+		for i in range(100):
+			live_shader.set('EXPOSURE', 1.0 + i * 0.001)
+			live_shader.flush()
+		t_update = (time.time() - t) / 100
+
+		print('%-24s %10.2f %10.2f %8.1f%% %11.3f %10.1f' % (name, t_const * 1000.0, t_live * 1000.0,
+			(t_live / t_const - 1.0) * 100.0, t_rebuild, t_update * 1e6))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,39 @@
+#Compares over-relaxed sphere tracing against regular sphere tracing on the CPU renderer.
+#Reports the average number of primary ray steps and the image error for each demo fractal.
+#Ambient occlusion is based on step counts, so most of the image error shows up there.
+#  python benchmarks/relaxed_marching.py [omega] [width] [height]
+
+import sys
+import numpy as np
+from common import FRACTALS, load_scene
+from pyspace.camera import Camera
+from pyspace.renderer import Renderer
+
+def primary_steps(renderer, mat, size):
+	frag, _ = renderer.frag_coords(size, None)
+	zero = np.zeros((2,), dtype=renderer.dtype)
+	p, ray, _ = renderer.camera_rays(mat, size, frag, zero, np.zeros((4,), dtype=renderer.dtype))
+	_, s, _, _ = renderer.ray_march(p, ray, 1.0, 0.0)
+	return float(np.mean(np.floor(s)))
+
+def main():
+	omega = float(sys.argv[1]) if len(sys.argv) > 1 else 1.5
+	size = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else (160, 90)
+	print('%-24s %10s %10s %8s %10s %10s' % ('fractal', 'steps', 'relaxed', 'ratio', 'mean err', 'max err'))
+	for name in FRACTALS:
+		obj, mat = load_scene(name)
+		cam = Camera()
+		renderer = Renderer(obj, cam)
+		steps = primary_steps(renderer, mat, size)
+		ref = renderer.render(mat, size)
+
+		cam['RELAXATION_OMEGA'] = omega
+		relaxed_steps = primary_steps(renderer, mat, size)
+		img = renderer.render(mat, size)
+
+		err = np.abs(img - ref)
+		print('%-24s %10.1f %10.1f %8.2f %10.4f %10.4f' % (name, steps, relaxed_steps,
+			relaxed_steps / max(steps, 1e-9), np.mean(err), np.max(err)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+import numpy as np
+from .cache import canonical
+
+#Sparse SDF cache of an Object: an octree over a cube whose leaves near the surface hold
+#dense bricks of (B+1)^3 DE samples and whose empty leaves only keep the DE at their center.
+#Lookups return a lower bound of the exact DE as long as the DE is lipschitz-continuous.
+#
+#File layout: a fixed size header followed by the node and brick arrays, each starting
+#on a 64 byte boundary so they can be memory-mapped without copying, and the values of
+#the scene's params the map was baked with as JSON.
+MAGIC = b'PYBM'
+VERSION = 2
+HEADER_FORMAT = '<4sIIIIIffffff'
+HEADER_SIZE = 64
+ALIGN = 64
+
+#Offsets of the 8 children, bit 0 is x, bit 1 is y and bit 2 is z
+OCTANTS = np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)], dtype=np.float64)
+
+_worker = {}
+
+def _init_worker(obj):
+	if callable(obj):
+		obj = obj()
+	_worker['obj'] = obj
+
+def _eval_chunk(points):
+	return _worker['obj'].DE_batch(points, dtype=np.float64)
+
+def eval_DE(obj, points, pool=None, chunk_size=65536):
+	if pool is None or points.shape[0] <= chunk_size:
+		return obj.DE_batch(points, dtype=np.float64)
+	chunks = [points[i:i+chunk_size] for i in range(0, points.shape[0], chunk_size)]
+	return np.concatenate(pool.map(_eval_chunk, chunks))
+
+class BrickMap:
+	def __init__(self, lo, size, depth, brick_size, lipschitz, closed, children, value, brick, bricks, params=None):
+		self.lo = np.asarray(lo, dtype=np.float64)
+		self.size = float(size)
+		self.depth = depth
+		self.brick_size = brick_size
+		self.lipschitz = float(lipschitz)
+		self.closed = closed
+		self.children = children
+		self.value = value
+		self.brick = brick
+		self.bricks = bricks
+		self.params = {} if params is None else params
+
+		#Spacing of the brick samples, closer than this the exact DE is worth evaluating
+		self.cell_size = self.size / (2**depth * brick_size)
+
+	def __len__(self):
+		return self.bricks.shape[0]
+
+	def matches(self, params):
+		#The bound only holds for the param values the map was baked with
+		for k in self.params:
+			if k not in params or not np.array_equal(np.asarray(params[k], dtype=np.float64), self.params[k]):
+				return False
+		return True
+
+	def find(self, p):
+		#Descends the octree for every point, returns the leaf and its min corner and size
+		node = np.zeros((p.shape[0],), dtype=np.int64)
+		origin = np.tile(self.lo, (p.shape[0], 1))
+		size = np.full((p.shape[0],), self.size)
+		for _ in range(self.depth):
+			inner = self.children[node, 0] >= 0
+			if not np.any(inner):
+				break
+			half = size[inner] * 0.5
+			o = (p[inner] >= origin[inner] + half[:,None]).astype(np.int64)
+			node[inner] = self.children[node[inner], o[:,0] + 2*o[:,1] + 4*o[:,2]]
+			origin[inner] += o * half[:,None]
+			size[inner] = half
+		return node, origin, size
+
+	def sample(self, points):
+		#Trilinear estimate of the DE and a bound of its error, which is infinite outside the map
+		p = np.asarray(points, dtype=np.float64)[:,:3]
+		d = np.zeros((p.shape[0],), dtype=np.float64)
+		err = np.full((p.shape[0],), np.inf)
+		inside = np.all((p >= self.lo) & (p < self.lo + self.size), axis=1)
+		if not np.any(inside):
+			return d, err
+		pi = p[inside]
+		node, origin, size = self.find(pi)
+		b = self.brick[node]
+		di = np.empty((pi.shape[0],), dtype=np.float64)
+		ei = np.empty((pi.shape[0],), dtype=np.float64)
+
+		#Empty leaves are bounded by the distance from their center
+		empty = b < 0
+		dc = pi[empty] - origin[empty] - size[empty,None] * 0.5
+		di[empty] = self.value[node[empty]]
+		ei[empty] = self.lipschitz * np.linalg.norm(dc, axis=1)
+
+		#The error of trilinear interpolation of a lipschitz function is at most L*h*sqrt(sum(t(1-t)))
+		full = ~empty
+		if np.any(full):
+			bf = b[full]
+			u = (pi[full] - origin[full]) * (self.brick_size / size[full,None])
+			ix = np.clip(np.floor(u).astype(np.int64), 0, self.brick_size - 1)
+			t = np.clip(u - ix, 0.0, 1.0)
+			v = 0.0
+			for k in range(8):
+				o = OCTANTS[k].astype(np.int64)
+				w = np.prod(np.where(o == 1, t, 1.0 - t), axis=1)
+				v = v + w * self.bricks[bf, ix[:,0] + o[0], ix[:,1] + o[1], ix[:,2] + o[2]]
+			di[full] = v
+			ei[full] = self.lipschitz * self.cell_size * np.sqrt(np.sum(t * (1.0 - t), axis=1))
+
+		d[inside] = di
+		err[inside] = ei
+		return d, err
+
+	def DE(self, p):
+		#Scalar version of DE_batch for single probes like the camera's
+		x, y, z = float(p[0]) - self.lo[0], float(p[1]) - self.lo[1], float(p[2]) - self.lo[2]
+		size = self.size
+		w = float(p[3]) if len(p) > 3 else 1.0
+		if not (0.0 <= x < size and 0.0 <= y < size and 0.0 <= z < size):
+			if not self.closed:
+				return -math.inf
+			a0, a1, a2 = max(abs(x - size*0.5) - size*0.5, 0.0), max(abs(y - size*0.5) - size*0.5, 0.0), max(abs(z - size*0.5) - size*0.5, 0.0)
+			return math.sqrt(a0*a0 + a1*a1 + a2*a2) / w
+		node = 0
+		for _ in range(self.depth):
+			if self.children[node, 0] < 0:
+				break
+			size *= 0.5
+			ox, oy, oz = int(x >= size), int(y >= size), int(z >= size)
+			x, y, z = x - ox*size, y - oy*size, z - oz*size
+			node = int(self.children[node, ox + 2*oy + 4*oz])
+		b = int(self.brick[node])
+		if b < 0:
+			h = size * 0.5
+			return (float(self.value[node]) - self.lipschitz * math.sqrt((x - h)**2 + (y - h)**2 + (z - h)**2)) / w
+		s = self.brick_size / size
+		u = [x*s, y*s, z*s]
+		ix = [min(max(int(math.floor(v)), 0), self.brick_size - 1) for v in u]
+		t = [min(max(u[i] - ix[i], 0.0), 1.0) for i in range(3)]
+		c = self.bricks[b, ix[0]:ix[0]+2, ix[1]:ix[1]+2, ix[2]:ix[2]+2].tolist()
+		d = 0.0
+		for i in range(2):
+			for j in range(2):
+				for k in range(2):
+					d += (t[0] if i else 1.0 - t[0]) * (t[1] if j else 1.0 - t[1]) * (t[2] if k else 1.0 - t[2]) * c[i][j][k]
+		err = self.lipschitz * self.cell_size * math.sqrt(sum(v * (1.0 - v) for v in t))
+		return (d - err) / w
+
+	def DE_batch(self, points):
+		#Lower bound of the DE inside the cube. Outside a closed map the distance to the cube
+		#is used instead, which bounds the distance to the surface since all of it is inside.
+		#Outside an open map nothing is known and it is -inf.
+		p = np.asarray(points, dtype=np.float64)
+		d, err = self.sample(p)
+		lower = d - err
+		outside = np.isinf(err)
+		if self.closed and np.any(outside):
+			a = np.abs(p[outside,:3] - (self.lo + self.size * 0.5)) - self.size * 0.5
+			lower[outside] = np.linalg.norm(np.maximum(a, 0.0), axis=1)
+		if p.shape[1] > 3:
+			lower /= p[:,3]
+		return lower
+
+	def save(self, fname):
+		header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.depth, self.brick_size,
+			self.children.shape[0], self.bricks.shape[0], self.lo[0], self.lo[1], self.lo[2],
+			self.size, self.lipschitz, 1.0 if self.closed else 0.0)
+		with open(fname + '.tmp', 'wb') as f:
+			f.write(header.ljust(HEADER_SIZE, b'\0'))
+			for a in self.arrays():
+				f.write(b'\0' * (-f.tell() % ALIGN))
+				f.write(np.ascontiguousarray(a).tobytes())
+			f.write(json.dumps({k: self.params[k].tolist() for k in self.params}).encode('utf-8'))
+		os.replace(fname + '.tmp', fname)
+
+	def arrays(self):
+		return (self.children, self.value, self.brick, self.bricks)
+
+def array_layout(num_nodes, num_bricks, brick_size):
+	n = brick_size + 1
+	return [('<i4', (num_nodes, 8)), ('<f4', (num_nodes,)), ('<i4', (num_nodes,)), ('<f4', (num_bricks, n, n, n))]
+
+def load_brickmap(fname):
+	#Arrays are read-only views of the file
+	with open(fname, 'rb') as f:
+		data = f.read(struct.calcsize(HEADER_FORMAT))
+	magic, version, depth, brick_size, num_nodes, num_bricks, x, y, z, size, lipschitz, closed = struct.unpack(HEADER_FORMAT, data)
+	if magic != MAGIC:
+		raise Exception("Not a brick map file: " + fname)
+	if version != VERSION:
+		raise Exception("Unsupported brick map version: " + str(version))
+	arrays = []
+	offset = HEADER_SIZE
+	for dtype, shape in array_layout(num_nodes, num_bricks, brick_size):
+		offset += -offset % ALIGN
+		if np.prod(shape) == 0:
+			arrays.append(np.zeros(shape, dtype=dtype))
+		else:
+			arrays.append(np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=shape))
+		offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+	with open(fname, 'rb') as f:
+		f.seek(offset)
+		params = json.loads(f.read().decode('utf-8'))
+	params = {k: np.asarray(params[k], dtype=np.float64) for k in params}
+	return BrickMap((x, y, z), size, depth, brick_size, lipschitz, closed != 0.0, *arrays, params=params)
+
+def bake_brickmap(obj, lo=None, size=None, depth=5, brick_size=8, lipschitz=1.0, processes=None, leaves_per_batch=256):
+	#Samples obj over the cube [lo, lo + size]. By default the cube is fit around obj.bound
+	#or an estimated bound. lipschitz should be at least the DE's Lipschitz constant, see
+	#pyspace.lipschitz.analyze. With processes the DE is evaluated on a process pool,
+	#obj can then also be a builder function like in TiledRenderer.
+	builder = obj
+	if callable(obj):
+		obj = obj()
+	bound = obj.bound if obj.bound is not None else obj.estimate_bound()
+	if lo is None or size is None:
+		if bound is None:
+			raise Exception("Unbounded scenes need an explicit region to bake")
+		c, r = bound
+		lo = np.asarray(c, dtype=np.float64) - r
+		size = 2.0 * r
+		closed = True
+	else:
+		#Outside the cube the map only knows the distance to it if the whole bound is inside
+		lo = np.asarray(lo, dtype=np.float64)
+		closed = bound is not None
+		if closed:
+			c = np.asarray(bound[0], dtype=np.float64)
+			closed = bool(np.all(c - bound[1] >= lo) and np.all(c + bound[1] <= lo + size))
+
+	pool = None
+	if processes is not None:
+		pool = multiprocessing.Pool(processes, _init_worker, (builder,))
+	try:
+		#Refine level by level, a node can only contain surface if its center DE is below its radius.
+		#Nodes are numbered breadth first, so every level is a contiguous block.
+		children = []
+		value = []
+		origin = lo[None,:]
+		first_id = 0
+		next_id = 1
+		leaf_ids = np.zeros((0,), dtype=np.int64)
+		leaf_origin = np.zeros((0, 3))
+		for level in range(depth + 1):
+			node_size = size / 2**level
+			dc = eval_DE(obj, origin + node_size * 0.5, pool)
+			near = dc <= lipschitz * node_size * math.sqrt(3.0) * 0.5
+			value.append(dc)
+			children.append(np.full((origin.shape[0], 8), -1, dtype=np.int32))
+			if level == depth:
+				leaf_ids = first_id + np.nonzero(near)[0]
+				leaf_origin = origin[near]
+				break
+			num = np.count_nonzero(near)
+			if num == 0:
+				break
+			children[-1][near] = (next_id + np.arange(num * 8)).reshape((num, 8))
+			first_id = next_id
+			next_id += num * 8
+			origin = (origin[near][:,None,:] + OCTANTS[None,:,:] * node_size * 0.5).reshape((-1, 3))
+
+		#Dense bricks for the leaves at the finest level that are near the surface
+		n = brick_size + 1
+		h = size / (2**depth * brick_size)
+		grid = np.stack(np.meshgrid(*[np.arange(n) * h] * 3, indexing='ij'), axis=-1).reshape((-1, 3))
+		bricks = np.empty((leaf_ids.shape[0], n, n, n), dtype=np.float32)
+		for i in range(0, leaf_ids.shape[0], leaves_per_batch):
+			samples = (leaf_origin[i:i+leaves_per_batch,None,:] + grid[None,:,:]).reshape((-1, 3))
+			bricks[i:i+leaves_per_batch] = eval_DE(obj, samples, pool).reshape((-1, n, n, n))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	children = np.concatenate(children)
+	brick = np.full((children.shape[0],), -1, dtype=np.int32)
+	brick[leaf_ids] = np.arange(leaf_ids.shape[0])
+	#Only the params the DE reads decide whether the map is still valid
+	params = {k: np.asarray(obj.params[k], dtype=np.float64) for k in obj.param_keys() if k in obj.params}
+	return BrickMap(lo, size, depth, brick_size, lipschitz, closed, children,
+		np.concatenate(value).astype(np.float32), brick, bricks, params)
+
+def cached_brickmap(obj, path=None, **kwargs):
+	#Loads the brick map of obj, baking and saving it first if the scene, its parameter
+	#values or the settings are new
+	if path is None:
+		path = os.path.join(os.path.expanduser('~'), '.pyspace', 'brickmaps')
+	key = str(VERSION) + canonical(obj) + canonical(dict(obj.params.items())) + canonical(kwargs)
+	key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+	fname = os.path.join(path, key + '.pybm')
+	if not os.path.exists(fname):
+		if not os.path.exists(path):
+			os.makedirs(path)
+		bake_brickmap(obj, **kwargs).save(fname)
+	return load_brickmap(fname)
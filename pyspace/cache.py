@@ -0,0 +1,83 @@
+import hashlib
+import os
+import numpy as np
+from .util import ParamStore
+
+#Attributes that change at runtime or per process and don't affect the generated code.
+#o and o_grad are the per-call origin of FoldScaleOrigin and its Jacobian.
+_VOLATILE_ATTRS = ('name', 'o', 'py_key', 'py_de', 'py_refs', 'plan_key', 'plan', 'o_grad')
+
+def canonical(t):
+	if isinstance(t, (list, tuple)):
+		return '[' + ','.join(canonical(x) for x in t) + ']'
+	elif isinstance(t, dict):
+		return '{' + ','.join(repr(k) + ':' + canonical(t[k]) for k in sorted(t)) + '}'
+	elif isinstance(t, (set, frozenset)):
+		return '{' + ','.join(sorted(canonical(x) for x in t)) + '}'
+	elif isinstance(t, np.ndarray):
+		return repr(t.tolist())
+	elif isinstance(t, (str, int, float, bool)) or t is None:
+		return repr(t)
+	elif isinstance(t, ParamStore):
+		#Param values are uniforms, callers key the names and types they need themselves
+		return 'ParamStore'
+	s = type(t).__name__ + '('
+	for k in sorted(vars(t)):
+		if k not in _VOLATILE_ATTRS:
+			s += k + '=' + canonical(getattr(t, k)) + ','
+	return s + ')'
+
+#On-disk cache of generated shader source and linked program binaries.
+#Least recently used entries are evicted once the total size exceeds max_size.
+class ShaderCache:
+	def __init__(self, path=None, max_size=64*1024*1024):
+		if path is None:
+			path = os.path.join(os.path.expanduser('~'), '.pyspace', 'cache')
+		self.path = path
+		self.max_size = max_size
+
+	def key(self, *parts):
+		h = hashlib.sha1()
+		for part in parts:
+			h.update(part.encode('utf-8') if isinstance(part, str) else part)
+			h.update(b'\0')
+		return h.hexdigest()
+
+	def file(self, key, ext):
+		return os.path.join(self.path, key + '.' + ext)
+
+	def get(self, key, ext):
+		fname = self.file(key, ext)
+		if not os.path.exists(fname):
+			return None
+		with open(fname, 'rb') as f:
+			data = f.read()
+		#Touch the entry so it counts as recently used
+		os.utime(fname, None)
+		return data
+
+	def put(self, key, ext, data):
+		if not os.path.exists(self.path):
+			os.makedirs(self.path)
+		fname = self.file(key, ext)
+		with open(fname + '.tmp', 'wb') as f:
+			f.write(data)
+		os.replace(fname + '.tmp', fname)
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for fname in os.listdir(self.path):
+			st = os.stat(os.path.join(self.path, fname))
+			entries.append((st.st_mtime, st.st_size, fname))
+		total = sum(e[1] for e in entries)
+		for mtime, size, fname in sorted(entries):
+			if total <= self.max_size:
+				break
+			os.remove(os.path.join(self.path, fname))
+			total -= size
+
+	def clear(self):
+		if os.path.exists(self.path):
+			for fname in os.listdir(self.path):
+				os.remove(os.path.join(self.path, fname))
@@ -1,8 +1,12 @@
+from .util import to_str
 
 class Camera:
 	def __init__(self):
 		self.params = {}
 
+		#Params emitted as uniforms instead of constants, see set_live()
+		self.live = set()
+
 		# Number of additional samples on each axis to average and improve image quality.
 		# NOTE: This will slow down rendering quadratically.
 		# Recommended Range: 1 to 8 (integer)
@@ -17,10 +21,21 @@ class Camera:
 		# Recommended Range: All values between -1.0 and 1.0
 		self.params['AMBIENT_OCCLUSION_COLOR_DELTA'] = (0.8, 0.8, 0.8)
 
+		# Determines if normals are computed in one pass that carries the gradient through
+		# the fold chain instead of from four extra distance estimates.
+		# NOTE: Analytic normals also resolve detail finer than MIN_DIST, so deep fractals look noisier.
+		self.params['ANALYTIC_NORMALS'] = False
+
 		# Color of the background when the ray doesn't hit anything
 		# Recommended Range: All values between 0.0 and 1.0
 		self.params['BACKGROUND_COLOR'] = (0.6, 0.6, 0.9)
 
+		# Size in pixels of the blocks for the cone marching depth prepass, 0 to disable.
+		# Each block marches one cone first and its pixels start marching from that depth.
+		# NOTE: This has no effect if ORTHOGONAL_PROJECTION or ODS is enabled.
+		# Recommended Range: 0 to 16 (integer)
+		self.params['CONE_PREPASS_BLOCK'] = 0
+
 		# The strength of the depth of field effect.
 		# NOTE: ANTIALIASING_SAMPLES must be larger than 1 to use depth of field effects.
 		# Recommended Range: 0.0 to 20.0
@@ -102,6 +117,15 @@ class Camera:
 		# Recommended Range: 0.0 to 1.0
 		self.params['MOTION_BLUR_RATIO'] = 1.0
 
+		# When enabled, renders one jittered sample per frame while the camera and parameters
+		# are unchanged and averages it with the previous ones, resetting on any change.
+		# NOTE: This replaces ANTIALIASING_SAMPLES, depth of field is sampled progressively too.
+		self.params['PROGRESSIVE_ENABLED'] = False
+
+		# Number of samples after which progressive rendering stops adding new ones.
+		# Recommended Range: 16 to 4096 (integer)
+		self.params['PROGRESSIVE_MAX_SAMPLES'] = 256
+
 		# If true will render an omnidirectional stereo 360 projection.
 		self.params['ODS'] = False
 
@@ -113,6 +137,11 @@ class Camera:
 		# Recommended Range: 0.5 to 50.0
 		self.params['ORTHOGONAL_ZOOM'] = 5.0
 
+		# Over-relaxation factor of the ray marching steps, 1.0 for regular sphere tracing.
+		# Each ray falls back to regular steps once a relaxed step overshoots.
+		# Recommended Range: 1.0 to 1.9
+		self.params['RELAXATION_OMEGA'] = 1.0
+
 		# Number of additional bounces after a ray collides with the geometry.
 		# Recommended Range: 0 to 8 (integer)
 		self.params['REFLECTION_LEVEL'] = 0
@@ -139,6 +168,12 @@ class Camera:
 		# Recommended Range: 0 to 1000 (integer)
 		self.params['SPECULAR_HIGHLIGHT'] = 40
 
+		# Scales every distance estimate before it is used as a step.
+		# NOTE: Use pyspace.lipschitz.analyze to find a safe value for a fractal.
+		# NOTE: Values below 1.0 fix overstepping, values above 1.0 are only safe if proven.
+		# Recommended Range: 0.25 to 2.0
+		self.params['STEP_MULTIPLIER'] = 1.0
+
 		# Determines if the sun should be drawn in the sky.
 		self.params['SUN_ENABLED'] = True
 
@@ -164,3 +199,24 @@ class Camera:
 
 	def __setitem__(self, k, x):
 		self.params[k] = x
+
+	def set_live(self, k, live=True):
+		#Live params can be changed with Shader.set() every frame without recompiling,
+		#the others stay constants the compiler can fold. Only floats and vec3s are allowed
+		#since ints and flags pick code paths at compile time.
+		if live:
+			if type(self.params[k]) is not float and type(self.params[k]) is not tuple:
+				raise Exception("Only float and vec3 camera params can be live: " + k)
+			self.live.add(k)
+		else:
+			self.live.discard(k)
+
+	def defines(self):
+		#Code of each define, live params refer to their uniform so their values don't matter
+		return {k: '_' + k if k in self.live else to_str(self.params[k]) for k in self.params}
+
+	def copy(self):
+		cam = Camera()
+		cam.params = dict(self.params)
+		cam.live = set(self.live)
+		return cam
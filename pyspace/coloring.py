@@ -8,6 +8,9 @@ class OrbitInitZero:
 	def orbit(self):
 		return '\tvec3 orbit = vec3(0.0);\n'
 
+	def orbit_batch(self, p, orbit):
+		return np.zeros((p.shape[0], 3), dtype=p.dtype)
+
 class OrbitInitInf:
 	def __init__(self):
 		pass
@@ -15,13 +18,19 @@ class OrbitInitInf:
 	def orbit(self):
 		return '\tvec3 orbit = vec3(1e20);\n'
 
+	def orbit_batch(self, p, orbit):
+		return np.full((p.shape[0], 3), 1e20, dtype=p.dtype)
+
 class OrbitInitNegInf:
 	def __init__(self):
 		pass
 
 	def orbit(self):
 		return '\tvec3 orbit = vec3(-1e20);\n'
-		
+
+	def orbit_batch(self, p, orbit):
+		return np.full((p.shape[0], 3), -1e20, dtype=p.dtype)
+
 class OrbitMin:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -33,6 +42,11 @@ class OrbitMin:
 		else:
 			return '\torbit = min(orbit, (p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + ');\n'
 
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return np.minimum(orbit, (p[:,:3] - origin)*scale)
+
 class OrbitMinAbs:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -41,6 +55,11 @@ class OrbitMinAbs:
 	def orbit(self):
 		return '\torbit = min(orbit, abs((p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + '));\n'
 
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return np.minimum(orbit, np.abs((p[:,:3] - origin)*scale))
+
 class OrbitMax:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -49,6 +68,11 @@ class OrbitMax:
 	def orbit(self):
 		return '\torbit = max(orbit, (p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + ');\n'
 
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return np.maximum(orbit, (p[:,:3] - origin)*scale)
+
 class OrbitMaxAbs:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -57,6 +81,11 @@ class OrbitMaxAbs:
 	def orbit(self):
 		return '\torbit = max(orbit, abs((p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + '));\n'
 
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return np.maximum(orbit, np.abs((p[:,:3] - origin)*scale))
+
 class OrbitSum:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -65,6 +94,11 @@ class OrbitSum:
 	def orbit(self):
 		return '\torbit += (p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + ';\n'
 
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return orbit + (p[:,:3] - origin)*scale
+
 class OrbitSumAbs:
 	def __init__(self, scale=(1,1,1), origin=(0,0,0)):
 		self.scale = set_global_vec3(scale)
@@ -72,3 +106,8 @@ class OrbitSumAbs:
 
 	def orbit(self):
 		return '\torbit += abs((p.xyz - ' + vec3_str(self.origin) + ')*' + vec3_str(self.scale) + ');\n'
+
+	def orbit_batch(self, p, orbit):
+		scale = get_global(self.scale)
+		origin = get_global(self.origin)
+		return orbit + np.abs((p[:,:3] - origin)*scale)
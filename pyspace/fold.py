@@ -6,6 +6,9 @@ class FoldPlane:
 	def __init__(self, n, d=0.0):
 		self.n = set_global_vec3(n)
 		self.d = set_global_float(d)
+		#A keyed normal is used through a normalized copy, so tuning it keeps the fold a reflection
+		if type(self.n) is str:
+			self.n = set_global_derived(self.n, 'unit')
 
 	def fold(self, p):
 		n = get_global(self.n)
@@ -18,6 +21,42 @@ class FoldPlane:
 		if np.dot(p[:3], n) - d < 0.0:
 			q[:3] -= 2.0 * (np.dot(q[:3], n) - d) * n
 
+	def fold_batch(self, p):
+		n = get_global(self.n)
+		d = get_global(self.d)
+		p[:,:3] -= 2.0 * np.minimum(0.0, np.dot(p[:,:3], n) - d)[:,None] * n
+
+	def unfold_batch(self, p, q):
+		n = get_global(self.n)
+		d = get_global(self.d)
+		m = np.dot(p[:,:3], n) - d < 0.0
+		q[m] -= 2.0 * (np.dot(q[m], n) - d)[:,None] * n
+
+	def fold_grad_batch(self, p, J):
+		n = get_global(self.n)
+		d = get_global(self.d)
+		m = np.dot(p[:,:3], n) - d < 0.0
+		J[m,:3] -= 2.0 * n[:,None] * np.einsum('i,nij->nj', n, J[m,:3])[:,None,:]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		d = py_float(self.d, keys)
+		for i, c in enumerate('xyz'):
+			if vec3_eq(self.n, [float(j == i) for j in range(3)]):
+				if self.d == 0.0:
+					return '\t' + c + ' = abs(' + c + ')\n'
+				return '\t' + c + ' = abs(' + c + ' - ' + d + ') + ' + d + '\n'
+			elif vec3_eq(self.n, [-float(j == i) for j in range(3)]):
+				if self.d == 0.0:
+					return '\t' + c + ' = -abs(' + c + ')\n'
+				return '\t' + c + ' = -abs(' + c + ' + ' + d + ') - ' + d + '\n'
+		n = py_vec3(self.n, keys)
+		s = '\ta = 2.0 * min(0.0, x*' + n[0] + ' + y*' + n[1] + ' + z*' + n[2] + ' - ' + d + ')\n'
+		s += '\tx -= a*' + n[0] + '\n'
+		s += '\ty -= a*' + n[1] + '\n'
+		s += '\tz -= a*' + n[2] + '\n'
+		return s
+
 	def glsl(self):
 		if vec3_eq(self.n, (1,0,0)):
 			return '\tp.x = abs(p.x - ' + float_str(self.d) + ') + ' + float_str(self.d) + ';\n'
@@ -34,6 +73,9 @@ class FoldPlane:
 		else:
 			return '\tplaneFold(p, ' + vec3_str(self.n) + ', ' + float_str(self.d) + ');\n'
 
+	def glsl_grad(self):
+		return '\tplaneFold(p, J, ' + vec3_str(self.n) + ', ' + float_str(self.d) + ');\n'
+
 '''
 EQUIVALENT FOLD:
   FoldPlane((1, 0, 0), c_x))
@@ -51,8 +93,29 @@ class FoldAbs:
 	def unfold(self, p, q):
 		c = get_global(self.c)
 		if p[0] < c[0]: q[0] = 2*c[0] - q[0]
-		if p[1] < c[1]: q[1] = 2*c[0] - q[1]
-		if p[2] < c[2]: q[2] = 2*c[0] - q[2]
+		if p[1] < c[1]: q[1] = 2*c[1] - q[1]
+		if p[2] < c[2]: q[2] = 2*c[2] - q[2]
+
+	def fold_batch(self, p):
+		c = get_global(self.c)
+		p[:,:3] = np.abs(p[:,:3] - c) + c
+
+	def unfold_batch(self, p, q):
+		c = get_global(self.c)
+		for i in range(3):
+			m = p[:,i] < c[i]
+			q[m,i] = 2*c[i] - q[m,i]
+
+	def fold_grad_batch(self, p, J):
+		c = get_global(self.c)
+		J[:,:3] *= np.where(p[:,:3] < c, -1.0, 1.0)[:,:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		if vec3_eq(self.c, (0,0,0)):
+			return '\tx, y, z = abs(x), abs(y), abs(z)\n'
+		c = py_vec3(self.c, keys)
+		return '\tx, y, z = abs(x - ' + c[0] + ') + ' + c[0] + ', abs(y - ' + c[1] + ') + ' + c[1] + ', abs(z - ' + c[2] + ') + ' + c[2] + '\n'
 
 	def glsl(self):
 		if vec3_eq(self.c, (0,0,0)):
@@ -60,6 +123,9 @@ class FoldAbs:
 		else:
 			return '\tabsFold(p, ' + vec3_str(self.c) + ');\n'
 
+	def glsl_grad(self):
+		return '\tabsFold(p, J, ' + vec3_str(self.c) + ');\n'
+
 '''
 EQUIVALENT FOLD:
   FoldPlane((inv_sqrt2, inv_sqrt2, 0)))
@@ -87,9 +153,46 @@ class FoldSierpinski:
 		if p[0] + p[1] < 0.0:
 			q[[0,1]] = -q[[1,0]]
 
+	def fold_batch(self, p):
+		a = np.minimum(p[:,0] + p[:,1], 0.0)
+		p[:,0] -= a
+		p[:,1] -= a
+		a = np.minimum(p[:,0] + p[:,2], 0.0)
+		p[:,0] -= a
+		p[:,2] -= a
+		a = np.minimum(p[:,1] + p[:,2], 0.0)
+		p[:,1] -= a
+		p[:,2] -= a
+
+	def unfold_batch(self, p, q):
+		mx = np.maximum(-p[:,1], p[:,0])
+		m = np.maximum(p[:,1], -p[:,0]) + np.maximum(-mx, p[:,2]) < 0.0
+		q[m,1], q[m,2] = -q[m,2], -q[m,1]
+		m = mx + p[:,2] < 0.0
+		q[m,0], q[m,2] = -q[m,2], -q[m,0]
+		m = p[:,0] + p[:,1] < 0.0
+		q[m,0], q[m,1] = -q[m,1], -q[m,0]
+
+	def fold_grad_batch(self, p, J):
+		for i, j in ((0,1), (0,2), (1,2)):
+			m = p[:,i] + p[:,j] < 0.0
+			J[m,i], J[m,j] = -J[m,j], -J[m,i]
+			a = np.minimum(p[:,i] + p[:,j], 0.0)
+			p[:,i] -= a
+			p[:,j] -= a
+
+	def py(self, keys):
+		s = '\tif x + y < 0.0: x, y = -y, -x\n'
+		s += '\tif x + z < 0.0: x, z = -z, -x\n'
+		s += '\tif y + z < 0.0: y, z = -z, -y\n'
+		return s
+
 	def glsl(self):
 		return '\tsierpinskiFold(p);\n'
 
+	def glsl_grad(self):
+		return '\tsierpinskiFold(p, J);\n'
+
 '''
 EQUIVALENT FOLD:
   FoldPlane((inv_sqrt2, -inv_sqrt2, 0)))
@@ -117,13 +220,51 @@ class FoldMenger:
 		if p[0] < p[1]:
 			q[[0,1]] = q[[1,0]]
 
+	def fold_batch(self, p):
+		a = np.minimum(p[:,0] - p[:,1], 0.0)
+		p[:,0] -= a
+		p[:,1] += a
+		a = np.minimum(p[:,0] - p[:,2], 0.0)
+		p[:,0] -= a
+		p[:,2] += a
+		a = np.minimum(p[:,1] - p[:,2], 0.0)
+		p[:,1] -= a
+		p[:,2] += a
+
+	def unfold_batch(self, p, q):
+		mx = np.maximum(p[:,0], p[:,1])
+		m = np.minimum(p[:,0], p[:,1]) < np.minimum(mx, p[:,2])
+		q[m,1], q[m,2] = q[m,2], q[m,1]
+		m = mx < p[:,2]
+		q[m,0], q[m,2] = q[m,2], q[m,0]
+		m = p[:,0] < p[:,1]
+		q[m,0], q[m,1] = q[m,1], q[m,0]
+
+	def fold_grad_batch(self, p, J):
+		for i, j in ((0,1), (0,2), (1,2)):
+			m = p[:,i] < p[:,j]
+			J[m,i], J[m,j] = J[m,j], J[m,i]
+			a = np.minimum(p[:,i] - p[:,j], 0.0)
+			p[:,i] -= a
+			p[:,j] += a
+
+	def py(self, keys):
+		s = '\tif x < y: x, y = y, x\n'
+		s += '\tif x < z: x, z = z, x\n'
+		s += '\tif y < z: y, z = z, y\n'
+		return s
+
 	def glsl(self):
 		return '\tmengerFold(p);\n'
 
+	def glsl_grad(self):
+		return '\tmengerFold(p, J);\n'
+
 class FoldScaleTranslate:
 	def __init__(self, s=1.0, t=(0,0,0)):
 		self.s = set_global_float(s)
 		self.t = set_global_vec3(t)
+		self.s_inv = set_global_derived(self.s, 'inv') if type(self.s) is str else reciprocal(self.s)
 
 	def fold(self, p):
 		p[:] *= get_global(self.s)
@@ -131,7 +272,30 @@ class FoldScaleTranslate:
 
 	def unfold(self, p, q):
 		q[:3] -= get_global(self.t)
-		q[:] /= get_global(self.s)
+		q[:] *= get_global(self.s_inv)
+
+	def fold_batch(self, p):
+		p *= get_global(self.s)
+		p[:,:3] += get_global(self.t)
+
+	def unfold_batch(self, p, q):
+		q -= get_global(self.t)
+		q *= get_global(self.s_inv)
+
+	def fold_grad_batch(self, p, J):
+		J *= get_global(self.s)
+		self.fold_batch(p)
+
+	def py(self, keys):
+		ret_str = ''
+		if self.s != 1.0:
+			s = py_float(self.s, keys)
+			ret_str += '\tx *= ' + s + '\n\ty *= ' + s + '\n\tz *= ' + s + '\n\tw *= ' + s + '\n'
+		t = py_vec3(self.t, keys)
+		for i, c in enumerate('xyz'):
+			if type(self.t) is str or type(self.t[i]) is str or self.t[i] != 0.0:
+				ret_str += '\t' + c + ' += ' + t[i] + '\n'
+		return ret_str
 
 	def glsl(self):
 		ret_str = ''
@@ -145,16 +309,42 @@ class FoldScaleTranslate:
 			ret_str += '\tp.xyz += ' + vec3_str(self.t) + ';\n'
 		return ret_str
 
+	def glsl_grad(self):
+		ret_str = ''
+		if self.s != 1.0:
+			if isinstance(self.s, (float, int)) and self.s >= 0:
+				ret_str += '\tJ *= ' + float_str(self.s) + ';\n'
+			else:
+				ret_str += '\tJ[0] *= ' + float_str(self.s) + ';J[1] *= ' + float_str(self.s) + ';J[2] *= ' + float_str(self.s) + ';\n'
+				ret_str += '\tJ[3] *= abs(' + float_str(self.s) + ');\n'
+		return ret_str + self.glsl()
+
 class FoldScaleOrigin:
 	def __init__(self, s=1.0):
 		self.s = set_global_float(s)
+		self.s_inv = set_global_derived(self.s, 'inv') if type(self.s) is str else reciprocal(self.s)
 		self.o = set_global_vec3((0,0,0))
 
 	def fold(self, p):
 		p[:] = p*get_global(self.s) + self.o
 
 	def unfold(self, p, q):
-		q[:] = (q - self.o[:3]) / get_global(self.s)
+		q[:] = (q - self.o[:3]) * get_global(self.s_inv)
+
+	def fold_batch(self, p):
+		p[:] = p*get_global(self.s) + self.o
+
+	def unfold_batch(self, p, q):
+		q[:] = (q - self.o[:,:3]) * get_global(self.s_inv)
+
+	def fold_grad_batch(self, p, J):
+		#The origin's Jacobian is set along with the origin
+		J[:] = J*get_global(self.s) + self.o_grad
+		self.fold_batch(p)
+
+	def py(self, keys):
+		s = py_float(self.s, keys)
+		return '\tx, y, z, w = x*' + s + ' + ox, y*' + s + ' + oy, z*' + s + ' + oz, w*' + s + ' + ow\n'
 
 	def glsl(self):
 		ret_str = ''
@@ -164,6 +354,15 @@ class FoldScaleOrigin:
 			ret_str += '\tp += o;\n'
 		return ret_str
 
+	def glsl_grad(self):
+		ret_str = ''
+		if self.s != 1.0:
+			s = float_str(self.s)
+			ret_str += '\tJ = J*' + s + ';if (p.w*' + s + ' < 0.0) { J[3] = -J[3]; }J += oJ;\n'
+		else:
+			ret_str += '\tJ += oJ;\n'
+		return ret_str + self.glsl()
+
 class FoldBox:
 	def __init__(self, r=(1.0,1.0,1.0)):
 		self.r = set_global_vec3(r)
@@ -181,9 +380,36 @@ class FoldBox:
 		if p[1] > r[1]: q[1] = 2*r[1] - q[1]
 		if p[2] > r[2]: q[2] = 2*r[2] - q[2]
 
+	def fold_batch(self, p):
+		r = get_global(self.r)
+		p[:,:3] = np.clip(p[:,:3], -r, r)*2 - p[:,:3]
+
+	def unfold_batch(self, p, q):
+		r = get_global(self.r)
+		for i in range(3):
+			m = p[:,i] < -r[i]
+			q[m,i] = -2*r[i] - q[m,i]
+			m = p[:,i] > r[i]
+			q[m,i] = 2*r[i] - q[m,i]
+
+	def fold_grad_batch(self, p, J):
+		r = get_global(self.r)
+		J[:,:3] *= np.where(np.abs(p[:,:3]) > r, -1.0, 1.0)[:,:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		r = py_vec3(self.r, keys)
+		s = ''
+		for i, c in enumerate('xyz'):
+			s += '\t' + c + ' = min(max(' + c + ', -' + r[i] + '), ' + r[i] + ')*2.0 - ' + c + '\n'
+		return s
+
 	def glsl(self):
 		return '\tboxFold(p,' + vec3_str(self.r) + ');\n'
 
+	def glsl_grad(self):
+		return '\tboxFold(p, J, ' + vec3_str(self.r) + ');\n'
+
 class FoldSphere:
 	def __init__(self, min_r=0.5, max_r=1.0):
 		self.min_r = set_global_float(min_r)
@@ -201,9 +427,41 @@ class FoldSphere:
 		r2 = np.dot(p[:3], p[:3])
 		q[:] /= max(max_r / max(min_r, r2), 1.0)
 
+	def fold_batch(self, p):
+		max_r = get_global(self.max_r)
+		min_r = get_global(self.min_r)
+		r2 = np.einsum('ij,ij->i', p[:,:3], p[:,:3])
+		p *= np.maximum(max_r / np.maximum(min_r, r2), 1.0)[:,None]
+
+	def unfold_batch(self, p, q):
+		max_r = get_global(self.max_r)
+		min_r = get_global(self.min_r)
+		r2 = np.einsum('ij,ij->i', p[:,:3], p[:,:3])
+		q /= np.maximum(max_r / np.maximum(min_r, r2), 1.0)[:,None]
+
+	def fold_grad_batch(self, p, J):
+		max_r = get_global(self.max_r)
+		min_r = get_global(self.min_r)
+		r2 = np.einsum('ij,ij->i', p[:,:3], p[:,:3])
+		k = np.maximum(max_r / np.maximum(min_r, r2), 1.0)
+		#Between the radii the scale depends on the point itself
+		m = (r2 > min_r) & (r2 < max_r)
+		dk = -2.0 * (k[m] / r2[m])[:,None] * np.einsum('ni,nij->nj', p[m,:3], J[m,:3])
+		J *= k[:,None,None]
+		J[m] += p[m][:,:,None] * dk[:,None,:]
+		p *= k[:,None]
+
+	def py(self, keys):
+		s = '\ta = max(' + py_float(self.max_r, keys) + ' / max(' + py_float(self.min_r, keys) + ', x*x + y*y + z*z), 1.0)\n'
+		s += '\tx *= a\n\ty *= a\n\tz *= a\n\tw *= a\n'
+		return s
+
 	def glsl(self):
 		return '\tsphereFold(p,' + float_str(self.min_r) + ',' + float_str(self.max_r) + ');\n'
 
+	def glsl_grad(self):
+		return '\tsphereFold(p, J, ' + float_str(self.min_r) + ', ' + float_str(self.max_r) + ');\n'
+
 class FoldInversion:
 	def __init__(self, epsilon=1e-12):
 		self.epsilon = set_global_float(epsilon)
@@ -216,70 +474,187 @@ class FoldInversion:
 		epsilon = get_global(self.epsilon)
 		q[:] *= (np.dot(p[:3], p[:3]) + epsilon)
 
+	def fold_batch(self, p):
+		epsilon = get_global(self.epsilon)
+		p *= (1.0 / (np.einsum('ij,ij->i', p[:,:3], p[:,:3]) + epsilon))[:,None]
+
+	def unfold_batch(self, p, q):
+		epsilon = get_global(self.epsilon)
+		q *= (np.einsum('ij,ij->i', p[:,:3], p[:,:3]) + epsilon)[:,None]
+
+	def fold_grad_batch(self, p, J):
+		epsilon = get_global(self.epsilon)
+		k = 1.0 / (np.einsum('ij,ij->i', p[:,:3], p[:,:3]) + epsilon)
+		dk = -2.0 * (k * k)[:,None] * np.einsum('ni,nij->nj', p[:,:3], J[:,:3])
+		J *= k[:,None,None]
+		J += p[:,:,None] * dk[:,None,:]
+		p *= k[:,None]
+
+	def py(self, keys):
+		s = '\ta = 1.0 / (x*x + y*y + z*z + ' + py_float(self.epsilon, keys) + ')\n'
+		s += '\tx *= a\n\ty *= a\n\tz *= a\n\tw *= a\n'
+		return s
+
 	def glsl(self):
 		return '\tp *= 1.0 / (dot(p.xyz, p.xyz) + ' + float_str(self.epsilon) + ');\n'
 
+	def glsl_grad(self):
+		return '\tinversionFold(p, J, ' + float_str(self.epsilon) + ');\n'
+
 class FoldRotateX:
 	def __init__(self, a):
 		self.a = set_global_float(a)
+		#Keyed angles get their sine and cosine as params, updated only when the angle changes
+		if type(self.a) is str:
+			self.sin, self.cos = set_global_derived(self.a, 'sin'), set_global_derived(self.a, 'cos')
+		else:
+			self.sin, self.cos = math.sin(self.a), math.cos(self.a)
 
 	def fold(self, p):
-		a = get_global(self.a)
-		s,c = math.sin(a), math.cos(a)
+		s, c = get_global(self.sin), get_global(self.cos)
 		p[1], p[2] = (c*p[1] + s*p[2]), (c*p[2] - s*p[1])
 
 	def unfold(self, p, q):
-		a = get_global(self.a)
-		s,c = math.sin(-a), math.cos(-a)
+		s, c = -get_global(self.sin), get_global(self.cos)
 		q[1], q[2] = (c*q[1] + s*q[2]), (c*q[2] - s*q[1])
 
+	def fold_batch(self, p):
+		s, c = get_global(self.sin), get_global(self.cos)
+		p[:,1], p[:,2] = (c*p[:,1] + s*p[:,2]), (c*p[:,2] - s*p[:,1])
+
+	def unfold_batch(self, p, q):
+		s, c = -get_global(self.sin), get_global(self.cos)
+		q[:,1], q[:,2] = (c*q[:,1] + s*q[:,2]), (c*q[:,2] - s*q[:,1])
+
+	def fold_grad_batch(self, p, J):
+		s, c = get_global(self.sin), get_global(self.cos)
+		J[:,1], J[:,2] = (c*J[:,1] + s*J[:,2]), (c*J[:,2] - s*J[:,1])
+		self.fold_batch(p)
+
+	def py(self, keys):
+		s, c = py_float(self.sin, keys), py_float(self.cos, keys)
+		return '\ty, z = ' + c + '*y + ' + s + '*z, ' + c + '*z - ' + s + '*y\n'
+
 	def glsl(self):
-		if isinstance(self.a, (float, int)):
-			return '\trotX(p, ' + float_str(math.sin(self.a)) + ', ' + float_str(math.cos(self.a)) + ');\n'
-		else:
-			return '\trotX(p, ' + float_str(self.a) + ');\n'
+		return '\trotX(p, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
+
+	def glsl_grad(self):
+		return '\trotX(p, J, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
 
 class FoldRotateY:
 	def __init__(self, a):
 		self.a = set_global_float(a)
+		if type(self.a) is str:
+			self.sin, self.cos = set_global_derived(self.a, 'sin'), set_global_derived(self.a, 'cos')
+		else:
+			self.sin, self.cos = math.sin(self.a), math.cos(self.a)
 
 	def fold(self, p):
-		a = get_global(self.a)
-		s,c = math.sin(a), math.cos(a)
+		s, c = get_global(self.sin), get_global(self.cos)
 		p[2], p[0] = (c*p[2] + s*p[0]), (c*p[0] - s*p[2])
 
 	def unfold(self, p, q):
-		a = get_global(self.a)
-		s,c = math.sin(-a), math.cos(-a)
+		s, c = -get_global(self.sin), get_global(self.cos)
 		q[2], q[0] = (c*q[2] + s*q[0]), (c*q[0] - s*q[2])
 
+	def fold_batch(self, p):
+		s, c = get_global(self.sin), get_global(self.cos)
+		p[:,2], p[:,0] = (c*p[:,2] + s*p[:,0]), (c*p[:,0] - s*p[:,2])
+
+	def unfold_batch(self, p, q):
+		s, c = -get_global(self.sin), get_global(self.cos)
+		q[:,2], q[:,0] = (c*q[:,2] + s*q[:,0]), (c*q[:,0] - s*q[:,2])
+
+	def fold_grad_batch(self, p, J):
+		s, c = get_global(self.sin), get_global(self.cos)
+		J[:,2], J[:,0] = (c*J[:,2] + s*J[:,0]), (c*J[:,0] - s*J[:,2])
+		self.fold_batch(p)
+
+	def py(self, keys):
+		s, c = py_float(self.sin, keys), py_float(self.cos, keys)
+		return '\tz, x = ' + c + '*z + ' + s + '*x, ' + c + '*x - ' + s + '*z\n'
+
 	def glsl(self):
-		if isinstance(self.a, (float, int)):
-			return '\trotY(p, ' + float_str(math.sin(self.a)) + ', ' + float_str(math.cos(self.a)) + ');\n'
-		else:
-			return '\trotY(p, ' + float_str(self.a) + ');\n'
+		return '\trotY(p, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
+
+	def glsl_grad(self):
+		return '\trotY(p, J, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
 
 class FoldRotateZ:
 	def __init__(self, a):
 		self.a = set_global_float(a)
+		if type(self.a) is str:
+			self.sin, self.cos = set_global_derived(self.a, 'sin'), set_global_derived(self.a, 'cos')
+		else:
+			self.sin, self.cos = math.sin(self.a), math.cos(self.a)
 
 	def fold(self, p):
-		a = get_global(self.a)
-		s,c = math.sin(a), math.cos(a)
+		s, c = get_global(self.sin), get_global(self.cos)
 		p[0], p[1] = (c*p[0] + s*p[1]), (c*p[1] - s*p[0])
 
 	def unfold(self, p, q):
-		a = get_global(self.a)
-		s,c = math.sin(-a), math.cos(-a)
+		s, c = -get_global(self.sin), get_global(self.cos)
 		q[0], q[1] = (c*q[0] + s*q[1]), (c*q[1] - s*q[0])
 
+	def fold_batch(self, p):
+		s, c = get_global(self.sin), get_global(self.cos)
+		p[:,0], p[:,1] = (c*p[:,0] + s*p[:,1]), (c*p[:,1] - s*p[:,0])
+
+	def unfold_batch(self, p, q):
+		s, c = -get_global(self.sin), get_global(self.cos)
+		q[:,0], q[:,1] = (c*q[:,0] + s*q[:,1]), (c*q[:,1] - s*q[:,0])
+
+	def fold_grad_batch(self, p, J):
+		s, c = get_global(self.sin), get_global(self.cos)
+		J[:,0], J[:,1] = (c*J[:,0] + s*J[:,1]), (c*J[:,1] - s*J[:,0])
+		self.fold_batch(p)
+
+	def py(self, keys):
+		s, c = py_float(self.sin, keys), py_float(self.cos, keys)
+		return '\tx, y = ' + c + '*x + ' + s + '*y, ' + c + '*y - ' + s + '*x\n'
+
 	def glsl(self):
-		if isinstance(self.a, (float, int)):
-			return '\trotZ(p, ' + float_str(math.sin(self.a)) + ', ' + float_str(math.cos(self.a)) + ');\n'
-		else:
-			return '\trotZ(p, ' + float_str(self.a) + ');\n'
+		return '\trotZ(p, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
+
+	def glsl_grad(self):
+		return '\trotZ(p, J, ' + float_str(self.sin) + ', ' + float_str(self.cos) + ');\n'
+
+class FoldMatrix:
+	def __init__(self, m):
+		self.m = np.array(m, dtype=np.float64).reshape((3,3))
+
+	def fold(self, p):
+		p[:3] = np.dot(self.m, p[:3])
+
+	def unfold(self, p, q):
+		q[:3] = np.dot(self.m.T, q[:3])
+
+	def fold_batch(self, p):
+		p[:,:3] = np.dot(p[:,:3], self.m.T)
+
+	def unfold_batch(self, p, q):
+		q[:] = np.dot(q, self.m)
+
+	def fold_grad_batch(self, p, J):
+		J[:,:3] = np.einsum('ij,njk->nik', self.m, J[:,:3])
+		self.fold_batch(p)
+
+	def py(self, keys):
+		m = [[repr(float(self.m[i,j])) for j in range(3)] for i in range(3)]
+		rows = [m[i][0] + '*x + ' + m[i][1] + '*y + ' + m[i][2] + '*z' for i in range(3)]
+		return '\tx, y, z = ' + ', '.join(rows) + '\n'
+
+	def glsl(self):
+		cols = [float_str(float(self.m[i,j])) for j in range(3) for i in range(3)]
+		return '\tp.xyz = mat3(' + ','.join(cols) + ') * p.xyz;\n'
+
+	def glsl_grad(self):
+		cols = [float_str(float(self.m[i,j])) for j in range(3) for i in range(3)]
+		return '\tmatrixFold(p, J, mat3(' + ','.join(cols) + '));\n'
 
 class FoldRepeatX:
+	unbounded = True
+
 	def __init__(self, m):
 		self.m = set_global_float(m)
 
@@ -293,10 +668,35 @@ class FoldRepeatX:
 		if a < 0.0: q[0] = -q[0]
 		q[0] += p[0] - a
 
+	def fold_batch(self, p):
+		m = get_global(self.m)
+		p[:,0] = np.abs((p[:,0] - m/2) % m - m/2)
+
+	def unfold_batch(self, p, q):
+		m = get_global(self.m)
+		a = (p[:,0] - m/2) % m - m/2
+		q[a < 0.0,0] *= -1
+		q[:,0] += p[:,0] - a
+
+	def fold_grad_batch(self, p, J):
+		m = get_global(self.m)
+		J[:,0] *= np.where((p[:,0] - m/2) % m - m/2 < 0.0, -1.0, 1.0)[:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		m = py_float(self.m, keys)
+		return '\tx = abs((x - ' + m + '/2) % ' + m + ' - ' + m + '/2)\n'
+
 	def glsl(self):
 		return '\tp.x = abs(mod(p.x - ' + float_str(self.m) + '/2,' + float_str(self.m) + ') - ' + float_str(self.m) + '/2);\n'
 
+	def glsl_grad(self):
+		m = float_str(self.m)
+		return '\tif (mod(p.x - ' + m + '/2,' + m + ') - ' + m + '/2 < 0.0) { J[0] = -J[0]; }\n' + self.glsl()
+
 class FoldRepeatY:
+	unbounded = True
+
 	def __init__(self, m):
 		self.m = set_global_float(m)
 
@@ -310,10 +710,35 @@ class FoldRepeatY:
 		if a < 0.0: q[1] = -q[1]
 		q[1] += p[1] - a
 
+	def fold_batch(self, p):
+		m = get_global(self.m)
+		p[:,1] = np.abs((p[:,1] - m/2) % m - m/2)
+
+	def unfold_batch(self, p, q):
+		m = get_global(self.m)
+		a = (p[:,1] - m/2) % m - m/2
+		q[a < 0.0,1] *= -1
+		q[:,1] += p[:,1] - a
+
+	def fold_grad_batch(self, p, J):
+		m = get_global(self.m)
+		J[:,1] *= np.where((p[:,1] - m/2) % m - m/2 < 0.0, -1.0, 1.0)[:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		m = py_float(self.m, keys)
+		return '\ty = abs((y - ' + m + '/2) % ' + m + ' - ' + m + '/2)\n'
+
 	def glsl(self):
 		return '\tp.y = abs(mod(p.y - ' + float_str(self.m) + '/2,' + float_str(self.m) + ') - ' + float_str(self.m) + '/2);\n'
 
+	def glsl_grad(self):
+		m = float_str(self.m)
+		return '\tif (mod(p.y - ' + m + '/2,' + m + ') - ' + m + '/2 < 0.0) { J[1] = -J[1]; }\n' + self.glsl()
+
 class FoldRepeatZ:
+	unbounded = True
+
 	def __init__(self, m):
 		self.m = set_global_float(m)
 
@@ -327,10 +752,35 @@ class FoldRepeatZ:
 		if a < 0.0: q[2] = -q[2]
 		q[2] += p[2] - a
 
+	def fold_batch(self, p):
+		m = get_global(self.m)
+		p[:,2] = np.abs((p[:,2] - m/2) % m - m/2)
+
+	def unfold_batch(self, p, q):
+		m = get_global(self.m)
+		a = (p[:,2] - m/2) % m - m/2
+		q[a < 0.0,2] *= -1
+		q[:,2] += p[:,2] - a
+
+	def fold_grad_batch(self, p, J):
+		m = get_global(self.m)
+		J[:,2] *= np.where((p[:,2] - m/2) % m - m/2 < 0.0, -1.0, 1.0)[:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		m = py_float(self.m, keys)
+		return '\tz = abs((z - ' + m + '/2) % ' + m + ' - ' + m + '/2)\n'
+
 	def glsl(self):
 		return '\tp.z = abs(mod(p.z - ' + float_str(self.m) + '/2,' + float_str(self.m) + ') - ' + float_str(self.m) + '/2);\n'
 
+	def glsl_grad(self):
+		m = float_str(self.m)
+		return '\tif (mod(p.z - ' + m + '/2,' + m + ') - ' + m + '/2 < 0.0) { J[2] = -J[2]; }\n' + self.glsl()
+
 class FoldRepeatXYZ:
+	unbounded = True
+
 	def __init__(self, m):
 		self.m = set_global_float(m)
 
@@ -346,5 +796,34 @@ class FoldRepeatXYZ:
 		if a[2] < 0.0: q[2] = -q[2]
 		q[:3] += p[:3] - a
 
+	def fold_batch(self, p):
+		m = get_global(self.m)
+		p[:,:3] = np.abs((p[:,:3] - m/2) % m - m/2)
+
+	def unfold_batch(self, p, q):
+		m = get_global(self.m)
+		a = (p[:,:3] - m/2) % m - m/2
+		q[a < 0.0] *= -1
+		q += p[:,:3] - a
+
+	def fold_grad_batch(self, p, J):
+		m = get_global(self.m)
+		J[:,:3] *= np.where((p[:,:3] - m/2) % m - m/2 < 0.0, -1.0, 1.0)[:,:,None]
+		self.fold_batch(p)
+
+	def py(self, keys):
+		m = py_float(self.m, keys)
+		s = ''
+		for c in 'xyz':
+			s += '\t' + c + ' = abs((' + c + ' - ' + m + '/2) % ' + m + ' - ' + m + '/2)\n'
+		return s
+
 	def glsl(self):
 		return '\tp.xyz = abs(mod(p.xyz - ' + float_str(self.m) + '/2,' + float_str(self.m) + ') - ' + float_str(self.m) + '/2);\n'
+
+	def glsl_grad(self):
+		m = float_str(self.m)
+		ret_str = ''
+		for i, c in enumerate('xyz'):
+			ret_str += '\tif (mod(p.' + c + ' - ' + m + '/2,' + m + ') - ' + m + '/2 < 0.0) { J[' + str(i) + '] = -J[' + str(i) + ']; }\n'
+		return ret_str + self.glsl()
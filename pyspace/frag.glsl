@@ -5,6 +5,8 @@ uniform mat4 iMat;
 uniform mat4 iPrevMat;
 uniform vec2 iResolution;
 uniform float iIPD;
+uniform vec4 iJitter;
+uniform sampler2D iConeDepth;
 
 // [pydefine]
 // [/pydefine]
@@ -12,7 +14,16 @@ uniform float iIPD;
 // [pyvars]
 // [/pyvars]
 
-const float FOCAL_DIST = 1.0 / tan(M_PI * FIELD_OF_VIEW / 360.0);
+#if PROGRESSIVE_ENABLED
+	#define AA_SAMPLES 1
+#else
+	#define AA_SAMPLES ANTIALIASING_SAMPLES
+#endif
+
+#define CONE_PREPASS_ACTIVE (CONE_PREPASS_BLOCK > 0 && !ODS && !ORTHOGONAL_PROJECTION)
+
+//A macro rather than a const so FIELD_OF_VIEW can be a live uniform
+#define FOCAL_DIST (1.0 / tan(M_PI * FIELD_OF_VIEW / 360.0))
 
 float rand(float s, float minV, float maxV) {
 	float r = sin(s*s*27.12345 + 1000.9876 / (s*s + 1e-5));
@@ -77,6 +88,94 @@ void rotZ(inout vec4 z, float a) {
 	rotZ(z, sin(a), cos(a));
 }
 
+//Forward mode versions, column i of J is the gradient of z[i] with respect to the origin
+void planeFold(inout vec4 z, inout mat4x3 J, vec3 n, float d) {
+	if (dot(z.xyz, n) < d) {
+		vec3 g = mat3(J) * n;
+		J[0] -= 2.0 * n.x * g;
+		J[1] -= 2.0 * n.y * g;
+		J[2] -= 2.0 * n.z * g;
+	}
+	planeFold(z, n, d);
+}
+void absFold(inout vec4 z, inout mat4x3 J, vec3 c) {
+	if (z.x < c.x) { J[0] = -J[0]; }
+	if (z.y < c.y) { J[1] = -J[1]; }
+	if (z.z < c.z) { J[2] = -J[2]; }
+	absFold(z, c);
+}
+void sierpinskiFold(inout vec4 z, inout mat4x3 J) {
+	vec3 t;
+	if (z.x + z.y < 0.0) { t = J[0]; J[0] = -J[1]; J[1] = -t; }
+	z.xy -= min(z.x + z.y, 0.0);
+	if (z.x + z.z < 0.0) { t = J[0]; J[0] = -J[2]; J[2] = -t; }
+	z.xz -= min(z.x + z.z, 0.0);
+	if (z.y + z.z < 0.0) { t = J[1]; J[1] = -J[2]; J[2] = -t; }
+	z.yz -= min(z.y + z.z, 0.0);
+}
+void mengerFold(inout vec4 z, inout mat4x3 J) {
+	vec3 t;
+	if (z.x < z.y) { t = J[0]; J[0] = J[1]; J[1] = t; z.xy = z.yx; }
+	if (z.x < z.z) { t = J[0]; J[0] = J[2]; J[2] = t; z.xz = z.zx; }
+	if (z.y < z.z) { t = J[1]; J[1] = J[2]; J[2] = t; z.yz = z.zy; }
+}
+void sphereFold(inout vec4 z, inout mat4x3 J, float minR, float maxR) {
+	float r2 = dot(z.xyz, z.xyz);
+	float k = max(maxR / max(minR, r2), 1.0);
+	vec3 dr2 = 2.0 * (mat3(J) * z.xyz);
+	J *= k;
+	if (r2 > minR && r2 < maxR) {
+		J -= outerProduct(dr2 * (k / r2), z);
+	}
+	z *= k;
+}
+void inversionFold(inout vec4 z, inout mat4x3 J, float eps) {
+	float k = 1.0 / (dot(z.xyz, z.xyz) + eps);
+	vec3 dr2 = 2.0 * (mat3(J) * z.xyz);
+	J = J*k - outerProduct(dr2 * (k*k), z);
+	z *= k;
+}
+void boxFold(inout vec4 z, inout mat4x3 J, vec3 r) {
+	if (abs(z.x) > r.x) { J[0] = -J[0]; }
+	if (abs(z.y) > r.y) { J[1] = -J[1]; }
+	if (abs(z.z) > r.z) { J[2] = -J[2]; }
+	boxFold(z, r);
+}
+void matrixFold(inout vec4 z, inout mat4x3 J, mat3 m) {
+	mat3 j = mat3(J) * transpose(m);
+	J[0] = j[0];
+	J[1] = j[1];
+	J[2] = j[2];
+	z.xyz = m * z.xyz;
+}
+void rotX(inout vec4 z, inout mat4x3 J, float s, float c) {
+	vec3 t = J[1];
+	J[1] = c*t + s*J[2];
+	J[2] = c*J[2] - s*t;
+	rotX(z, s, c);
+}
+void rotY(inout vec4 z, inout mat4x3 J, float s, float c) {
+	vec3 t = J[0];
+	J[0] = c*t - s*J[2];
+	J[2] = c*J[2] + s*t;
+	rotY(z, s, c);
+}
+void rotZ(inout vec4 z, inout mat4x3 J, float s, float c) {
+	vec3 t = J[0];
+	J[0] = c*t + s*J[1];
+	J[1] = c*J[1] - s*t;
+	rotZ(z, s, c);
+}
+void rotX(inout vec4 z, inout mat4x3 J, float a) {
+	rotX(z, J, sin(a), cos(a));
+}
+void rotY(inout vec4 z, inout mat4x3 J, float a) {
+	rotY(z, J, sin(a), cos(a));
+}
+void rotZ(inout vec4 z, inout mat4x3 J, float a) {
+	rotZ(z, J, sin(a), cos(a));
+}
+
 //##########################################
 //
 //   Primative distance estimators
@@ -106,6 +205,51 @@ float de_inf_line(vec4 p, vec3 n, float r) {
 	return (length(p.xyz - n*dot(p.xyz, n)) - r) / p.w;
 }
 
+//Forward mode versions, g is the gradient of f(p.xyz)/p.w given the gradient df of f
+float de_grad(vec4 p, mat4x3 J, float f, vec3 df, out vec3 g) {
+	float d = f / p.w;
+	g = (mat3(J) * df - d * J[3]) / p.w;
+	return d;
+}
+float de_sphere(vec4 p, float r, mat4x3 J, out vec3 g) {
+	return de_grad(p, J, length(p.xyz) - r, normalize(p.xyz), g);
+}
+float de_box(vec4 p, vec3 s, mat4x3 J, out vec3 g) {
+	vec3 a = abs(p.xyz) - s;
+	float m = max(max(a.x, a.y), a.z);
+	vec3 df = (a.x == m ? vec3(1,0,0) : (a.y == m ? vec3(0,1,0) : vec3(0,0,1)));
+	if (m > 0.0) { df = normalize(max(a, 0.0)); }
+	return de_grad(p, J, min(m, 0.0) + length(max(a, 0.0)), df * sign(p.xyz), g);
+}
+float de_tetrahedron(vec4 p, float r, mat4x3 J, out vec3 g) {
+	vec3 n = vec3(-1,-1,-1);
+	float md = -p.x - p.y - p.z;
+	if (p.x + p.y - p.z > md) { md = p.x + p.y - p.z; n = vec3(1,1,-1); }
+	if (-p.x + p.y + p.z > md) { md = -p.x + p.y + p.z; n = vec3(-1,1,1); }
+	if (p.x - p.y + p.z > md) { md = p.x - p.y + p.z; n = vec3(1,-1,1); }
+	return de_grad(p, J, (md - r) / sqrt(3.0), n / sqrt(3.0), g);
+}
+float de_inf_cross(vec4 p, float r, mat4x3 J, out vec3 g) {
+	vec3 q = p.xyz * p.xyz;
+	vec3 m = vec3(1,1,0);
+	float s = q.x + q.y;
+	if (q.x + q.z < s) { s = q.x + q.z; m = vec3(1,0,1); }
+	if (q.y + q.z < s) { s = q.y + q.z; m = vec3(0,1,1); }
+	float l = sqrt(s);
+	return de_grad(p, J, l - r, p.xyz * m / l, g);
+}
+float de_inf_cross_xy(vec4 p, float r, mat4x3 J, out vec3 g) {
+	vec3 q = p.xyz * p.xyz;
+	vec3 m = (q.x <= q.y ? vec3(1,0,1) : vec3(0,1,1));
+	float l = sqrt(min(q.x, q.y) + q.z);
+	return de_grad(p, J, l - r, p.xyz * m / l, g);
+}
+float de_inf_line(vec4 p, vec3 n, float r, mat4x3 J, out vec3 g) {
+	vec3 v = p.xyz - n*dot(p.xyz, n);
+	float l = length(v);
+	return de_grad(p, J, l - r, (v - n*dot(v, n)) / l, g);
+}
+
 //##########################################
 //
 //   Compiled
@@ -120,24 +264,81 @@ float de_inf_line(vec4 p, vec3 n, float r) {
 //   Main code
 //
 //##########################################
+float skipped_steps(float d0, float d1, float len) {
+	//Estimates the steps a march takes over a length of ray with the DE linear between d0 and d1
+	d0 = max(d0, MIN_DIST);
+	d1 = max(d1, MIN_DIST);
+	float g = (d0 - d1) / len;
+	if (g >= 1.0) {
+		return 1.0;
+	} else if (g < 1e-3) {
+		return 2.0 * len / (d0 + d1);
+	}
+	return log(d1 / d0) / log(1.0 - g);
+}
 vec4 ray_march(inout vec4 p, vec4 ray, float sharpness, float td) {
-	//March the ray
+	//March the ray, over-relaxing steps by omega until that overshoots once
 	float d = MIN_DIST;
 	float s = 0.0;
 	float min_d = 1.0;
+	float omega = RELAXATION_OMEGA;
+	float step = 0.0;
+	float prev_d = 0.0;
+	float max_td = MAX_DIST;
+	float skipped = 0.0;
+	float skip_len = 0.0;
+	float skip_d = 0.0;
+	#if defined(BOUNDING_SPHERE) && !GLOW_ENABLED
+		//Only march the part of the ray inside the scene's bounding sphere,
+		//glow needs the closest approach of every ray so then all of them are marched
+		vec3 oc = p.xyz - BOUNDING_SPHERE.xyz;
+		float b = dot(oc, ray.xyz);
+		float h = b*b - dot(oc, oc) + BOUNDING_SPHERE.w*BOUNDING_SPHERE.w;
+		if (h < 0.0 || sqrt(h) < b) {
+			return vec4(1e20, 0.0, MAX_DIST, 1.0);
+		}
+		float enter = max(-b - sqrt(h), 0.0);
+		max_td = min(max_td, td - b + sqrt(h));
+		if (enter > 0.0) {
+			skip_len = enter;
+			skip_d = DE(p);
+		}
+		td += enter;
+		p += ray * enter;
+	#endif
 	for (; s < MAX_MARCHES; s += 1.0) {
 		d = DE(p);
+		if (skip_len > 0.0) {
+			//Ambient occlusion still counts the steps of the skipped part
+			skipped = skipped_steps(skip_d, d, skip_len);
+			skip_len = 0.0;
+		}
+		if (omega > 1.0 && d + prev_d < step) {
+			//The unbounding spheres don't overlap, go back to a regular step
+			step -= omega * step;
+			omega = 1.0;
+			td += step;
+			p += ray * step;
+			continue;
+		}
 		if (d < MIN_DIST) {
 			s += d / MIN_DIST;
 			break;
-		} else if (td > MAX_DIST) {
+		} else if (td > max_td) {
+			if (td < MAX_DIST) {
+				//Left the bounding sphere, so nothing can be hit anymore
+				d = 1e20;
+				td = MAX_DIST;
+			}
 			break;
 		}
-		td += d;
-		p += ray * d;
+		step = d * omega;
+		prev_d = d;
+		td += step;
+		p += ray * step;
 		min_d = min(min_d, sharpness * d / td);
 	}
-	return vec4(d, s, td, min_d);
+	return vec4(d, s + skipped, td, min_d);
 }
 vec4 ray_march(inout vec4 p, vec3 ray, float sharpness, float td) {
 	return ray_march(p, vec4(ray, 0.0), sharpness, td);
@@ -146,20 +347,26 @@ vec4 ray_march(inout vec4 p, vec3 ray, float sharpness, float td) {
 //A faster formula to find the gradient/normal direction of the DE(the w component is the average DE)
 //credit to http://www.iquilezles.org/www/articles/normalsSDF/normalsSDF.htm
 vec3 calcNormal(vec4 p, float dx) {
-	const vec3 k = vec3(1,-1,0);
-	return normalize(k.xyy*DE(p + k.xyyz*dx) +
-					 k.yyx*DE(p + k.yyxz*dx) +
-					 k.yxy*DE(p + k.yxyz*dx) +
-					 k.xxx*DE(p + k.xxxz*dx));
+	#if ANALYTIC_NORMALS
+		vec3 g;
+		DE_GRAD(p, mat4x3(1,0,0, 0,1,0, 0,0,1, 0,0,0), g);
+		return normalize(g);
+	#else
+		const vec3 k = vec3(1,-1,0);
+		return normalize(k.xyy*DE(p + k.xyyz*dx) +
+						 k.yyx*DE(p + k.yyxz*dx) +
+						 k.yxy*DE(p + k.yxyz*dx) +
+						 k.xxx*DE(p + k.xxxz*dx));
+	#endif
 }
 
-vec4 scene(inout vec4 origin, inout vec4 ray, float vignette, float td) {
-	//Trace the ray
-	vec4 p = origin;
-	vec4 d_s_td_m = ray_march(p, ray, GLOW_SHARPNESS, td);
+vec4 scene(inout vec4 origin, inout vec4 ray, float vignette, vec2 start) {
+	//Trace the ray, skipping the distance and steps already covered by the cone prepass
+	vec4 p = origin + ray * start.x;
+	vec4 d_s_td_m = ray_march(p, ray, GLOW_SHARPNESS, start.x);
 	float d = d_s_td_m.x;
-	float s = d_s_td_m.y;
-	td = d_s_td_m.z;
+	float s = d_s_td_m.y + start.y;
+	float td = d_s_td_m.z;
 	float m = d_s_td_m.w;
 
 	//Determine the color for this pixel
@@ -238,84 +445,141 @@ vec4 scene(inout vec4 origin, inout vec4 ray, float vignette, float td) {
 	return vec4(col, td);
 }
 
+//Gets the ray origin and direction for a fragment and returns its screen position
+vec2 camera_ray(mat4 mat, vec2 frag, vec2 delta, vec4 dxy, out vec4 p, out vec4 ray) {
+	#if ODS
+		//Get the normalized screen coordinate
+		vec2 screen_pos;
+		float scale;
+		vec2 ods_coord = vec2(frag.x, frag.y * 2);
+		if (ods_coord.y < iResolution.y) {
+			screen_pos = (ods_coord + delta) / iResolution.xy;
+			scale = -iIPD*0.5;
+		} else {
+			screen_pos = (ods_coord - vec2(0, iResolution.y) + delta) / iResolution.xy;
+			scale = iIPD*0.5;
+		}
+		float theta = -2*M_PI*screen_pos.x;
+		float phi = -0.5*M_PI + screen_pos.y*M_PI;
+		scale *= cos(phi);
+		p = mat[3] - mat * vec4(cos(theta) * scale, 0, sin(theta) * scale, 0);
+		ray = mat * vec4(sin(theta)*cos(phi), sin(phi), cos(theta)*cos(phi), 0);
+	#else
+		//Get normalized screen coordinate
+		vec2 screen_pos = (frag + delta) / iResolution.xy;
+		vec2 uv = 2*screen_pos - 1;
+		uv.x *= iResolution.x / iResolution.y;
+
+		//Convert screen coordinate to 3d ray
+		#if ORTHOGONAL_PROJECTION
+			ray = vec4(0.0, 0.0, -FOCAL_DIST, 0.0);
+			ray = mat * normalize(ray);
+		#else
+			ray = normalize(vec4(uv.x, uv.y, -FOCAL_DIST, 0.0));
+			ray = mat * normalize(ray * DEPTH_OF_FIELD_DISTANCE + dxy);
+		#endif
+
+		//Cast the first ray
+		#if ORTHOGONAL_PROJECTION
+			p = mat[3] + mat * vec4(uv.x, uv.y, 0.0, 0.0) * ORTHOGONAL_ZOOM;
+		#else
+			p = mat[3] - mat * dxy;
+		#endif
+	#endif
+	return screen_pos;
+}
+
+#ifdef CONE_PASS
+//Marches one cone per block of pixels and outputs a distance that is safe for every ray
+//in the block, the number of steps a pixel would have needed to get there and the cost.
+void main() {
+	vec4 origin, ray;
+	camera_ray(iMat, gl_FragCoord.xy * CONE_PREPASS_BLOCK, vec2(0.0), vec4(0.0), origin, ray);
+
+	//Neighbor rays stay within a + b*t of the center ray, including sub-pixel and lens offsets
+	float a = DEPTH_OF_FIELD_STRENGTH * sqrt(2.0) / iResolution.x;
+	float b = (CONE_PREPASS_BLOCK + 1) * sqrt(2.0) / (iResolution.y * FOCAL_DIST) + a / DEPTH_OF_FIELD_DISTANCE;
+	vec4 p = origin;
+	float td = 0.0;
+	float cone_steps = 0.0;
+	for (; cone_steps < MAX_MARCHES; cone_steps += 1.0) {
+		float step = (DE(p) - a - b*td) / (1.0 + b);
+		if (step < MIN_DIST || td > MAX_DIST) {
+			break;
+		}
+		td += step;
+		p += ray * step;
+	}
+
+	//Ambient occlusion depends on the step count, so count the steps of a regular march
+	p = origin;
+	float t = 0.0;
+	float s = 0.0;
+	for (; s < MAX_MARCHES && t < td; s += 1.0) {
+		float d = DE(p);
+		t += d;
+		p += ray * d;
+	}
+	gl_FragColor = vec4(td, s, cone_steps + s, 0.0);
+}
+#else
 void main() {
 	vec4 col = vec4(0.0);
+	#if CONE_PREPASS_ACTIVE
+		vec2 cone_size = ceil(iResolution / CONE_PREPASS_BLOCK);
+		vec2 cone = texture2D(iConeDepth, (floor(gl_FragCoord.xy / CONE_PREPASS_BLOCK) + 0.5) / cone_size).xy;
+	#else
+		vec2 cone = vec2(0.0);
+	#endif
 	for (int k = 0; k < MOTION_BLUR_LEVEL + 1; ++k) {
-		for (int i = 0; i < ANTIALIASING_SAMPLES; ++i) {
-			for (int j = 0; j < ANTIALIASING_SAMPLES; ++j) {
+		for (int i = 0; i < AA_SAMPLES; ++i) {
+			for (int j = 0; j < AA_SAMPLES; ++j) {
 				mat4 mat = iMat;
 				#if MOTION_BLUR_LEVEL > 0
 					float a = MOTION_BLUR_RATIO * float(k) / (MOTION_BLUR_LEVEL + 1);
 					mat = iPrevMat*a + iMat*(1.0 - a);
 				#endif
 
-				vec2 delta = vec2(i, j) / ANTIALIASING_SAMPLES;
-				vec2 delta2 = vec2(rand(i,0,1), rand(j+0.1,0,1));
-				vec4 dxy = vec4(delta2.x, delta2.y, 0.0, 0.0) * DEPTH_OF_FIELD_STRENGTH / iResolution.x;
-
-				#if ODS
-					//Get the normalized screen coordinate
-					vec2 screen_pos;
-					float scale;
-					vec2 ods_coord = vec2(gl_FragCoord.x, gl_FragCoord.y * 2);
-					if (ods_coord.y < iResolution.y) {
-						screen_pos = (ods_coord + delta) / iResolution.xy;
-						scale = -iIPD*0.5;
-					} else {
-						screen_pos = (ods_coord - vec2(0, iResolution.y) + delta) / iResolution.xy;
-						scale = iIPD*0.5;
-					}
-					float theta = -2*M_PI*screen_pos.x;
-					float phi = -0.5*M_PI + screen_pos.y*M_PI;
-					scale *= cos(phi);
-					vec4 p = mat[3] - mat * vec4(cos(theta) * scale, 0, sin(theta) * scale, 0);
-					vec4 ray = mat * vec4(sin(theta)*cos(phi), sin(phi), cos(theta)*cos(phi), 0);
+				#if PROGRESSIVE_ENABLED
+					vec2 delta = iJitter.xy;
+					vec2 delta2 = iJitter.zw;
 				#else
-					//Get normalized screen coordinate
-					vec2 screen_pos = (gl_FragCoord.xy + delta) / iResolution.xy;
-					vec2 uv = 2*screen_pos - 1;
-					uv.x *= iResolution.x / iResolution.y;
-
-					//Convert screen coordinate to 3d ray
-					#if ORTHOGONAL_PROJECTION
-						vec4 ray = vec4(0.0, 0.0, -FOCAL_DIST, 0.0);
-						ray = mat * normalize(ray);
-					#else
-						vec4 ray = normalize(vec4(uv.x, uv.y, -FOCAL_DIST, 0.0));
-						ray = mat * normalize(ray * DEPTH_OF_FIELD_DISTANCE + dxy);
-					#endif
-
-					//Cast the first ray
-					#if ORTHOGONAL_PROJECTION
-						vec4 p = mat[3] + mat * vec4(uv.x, uv.y, 0.0, 0.0) * ORTHOGONAL_ZOOM;
-					#else
-						vec4 p = mat[3] - mat * dxy;
-					#endif
+					vec2 delta = vec2(i, j) / ANTIALIASING_SAMPLES;
+					vec2 delta2 = vec2(rand(i,0,1), rand(j+0.1,0,1));
 				#endif
+				vec4 dxy = vec4(delta2.x, delta2.y, 0.0, 0.0) * DEPTH_OF_FIELD_STRENGTH / iResolution.x;
+
+				vec4 p, ray;
+				vec2 screen_pos = camera_ray(mat, gl_FragCoord.xy, delta, dxy, p, ray);
+
+				//Only the unblurred sample matches the camera of the prepass
+				vec2 start = (k == 0 ? cone : vec2(0.0));
 
 				//Reflect light if needed
 				float vignette = 1.0 - VIGNETTE_STRENGTH * length(screen_pos - 0.5);
 				#if REFLECTION_LEVEL > 0
-					vec3 newCol = vec3(0.0);
+					vec4 newCol = vec4(0.0);
 					vec4 prevRay = ray;
 					float ref_alpha = 1.0;
 					for (int r = 0; r < REFLECTION_LEVEL + 1; ++r) {
 						ref_alpha *= REFLECTION_ATTENUATION;
-						newCol += ref_alpha * scene(p, ray, vignette, 0.0);
+						newCol += ref_alpha * scene(p, ray, vignette, start);
+						start = vec2(0.0);
 						if (ray == prevRay || r >= REFLECTION_LEVEL) {
 							break;
 						}
 					}
 					col += newCol;
 				#else
-					col += scene(p, ray, vignette, 0.0);
+					col += scene(p, ray, vignette, start);
 				#endif
 
 			}
 		}
 	}
 
-	col /= (ANTIALIASING_SAMPLES * ANTIALIASING_SAMPLES * (MOTION_BLUR_LEVEL + 1));
+	col /= (AA_SAMPLES * AA_SAMPLES * (MOTION_BLUR_LEVEL + 1));
 	gl_FragColor.rgb = clamp(col.xyz * EXPOSURE, 0.0, 1.0);
 	gl_FragDepth = min(col.w / MAX_DIST, 0.999);
 }
+#endif
@@ -13,17 +13,46 @@ class Sphere:
 		r = get_global(self.r)
 		return (np.linalg.norm(p[:3] - c) - r) / p[3]
 
+	def DE_batch(self, p):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		return (np.linalg.norm(p[:,:3] - c, axis=1) - r) / p[:,3]
+
+	def grad_batch(self, p, J):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		a = p[:,:3] - c
+		l = np.linalg.norm(a, axis=1)
+		return de_grad(l - r, a / np.maximum(l, 1e-20)[:,None], p, J)
+
 	def NP(self, p):
 		c = get_global(self.c)
 		r = get_global(self.r)
 		return normalize(p[:3] - c) * r + c
 
+	def NP_batch(self, p):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		return normalize_batch(p[:,:3] - c) * r + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		s = '\ta0, a1, a2 = x - ' + c[0] + ', y - ' + c[1] + ', z - ' + c[2] + '\n'
+		s += '\te = (sqrt(a0*a0 + a1*a1 + a2*a2) - ' + py_float(self.r, keys) + ') / w\n'
+		return s
+
 	def glsl(self):
 		return 'de_sphere(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ')'
 
+	def glsl_grad(self):
+		return 'de_sphere(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class Box:
 	def __init__(self, s=(1,1,1), c=(0,0,0), color=(1,1,1)):
 		self.s = set_global_vec3(s)
@@ -36,17 +65,55 @@ class Box:
 		a = np.abs(p[:3] - c) - s;
 		return (min(max(a[0], a[1], a[2]), 0.0) + np.linalg.norm(np.maximum(a,0.0))) / p[3]
 
+	def DE_batch(self, p):
+		c = get_global(self.c)
+		s = get_global(self.s)
+		a = np.abs(p[:,:3] - c) - s
+		return (np.minimum(np.max(a, axis=1), 0.0) + np.linalg.norm(np.maximum(a,0.0), axis=1)) / p[:,3]
+
+	def grad_batch(self, p, J):
+		c = get_global(self.c)
+		s = get_global(self.s)
+		a = p[:,:3] - c
+		q = np.abs(a) - s
+		mq = np.max(q, axis=1)
+		o = np.maximum(q, 0.0)
+		lo = np.linalg.norm(o, axis=1)
+		#Outside it points away from the closest point, inside away from the closest face
+		df = np.where((mq > 0.0)[:,None], o / np.maximum(lo, 1e-20)[:,None], np.eye(3, dtype=p.dtype)[np.argmax(q, axis=1)])
+		return de_grad(np.minimum(mq, 0.0) + lo, df * np.sign(a), p, J)
+
 	def NP(self, p):
 		c = get_global(self.c)
 		s = get_global(self.s)
 		return np.clip(p[:3] - c, -s, s) + c
 
+	def NP_batch(self, p):
+		c = get_global(self.c)
+		s = get_global(self.s)
+		return np.clip(p[:,:3] - c, -s, s) + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		b = py_vec3(self.s, keys)
+		s = '\ta0, a1, a2 = abs(x - ' + c[0] + ') - ' + b[0] + ', abs(y - ' + c[1] + ') - ' + b[1] + ', abs(z - ' + c[2] + ') - ' + b[2] + '\n'
+		s += '\te = min(max(a0, a1, a2), 0.0)\n'
+		s += '\ta0, a1, a2 = max(a0, 0.0), max(a1, 0.0), max(a2, 0.0)\n'
+		s += '\te = (e + sqrt(a0*a0 + a1*a1 + a2*a2)) / w\n'
+		return s
+
 	def glsl(self):
 		return 'de_box(p' + cond_offset(self.c) + ', ' + vec3_str(self.s) + ')'
 
+	def glsl_grad(self):
+		return 'de_box(p' + cond_offset(self.c) + ', ' + vec3_str(self.s) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class Tetrahedron:
 	def __init__(self, r=1.0, c=(0,0,0), color=(1,1,1)):
 		self.r = set_global_float(r)
@@ -60,16 +127,66 @@ class Tetrahedron:
 		md = max(-a[0] - a[1] - a[2], a[0] + a[1] - a[2], -a[0] + a[1] + a[2], a[0] - a[1] + a[2])
 		return (md - r) / (p[3] * math.sqrt(3.0));
 
+	def DE_batch(self, p):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		a = p[:,:3] - c
+		md = np.maximum(np.maximum(-a[:,0] - a[:,1] - a[:,2], a[:,0] + a[:,1] - a[:,2]),
+						np.maximum(-a[:,0] + a[:,1] + a[:,2], a[:,0] - a[:,1] + a[:,2]))
+		return (md - r) / (p[:,3] * math.sqrt(3.0))
+
+	def grad_batch(self, p, J):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		a = p[:,:3] - c
+		faces = np.array([[-1,-1,-1], [1,1,-1], [-1,1,1], [1,-1,1]], dtype=a.dtype)
+		md = np.dot(a, faces.T)
+		i = np.argmax(md, axis=1)
+		md = md[np.arange(a.shape[0]), i]
+		return de_grad((md - r) / math.sqrt(3.0), faces[i] / math.sqrt(3.0), p, J)
+
 	def NP(self, p):
-		raise Exception("Not implemented")
+		#Project onto the face plane that determines the distance
+		c = get_global(self.c)
+		r = get_global(self.r)
+		a = p[:3] - c
+		faces = np.array([[-1,-1,-1], [1,1,-1], [-1,1,1], [1,-1,1]], dtype=a.dtype)
+		md = np.dot(faces, a)
+		i = np.argmax(md)
+		return a - faces[i] * ((md[i] - r) / 3.0) + c
+
+	def NP_batch(self, p):
+		c = get_global(self.c)
+		r = get_global(self.r)
+		a = p[:,:3] - c
+		faces = np.array([[-1,-1,-1], [1,1,-1], [-1,1,1], [1,-1,1]], dtype=a.dtype)
+		md = np.dot(a, faces.T)
+		i = np.argmax(md, axis=1)
+		md = md[np.arange(a.shape[0]), i]
+		return a - faces[i] * ((md - r) / 3.0)[:,None] + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		s = '\ta0, a1, a2 = x - ' + c[0] + ', y - ' + c[1] + ', z - ' + c[2] + '\n'
+		s += '\te = max(-a0 - a1 - a2, a0 + a1 - a2, -a0 + a1 + a2, a0 - a1 + a2)\n'
+		s += '\te = (e - ' + py_float(self.r, keys) + ') / (w * ' + repr(math.sqrt(3.0)) + ')\n'
+		return s
 
 	def glsl(self):
 		return 'de_tetrahedron(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ')'
 
+	def glsl_grad(self):
+		return 'de_tetrahedron(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class InfCross:
+	unbounded = True
+
 	def __init__(self, r=1.0, c=(0,0,0), color=(1,1,1)):
 		self.r = set_global_float(r)
 		self.c = set_global_vec3(c)
@@ -81,6 +198,24 @@ class InfCross:
 		sq = (p[:3] - c) * (p[:3] - c)
 		return (math.sqrt(min(min(sq[0] + sq[1], sq[0] + sq[2]), sq[1] + sq[2])) - r) / p[3]
 
+	def DE_batch(self, p):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		sq = (p[:,:3] - c) * (p[:,:3] - c)
+		return (np.sqrt(np.minimum(np.minimum(sq[:,0] + sq[:,1], sq[:,0] + sq[:,2]), sq[:,1] + sq[:,2])) - r) / p[:,3]
+
+	def grad_batch(self, p, J):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		a = p[:,:3] - c
+		sq = a * a
+		sums = np.stack((sq[:,0] + sq[:,1], sq[:,0] + sq[:,2], sq[:,1] + sq[:,2]), axis=1)
+		i = np.argmin(sums, axis=1)
+		l = np.sqrt(sums[np.arange(a.shape[0]), i])
+		#The axis left out of the closest pair doesn't change the distance
+		axes = np.array([[1,1,0], [1,0,1], [0,1,1]], dtype=a.dtype)
+		return de_grad(l - r, a * axes[i] / np.maximum(l, 1e-20)[:,None], p, J)
+
 	def NP(self, p):
 		r = get_global(self.r)
 		c = get_global(self.c)
@@ -91,13 +226,40 @@ class InfCross:
 		n[m_ix] = p[m_ix] - c[m_ix]
 		return n + c
 
+	def NP_batch(self, p):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		n = p[:,:3] - c
+		ix = np.arange(n.shape[0])
+		m_ix = np.argmax(np.abs(n), axis=1)
+		a = n[ix, m_ix]
+		n[ix, m_ix] = 0.0
+		n = normalize_batch(n) * r
+		n[ix, m_ix] = a
+		return n + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		s = '\ta0, a1, a2 = x - ' + c[0] + ', y - ' + c[1] + ', z - ' + c[2] + '\n'
+		s += '\ta0, a1, a2 = a0*a0, a1*a1, a2*a2\n'
+		s += '\te = (sqrt(min(a0 + a1, a0 + a2, a1 + a2)) - ' + py_float(self.r, keys) + ') / w\n'
+		return s
+
 	def glsl(self):
 		return 'de_inf_cross(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ')'
 
+	def glsl_grad(self):
+		return 'de_inf_cross(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class InfCrossXY:
+	unbounded = True
+
 	def __init__(self, r=1.0, c=(0,0,0), color=(1,1,1)):
 		self.r = set_global_float(r)
 		self.c = set_global_vec3(c)
@@ -109,6 +271,21 @@ class InfCrossXY:
 		sq = (p[:3] - c) * (p[:3] - c)
 		return (math.sqrt(min(sq[0], sq[1]) + sq[2]) - r) / p[3]
 
+	def DE_batch(self, p):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		sq = (p[:,:3] - c) * (p[:,:3] - c)
+		return (np.sqrt(np.minimum(sq[:,0], sq[:,1]) + sq[:,2]) - r) / p[:,3]
+
+	def grad_batch(self, p, J):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		a = p[:,:3] - c
+		sq = a * a
+		l = np.sqrt(np.minimum(sq[:,0], sq[:,1]) + sq[:,2])
+		axes = np.where((sq[:,0] <= sq[:,1])[:,None], (1,0,1), (0,1,1))
+		return de_grad(l - r, a * axes / np.maximum(l, 1e-20)[:,None], p, J)
+
 	def NP(self, p):
 		r = get_global(self.r)
 		c = get_global(self.c)
@@ -119,13 +296,39 @@ class InfCrossXY:
 		n[m_ix] = p[m_ix] - c[m_ix]
 		return n + c
 
+	def NP_batch(self, p):
+		r = get_global(self.r)
+		c = get_global(self.c)
+		n = p[:,:3] - c
+		ix = np.arange(n.shape[0])
+		m_ix = np.where(np.abs(n[:,0]) > np.abs(n[:,1]), 0, 1)
+		a = n[ix, m_ix]
+		n[ix, m_ix] = 0.0
+		n = normalize_batch(n) * r
+		n[ix, m_ix] = a
+		return n + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		s = '\ta0, a1, a2 = x - ' + c[0] + ', y - ' + c[1] + ', z - ' + c[2] + '\n'
+		s += '\te = (sqrt(min(a0*a0, a1*a1) + a2*a2) - ' + py_float(self.r, keys) + ') / w\n'
+		return s
+
 	def glsl(self):
 		return 'de_inf_cross_xy(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ')'
 
+	def glsl_grad(self):
+		return 'de_inf_cross_xy(p' + cond_offset(self.c) + ', ' + float_str(self.r) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class InfLine:
+	unbounded = True
+
 	def __init__(self, r=1.0, n=(1,0,0), c=(0,0,0), color=(1,1,1)):
 		self.r = set_global_float(r)
 		self.n = set_global_vec3(n)
@@ -139,23 +342,63 @@ class InfLine:
 		q = p[:3] - c
 		return (np.linalg.norm(q - n*np.dot(n,q)) - r) / p[3]
 
+	def DE_batch(self, p):
+		r = get_global(self.r)
+		n = get_global(self.n)
+		c = get_global(self.c)
+		q = p[:,:3] - c
+		return (np.linalg.norm(q - np.outer(np.dot(q,n), n), axis=1) - r) / p[:,3]
+
+	def grad_batch(self, p, J):
+		r = get_global(self.r)
+		n = get_global(self.n)
+		c = get_global(self.c)
+		q = p[:,:3] - c
+		v = q - np.outer(np.dot(q,n), n)
+		l = np.linalg.norm(v, axis=1)
+		df = (v - np.outer(np.dot(v,n), n)) / np.maximum(l, 1e-20)[:,None]
+		return de_grad(l - r, df, p, J)
+
 	def NP(self, p):
 		r = get_global(self.r)
+		n = get_global(self.n)
 		c = get_global(self.c)
-		n = p[:3] - c
-		m_ix = (0 if abs(n[0]) > abs(n[1]) else 1)
-		n[m_ix] = 0.0
-		n = normalize(n) * r
-		n[m_ix] = p[m_ix] - c[m_ix]
-		return n + c
+		q = p[:3] - c
+		a = n*np.dot(n,q)
+		return normalize(q - a) * r + a + c
+
+	def NP_batch(self, p):
+		r = get_global(self.r)
+		n = get_global(self.n)
+		c = get_global(self.c)
+		q = p[:,:3] - c
+		a = np.outer(np.dot(q,n), n)
+		return normalize_batch(q - a) * r + a + c
+
+	def py(self, keys):
+		c = py_vec3(self.c, keys)
+		n = py_vec3(self.n, keys)
+		s = '\ta0, a1, a2 = x - ' + c[0] + ', y - ' + c[1] + ', z - ' + c[2] + '\n'
+		s += '\te = a0*' + n[0] + ' + a1*' + n[1] + ' + a2*' + n[2] + '\n'
+		s += '\ta0, a1, a2 = a0 - ' + n[0] + '*e, a1 - ' + n[1] + '*e, a2 - ' + n[2] + '*e\n'
+		s += '\te = (sqrt(a0*a0 + a1*a1 + a2*a2) - ' + py_float(self.r, keys) + ') / w\n'
+		return s
 
 	def glsl(self):
 		return 'de_inf_line(p' + cond_offset(self.c) + ', ' + vec3_str(self.n) + ', ' + float_str(self.r) + ')'
 
+	def glsl_grad(self):
+		return 'de_inf_line(p' + cond_offset(self.c) + ', ' + vec3_str(self.n) + ', ' + float_str(self.r) + ', J, g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class XPlane:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -164,17 +407,44 @@ class XPlane:
 		x = get_global(self.x)
 		return abs(p[0] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return np.abs(p[:,0] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		a = p[:,0] - x
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,0] = np.sign(a)
+		return de_grad(np.abs(a), df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([x, p[1], p[2]])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,0] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = abs(x - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return 'abs(p.x' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, abs(p.x' + cond_subtract(self.x) + '), vec3(sign(p.x' + cond_subtract(self.x) + '), 0.0, 0.0), g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class YPlane:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -183,17 +453,44 @@ class YPlane:
 		x = get_global(self.x)
 		return abs(p[1] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return np.abs(p[:,1] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		a = p[:,1] - x
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,1] = np.sign(a)
+		return de_grad(np.abs(a), df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([p[0], x, p[2]])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,1] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = abs(y - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return 'abs(p.y' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, abs(p.y' + cond_subtract(self.x) + '), vec3(0.0, sign(p.y' + cond_subtract(self.x) + '), 0.0), g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class ZPlane:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -202,17 +499,44 @@ class ZPlane:
 		x = get_global(self.x)
 		return abs(p[2] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return np.abs(p[:,2] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		a = p[:,2] - x
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,2] = np.sign(a)
+		return de_grad(np.abs(a), df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([p[0], p[1], x])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,2] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = abs(z - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return 'abs(p.z' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, abs(p.z' + cond_subtract(self.x) + '), vec3(0.0, 0.0, sign(p.z' + cond_subtract(self.x) + ')), g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class XHalfSpace:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -221,17 +545,43 @@ class XHalfSpace:
 		x = get_global(self.x)
 		return (p[0] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return (p[:,0] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,0] = 1.0
+		return de_grad(p[:,0] - x, df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([x, p[1], p[2]])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,0] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = (x - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return '(p.x' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, p.x' + cond_subtract(self.x) + ', vec3(1.0, 0.0, 0.0), g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class YHalfSpace:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -240,17 +590,43 @@ class YHalfSpace:
 		x = get_global(self.x)
 		return (p[1] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return (p[:,1] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,1] = 1.0
+		return de_grad(p[:,1] - x, df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([p[0], x, p[2]])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,1] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = (y - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return '(p.y' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, p.y' + cond_subtract(self.x) + ', vec3(0.0, 1.0, 0.0), g)'
+
 	def glsl_col(self):
 		return make_color(self)
 
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
+
 class ZHalfSpace:
+	unbounded = True
+
 	def __init__(self, x=0.0, color=(1,1,1)):
 		self.x = set_global_float(x)
 		self.color = color
@@ -259,12 +635,36 @@ class ZHalfSpace:
 		x = get_global(self.x)
 		return (p[2] - x) / p[3]
 
+	def DE_batch(self, p):
+		x = get_global(self.x)
+		return (p[:,2] - x) / p[:,3]
+
+	def grad_batch(self, p, J):
+		x = get_global(self.x)
+		df = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		df[:,2] = 1.0
+		return de_grad(p[:,2] - x, df, p, J)
+
 	def NP(self, p):
 		x = get_global(self.x)
 		return np.array([p[0], p[1], x])
 
+	def NP_batch(self, p):
+		n = np.copy(p[:,:3])
+		n[:,2] = get_global(self.x)
+		return n
+
+	def py(self, keys):
+		return '\te = (z - ' + py_float(self.x, keys) + ') / w\n'
+
 	def glsl(self):
 		return '(p.z' + cond_subtract(self.x) + ') / p.w'
 
+	def glsl_grad(self):
+		return 'de_grad(p, J, p.z' + cond_subtract(self.x) + ', vec3(0.0, 0.0, 1.0), g)'
+
 	def glsl_col(self):
 		return make_color(self)
+
+	def col_batch(self, p, orbit):
+		return make_color_batch(self, self.DE_batch(p), orbit)
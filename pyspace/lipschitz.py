@@ -0,0 +1,150 @@
+import numpy as np
+from .util import *
+from .fold import *
+from .geo import *
+
+#Folds that are piecewise isometries and leave w alone
+ISOMETRIES = (FoldAbs, FoldSierpinski, FoldMenger, FoldBox, FoldRotateX, FoldRotateY, FoldRotateZ,
+	FoldRepeatX, FoldRepeatY, FoldRepeatZ, FoldRepeatXYZ)
+
+#Primitives that are exact or bounding 1-Lipschitz distances of p.xyz before dividing by p.w
+PRIMITIVES = (Sphere, Box, Tetrahedron, InfCross, InfCrossXY, XPlane, YPlane, ZPlane,
+	XHalfSpace, YHalfSpace, ZHalfSpace)
+
+#Result of analyze(). bound is an upper bound of the DE's Lipschitz constant that is
+#proven when proven is True, sampled is the largest slope found by sampling.
+class LipschitzReport:
+	def __init__(self):
+		self.bound = 1.0
+		self.proven = True
+		self.sampled = None
+		self.multiplier = 1.0
+		self.warnings = []
+
+	def warn(self, msg):
+		if msg not in self.warnings:
+			self.warnings.append(msg)
+
+	def __str__(self):
+		s = 'Lipschitz bound: %.4g (%s)' % (self.bound, 'proven' if self.proven else 'not proven')
+		if self.sampled is not None:
+			s += ', sampled: %.4g' % self.sampled
+		s += ', step multiplier: %.4g' % self.multiplier
+		for w in self.warnings:
+			s += '\nWarning: ' + w
+		return s
+
+def uses_keys(t):
+	for v in vars(t).values():
+		if type(v) is str or len(get_sub_keys(v)) > 0:
+			return True
+	return False
+
+def chain_bound(obj, report, w_range, visited):
+	#Walks the chain tracking an upper bound of |J|/w, where J is the derivative of the
+	#folded point, and the range of w. Returns the bound of the whole DE.
+	visited = visited | {id(obj)}
+	ratio = 1.0
+	w_min, w_max = w_range
+	bound = 0.0
+	for t in obj.trans:
+		name = type(t).__name__
+		if hasattr(t, 'fold') and uses_keys(t):
+			report.warn(name + ' uses live parameters, the bound holds for their current values only')
+
+		if isinstance(t, ISOMETRIES):
+			pass
+		elif isinstance(t, FoldPlane):
+			#Reflections only preserve lengths for unit normals
+			n2 = norm_sq(get_global(t.n))
+			k = max(1.0, abs(1.0 - 2.0*n2))
+			if abs(n2 - 1.0) > 1e-6:
+				report.warn('FoldPlane normal is not normalized, scaling by up to %.4g' % k)
+			ratio *= k
+		elif isinstance(t, FoldMatrix):
+			k = float(np.linalg.norm(t.m, 2))
+			if k > 1.0 + 1e-6:
+				report.warn('FoldMatrix is not a rotation, scaling by up to %.4g' % k)
+			ratio *= max(k, 1.0)
+		elif isinstance(t, FoldScaleTranslate):
+			s = get_global(t.s)
+			if s <= 0.0:
+				report.warn('FoldScaleTranslate with scale %.4g makes w non-positive' % s)
+				report.proven = False
+			w_min, w_max = sorted((w_min * s, w_max * s))
+		elif isinstance(t, FoldScaleOrigin):
+			#The origin adds the identity to the Jacobian and one to w, which pulls the
+			#ratio towards 1. It is largest at w_max above 1 and at w_min below it.
+			s = get_global(t.s)
+			if s <= 0.0:
+				report.warn('FoldScaleOrigin with scale %.4g makes w non-positive' % s)
+				report.proven = False
+			else:
+				w = w_max if ratio >= 1.0 else w_min
+				ratio = (s * ratio * w + 1.0) / (s * w + 1.0)
+			w_min, w_max = sorted((w_min * s + 1.0, w_max * s + 1.0))
+		elif isinstance(t, FoldSphere):
+			report.warn('FoldSphere scales by a position dependent factor, the DE is not provably bounded')
+			report.proven = False
+			w_max *= get_global(t.max_r) / get_global(t.min_r)
+		elif isinstance(t, FoldInversion):
+			report.warn('FoldInversion scales by a position dependent factor, the DE is not provably bounded')
+			report.proven = False
+			w_min = 0.0
+			w_max /= get_global(t.epsilon)
+		elif hasattr(t, 'fold'):
+			report.warn('Unknown fold ' + name + ', the DE is not provably bounded')
+			report.proven = False
+		elif isinstance(t, PRIMITIVES):
+			bound = max(bound, ratio)
+		elif isinstance(t, InfLine):
+			n2 = norm_sq(get_global(t.n))
+			if abs(n2 - 1.0) > 1e-6:
+				report.warn('InfLine direction is not normalized')
+			bound = max(bound, ratio * max(1.0, abs(1.0 - n2)))
+		elif hasattr(t, 'forwared_decl'):
+			if id(t) in visited:
+				report.warn('Object ' + t.name + ' contains itself')
+				report.proven = False
+			else:
+				with t.params:
+					bound = max(bound, ratio * chain_bound(t, report, (w_min, w_max), visited))
+		elif hasattr(t, 'DE'):
+			report.warn('Unknown primitive ' + name + ', assuming it is 1-Lipschitz')
+			report.proven = False
+			bound = max(bound, ratio)
+	return bound
+
+def sample_bound(obj, n, center, radius, rng):
+	#Largest finite difference slope of the DE over random points and directions
+	p = rng.uniform(-radius, radius, (n, 3)) + np.asarray(center, dtype=np.float64)
+	u = normalize_batch(rng.normal(size=(n, 3)))
+	h = radius * 1e-4
+	d0 = obj.DE_batch(p, dtype=np.float64)
+	d1 = obj.DE_batch(p + u*h, dtype=np.float64)
+	slope = np.abs(d1 - d0) / h
+	slope = slope[np.isfinite(slope)]
+	return float(np.max(slope)) if slope.shape[0] > 0 else None
+
+def analyze(obj, samples=65536, center=(0,0,0), radius=8.0, seed=0, margin=1.1):
+	#Bounds the Lipschitz constant of obj's DE and suggests a step multiplier for
+	#the STEP_MULTIPLIER camera option. With a proven bound the multiplier is safe,
+	#otherwise it is derived from sampling with the given safety margin.
+	report = LipschitzReport()
+	with obj.params:
+		report.bound = chain_bound(obj, report, (1.0, 1.0), set())
+	if report.bound <= 0.0:
+		report.bound = 1.0
+
+	if samples > 0:
+		report.sampled = sample_bound(obj, samples, center, radius, np.random.default_rng(seed))
+		if report.sampled is not None and report.sampled > report.bound * 1.001:
+			report.warn('Sampled slope %.4g exceeds the bound, the DE overestimates distances' % report.sampled)
+			report.proven = False
+
+	if report.proven:
+		report.multiplier = 1.0 / report.bound
+	else:
+		estimate = max(report.bound, report.sampled if report.sampled is not None else 1.0)
+		report.multiplier = min(1.0, 1.0 / (estimate * margin))
+	return report
@@ -1,39 +1,373 @@
+import math
 import numpy as np
 from .util import *
 
+#Rows of a batch that still run the fold chain while escaped ones skip the rest of a run.
+#work holds the rows ix of the full arrays. Rows that escape later are copied back right
+#away and masked by live until compacting the others pays off.
+class Lanes:
+	def __init__(self, full, origins, bailout):
+		self.full = full
+		self.origins = origins
+		self.r2 = None if bailout is None else float(bailout) * float(bailout)
+		self.reset()
+
+	def reset(self):
+		self.work = list(self.full)
+		self.o = list(self.origins)
+		self.ix = None
+		self.live = None
+
+	def get(self, a):
+		return a if self.ix is None else a[self.ix]
+
+	def put(self, a, rows):
+		if self.ix is not None:
+			a[self.ix] = rows
+
+	def set(self, k, a):
+		self.work[k] = a
+		if self.ix is None:
+			self.full[k] = a
+
+	def mask(self, m):
+		return m if self.live is None else m & self.live
+
+	def escape(self):
+		q = self.work[0]
+		m = self.mask(np.einsum('ij,ij->i', q[:,:3], q[:,:3]) <= self.r2)
+		if self.ix is None:
+			#The work arrays are the full arrays until the first escape
+			if not np.all(m):
+				self.ix = np.flatnonzero(m)
+				self.compact(m)
+			return
+		dead = ~m if self.live is None else self.live & ~m
+		if not np.any(dead):
+			return
+		for f, w in zip(self.full, self.work):
+			if f is not None and w is not None:
+				f[self.ix[dead]] = w[dead]
+		self.live = m
+		if 2 * np.count_nonzero(m) < m.shape[0]:
+			self.ix = self.ix[m]
+			self.compact(m)
+
+	def compact(self, m):
+		self.work = [None if w is None else w[m] for w in self.work]
+		self.o = [o[m] for o in self.o]
+		self.live = None
+
+	def end(self):
+		#Rows that are still active rejoin the full arrays after the run
+		if self.ix is None:
+			return
+		rows = self.ix if self.live is None else self.ix[self.live]
+		for f, w in zip(self.full, self.work):
+			if f is not None and w is not None:
+				f[rows] = w if self.live is None else w[self.live]
+		self.reset()
+
 class Object:
 	def __init__(self):
 		self.trans = []
 		self.name = 'obj' + str(id(self))
+		self.params = active_params()
+		self.py_key = None
+		self.py_de = None
+		self.py_refs = []
+		self.roll_loops = True
+		self.bound = None
+		self.bailout = None
+		self.plan_key = None
+		self.plan = None
+
+	def __getstate__(self):
+		#Generated functions can't be pickled, they are rebuilt on demand
+		state = dict(self.__dict__)
+		state['py_key'] = None
+		state['py_de'] = None
+		return state
 
 	def add(self, fold):
 		self.trans.append(fold)
 
 	def DE(self, origin):
+		with self.params:
+			return self.DE_point(origin)
+
+	def DE_point(self, origin):
 		p = np.copy(origin)
 		d = 1e20
-		for t in self.trans:
+		checks, ends = self.bailout_plan()
+		escaped = False
+		for i, t in enumerate(self.trans):
+			if escaped:
+				escaped = i not in ends
+				continue
 			if hasattr(t, 'fold'):
 				if hasattr(t, 'o'):
 					t.o = origin
 				t.fold(p)
 			elif hasattr(t, 'DE'):
-				d = min(d, t.DE(p))
+				if getattr(t, 'bound', None) is None or t.bound_DE(p) < d:
+					d = min(d, t.DE(p))
 			elif hasattr(t, 'orbit'): pass
 			else:
 				raise Exception("Invalid type in transformation queue")
+			if i in checks:
+				escaped = norm_sq(p[:3]) > self.bailout * self.bailout
+		return d
+
+	def DE_fast(self, origin):
+		key = self.chain_key()
+		if key != self.py_key:
+			ns = {'sin': math.sin, 'cos': math.cos, 'sqrt': math.sqrt}
+			nested_refs = {}
+			src = self.compiled_py(nested_refs)
+			for obj in [self] + list(nested_refs.values()):
+				ns['params_' + obj.name] = obj.params.slots
+			exec(src, ns)
+			self.py_de = ns['de_' + self.name]
+			self.py_refs = [t for t in self.trans if hasattr(t, 'chain_key')]
+			self.py_key = self.chain_key()
+		return self.py_de(float(origin[0]), float(origin[1]), float(origin[2]), float(origin[3]))
+
+	def chain_key(self):
+		#Nested objects are tracked from the last generation, a new one changes the ids anyway
+		return (tuple(map(id, self.trans)), self.bailout) + tuple(t.chain_key() for t in self.py_refs)
+
+	def DE_batch(self, points, chunk_size=65536, dtype=None):
+		points = to_batch(points, dtype)
+		d = np.empty((points.shape[0],), dtype=points.dtype)
+		with self.params:
+			for i in range(0, points.shape[0], chunk_size):
+				d[i:i+chunk_size] = self.DE_chunk(points[i:i+chunk_size])
 		return d
 
+	def DE_chunk(self, origin):
+		p = np.copy(origin)
+		d = np.full((p.shape[0],), 1e20, dtype=p.dtype)
+		checks, ends = self.bailout_plan()
+		lanes = Lanes([p], [origin], self.bailout)
+		for i, t in enumerate(self.trans):
+			q = lanes.work[0]
+			if hasattr(t, 'fold_batch'):
+				if hasattr(t, 'o'):
+					t.o = lanes.o[0]
+				t.fold_batch(q)
+			elif hasattr(t, 'DE_batch'):
+				dq = lanes.get(d)
+				if getattr(t, 'bound', None) is None:
+					cur_d = t.DE_batch(q)
+					m = lanes.mask(cur_d < dq)
+					dq[m] = cur_d[m]
+				else:
+					#Only points closer to the child's bound than the current best evaluate its chain
+					m = lanes.mask(t.bound_DE_batch(q) < dq)
+					if np.any(m):
+						dq[m] = np.minimum(dq[m], t.DE_batch(q[m]))
+				lanes.put(d, dq)
+			elif hasattr(t, 'orbit'): pass
+			else:
+				raise Exception("Invalid type in transformation queue")
+			if i in checks:
+				lanes.escape()
+			elif i in ends:
+				lanes.end()
+		return d
+
+	def bailout_plan(self):
+		#Indices after which escaped points skip the rest of their periodic run, and the
+		#indices that end those runs. The checks are between iterations like in the shader.
+		key = (tuple(map(id, self.trans)), self.bailout)
+		if key != self.plan_key:
+			checks, ends = set(), set()
+			if self.bailout is not None:
+				for start, period, count in self.runs():
+					if count > 1:
+						checks.update(start + period*k - 1 for k in range(1, count))
+						ends.add(start + period*count - 1)
+			self.plan = (checks, ends)
+			self.plan_key = key
+		return self.plan
+
+	def COL_batch(self, points, chunk_size=65536, dtype=None):
+		#Rows of RGB and distance, the same as the generated col_ function
+		points = to_batch(points, dtype)
+		col = np.empty((points.shape[0], 4), dtype=points.dtype)
+		with self.params:
+			for i in range(0, points.shape[0], chunk_size):
+				col[i:i+chunk_size] = self.COL_chunk(points[i:i+chunk_size])
+		return col
+
+	def col_batch(self, p, orbit):
+		#Nested objects start their own orbit trap
+		with self.params:
+			return self.COL_chunk(p)
+
+	def COL_chunk(self, origin):
+		p = np.copy(origin)
+		col = np.full((p.shape[0], 4), 1e20, dtype=p.dtype)
+		checks, ends = self.bailout_plan()
+		#Escaped points keep their orbit trap too
+		lanes = Lanes([p, None], [origin], self.bailout)
+		for i, t in enumerate(self.trans):
+			q, orbit = lanes.work
+			if hasattr(t, 'fold_batch'):
+				if hasattr(t, 'o'):
+					t.o = lanes.o[0]
+				t.fold_batch(q)
+			elif hasattr(t, 'col_batch'):
+				cq = lanes.get(col)
+				if getattr(t, 'bound', None) is None:
+					new_col = t.col_batch(q, orbit)
+					m = lanes.mask(new_col[:,3] < cq[:,3])
+					cq[m] = new_col[m]
+				else:
+					ix = np.flatnonzero(lanes.mask(t.bound_DE_batch(q) < cq[:,3]))
+					if ix.shape[0] > 0:
+						new_col = t.col_batch(q[ix], None if orbit is None else orbit[ix])
+						m = new_col[:,3] < cq[ix,3]
+						cq[ix[m]] = new_col[m]
+				lanes.put(col, cq)
+			elif hasattr(t, 'orbit_batch'):
+				lanes.set(1, t.orbit_batch(q, orbit))
+			else:
+				raise Exception("Invalid type in transformation queue")
+			if i in checks:
+				lanes.escape()
+			elif i in ends:
+				lanes.end()
+		return col
+
+	def DE_grad_batch(self, points, chunk_size=16384, dtype=None):
+		#Distance and its gradient, the unnormalized surface normal, in a single pass that
+		#carries the Jacobian of the folded point with respect to the origin along the chain
+		points = to_batch(points, dtype)
+		d = np.empty((points.shape[0],), dtype=points.dtype)
+		g = np.empty((points.shape[0], 3), dtype=points.dtype)
+		with self.params:
+			for i in range(0, points.shape[0], chunk_size):
+				p = points[i:i+chunk_size]
+				J = np.zeros((p.shape[0], 4, 3), dtype=p.dtype)
+				J[:,0,0] = J[:,1,1] = J[:,2,2] = 1.0
+				d[i:i+chunk_size], g[i:i+chunk_size] = self.grad_chunk(p, J)
+		return d, g
+
+	def grad_batch(self, p, J):
+		with self.params:
+			return self.grad_chunk(p, J)
+
+	def grad_chunk(self, origin, origin_J):
+		p = np.copy(origin)
+		J = np.copy(origin_J)
+		d = np.full((p.shape[0],), 1e20, dtype=p.dtype)
+		g = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		checks, ends = self.bailout_plan()
+		#Escaped points keep their Jacobian too
+		lanes = Lanes([p, J], [origin, origin_J], self.bailout)
+		for i, t in enumerate(self.trans):
+			q, Jq = lanes.work
+			if hasattr(t, 'fold_grad_batch'):
+				if hasattr(t, 'o'):
+					t.o, t.o_grad = lanes.o
+				t.fold_grad_batch(q, Jq)
+				if hasattr(t, 'o'):
+					#The origin's Jacobian is only needed during the call, don't keep it around
+					t.o_grad = None
+			elif hasattr(t, 'grad_batch'):
+				dq = lanes.get(d)
+				gq = lanes.get(g)
+				if getattr(t, 'bound', None) is None:
+					cur_d, cur_g = t.grad_batch(q, Jq)
+					m = lanes.mask(cur_d < dq)
+					dq[m] = cur_d[m]
+					gq[m] = cur_g[m]
+				else:
+					#Cull like DE_chunk so the gradient belongs to the same distance
+					ix = np.flatnonzero(lanes.mask(t.bound_DE_batch(q) < dq))
+					if ix.shape[0] > 0:
+						cur_d, cur_g = t.grad_batch(q[ix], Jq[ix])
+						m = cur_d < dq[ix]
+						dq[ix[m]] = cur_d[m]
+						gq[ix[m]] = cur_g[m]
+				lanes.put(d, dq)
+				lanes.put(g, gq)
+			elif hasattr(t, 'orbit'): pass
+			else:
+				raise Exception("Invalid type in transformation queue")
+			if i in checks:
+				lanes.escape()
+			elif i in ends:
+				lanes.end()
+		return d, g
+
+	def bound_DE(self, p):
+		c, r = self.bound
+		return (np.linalg.norm(p[:3] - c) - r) / p[3]
+
+	def bound_DE_batch(self, p):
+		c, r = self.bound
+		return (np.linalg.norm(p[:,:3] - c, axis=1) - r) / p[:,3]
+
+	def is_unbounded(self):
+		for t in self.trans:
+			if getattr(t, 'unbounded', False):
+				return True
+			elif hasattr(t, 'forwared_decl') and t.is_unbounded():
+				return True
+		return False
+
+	def estimate_bound(self, radius=16.0, max_radius=1024.0, resolution=48, margin=1.1):
+		#Conservative bounding sphere (center, radius) of the surface from a grid of DE samples,
+		#or None for infinite scenes. Every surface point is within half a cell diagonal of a grid
+		#point, and since the DE doesn't overestimate by more than margin, that point's DE is small.
+		#The grid grows until the surface doesn't touch its edge and then shrinks around it.
+		if self.is_unbounded():
+			return None
+		lo = np.full((3,), -radius)
+		hi = np.full((3,), radius)
+		refined = False
+		while True:
+			h = (hi - lo) / resolution
+			axes = [lo[i] + (np.arange(resolution) + 0.5) * h[i] for i in range(3)]
+			g = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape((-1, 3))
+			cell = 0.5 * np.linalg.norm(h)
+			near = g[self.DE_batch(g, dtype=np.float64) <= cell * margin]
+			if near.shape[0] == 0:
+				return None
+			near_lo = np.min(near, axis=0)
+			near_hi = np.max(near, axis=0)
+			if not refined and (np.any(near_lo < lo + h) or np.any(near_hi > hi - h)):
+				radius *= 2.0
+				if radius > max_radius:
+					return None
+				lo = np.full((3,), -radius)
+				hi = np.full((3,), radius)
+			elif not refined:
+				lo = near_lo - h
+				hi = near_hi + h
+				refined = True
+			else:
+				c = 0.5 * (near_lo + near_hi)
+				r = np.max(np.linalg.norm(near - c, axis=1)) + cell * margin
+				return c.astype(np.float32), float(r)
+
 	def NP(self, origin):
+		with self.params:
+			return self.NP_point(origin)
+
+	def NP_point(self, origin):
 		undo = []
 		p = np.copy(origin)
 		d = 1e20
-		n = np.zeros((3,), dtype=np.float32)
+		n = np.zeros((3,), dtype=p.dtype)
 		for t in self.trans:
 			undo.append((t, np.copy(p)))
 			if hasattr(t, 'fold'):
-				if hasattr(fold, 'o'):
-					fold.o = origin
+				if hasattr(t, 'o'):
+					t.o = origin
 				t.fold(p)
 			elif hasattr(t, 'NP'): pass
 			elif hasattr(t, 'orbit'): pass
@@ -50,49 +384,257 @@ class Object:
 					n = cur_n
 		return n
 
+	def NP_batch(self, points, chunk_size=8192, dtype=None):
+		#Every fold keeps a copy of its input, so chunks are smaller than for DE_batch
+		points = to_batch(points, dtype)
+		n = np.empty((points.shape[0], 3), dtype=points.dtype)
+		with self.params:
+			for i in range(0, points.shape[0], chunk_size):
+				n[i:i+chunk_size] = self.NP_chunk(points[i:i+chunk_size])
+		return n
+
+	def NP_chunk(self, origin):
+		undo = []
+		p = np.copy(origin)
+		for t in self.trans:
+			if hasattr(t, 'fold_batch'):
+				undo.append((t, np.copy(p)))
+				if hasattr(t, 'o'):
+					t.o = origin
+				t.fold_batch(p)
+			elif hasattr(t, 'NP_batch'):
+				undo.append((t, np.copy(p)))
+			elif hasattr(t, 'orbit'): pass
+			else:
+				raise Exception("Invalid type in transformation queue")
+		d = np.full((p.shape[0],), np.inf, dtype=p.dtype)
+		n = np.zeros((p.shape[0], 3), dtype=p.dtype)
+		for t, p in undo[::-1]:
+			if hasattr(t, 'fold_batch'):
+				t.unfold_batch(p, n)
+			else:
+				cur_n = t.NP_batch(p)
+				cur_d = np.sum((cur_n - p[:,:3])**2, axis=1) / (p[:,3] * p[:,3])
+				m = cur_d < d
+				d[m] = cur_d[m]
+				n[m] = cur_n[m]
+		return n
+
+	def py(self, keys):
+		return '\te = de_' + self.name + '(x, y, z, w)\n'
+
+	def param_keys(self, keys=None):
+		#Params the DE reads, found the same way compiled_py finds them
+		if keys is None:
+			keys = {}
+		for t in self.trans:
+			if hasattr(t, 'forwared_decl'):
+				t.param_keys(keys)
+			elif hasattr(t, 'fold') or hasattr(t, 'DE'):
+				t.py(keys)
+		return keys
+
+	def compiled_py(self, nested_refs):
+		new_refs = []
+		keys = {}
+		lines = []
+		for t in self.trans:
+			if hasattr(t, 'fold'):
+				lines.append(t.py(keys))
+			elif getattr(t, 'bound', None) is not None:
+				lines.append('\tif ' + t.bound_py() + ' < d:\n\t' + t.py(keys) + '\t\td = min(d, e)\n')
+				if t.name not in nested_refs:
+					nested_refs[t.name] = t
+					new_refs.append(t)
+			elif hasattr(t, 'DE'):
+				lines.append(t.py(keys) + '\td = min(d, e)\n')
+				if hasattr(t, 'forwared_decl') and t.name not in nested_refs:
+					nested_refs[t.name] = t
+					new_refs.append(t)
+			elif hasattr(t, 'orbit'):
+				lines.append('')
+			else:
+				raise Exception("Invalid type in transformation queue")
+		if self.bailout is None:
+			body = ''.join(lines)
+		else:
+			#Same runs as the shader, escaped points skip the remaining iterations
+			body = ''
+			for start, period, count in self.runs():
+				if count > 1:
+					body += '\tfor _ in range(' + str(count) + '):\n'
+					body += ''.join('\t' + line + '\n' for line in ''.join(lines[start:start + period]).splitlines())
+					body += '\t\tif x*x + y*y + z*z > ' + repr(float(self.bailout)**2) + ': break\n'
+				else:
+					body += ''.join(lines[start:start + period*count])
+		s = 'def de_' + self.name + '(x, y, z, w):\n'
+		if len(keys) > 0:
+			s += '\tg = params_' + self.name + '\n'
+			s += py_globals(keys, self.params)
+		s += '\tox, oy, oz, ow = x, y, z, w\n'
+		s += '\td = 1e20\n'
+		s += body
+		s += '\treturn d\n'
+		for obj in new_refs:
+			s += obj.compiled_py(nested_refs)
+		return s
+
 	def glsl(self):
 		return 'de_' + self.name + '(p)'
 
 	def glsl_col(self):
 		return 'col_' + self.name + '(p)'
 
+	def glsl_grad(self):
+		return 'de_grad_' + self.name + '(p, J, g)'
+
+	def bound_py(self):
+		c, r = self.bound
+		c = [repr(float(v)) for v in c]
+		s = 'sqrt((x - ' + c[0] + ')**2 + (y - ' + c[1] + ')**2 + (z - ' + c[2] + ')**2)'
+		return '(' + s + ' - ' + repr(float(r)) + ') / w'
+
+	def bound_glsl(self):
+		return 'de_sphere(p - vec4(bound_' + self.name + '.xyz, 0.0), bound_' + self.name + '.w)'
+
 	def forwared_decl(self):
 		s = 'float de_' + self.name + '(vec4 p);\n'
 		s += 'vec4 col_' + self.name + '(vec4 p);\n'
+		s += 'float de_grad_' + self.name + '(vec4 p, mat4x3 J, out vec3 n);\n'
+		if self.bound is not None:
+			#Shared by the de_ and col_ functions of every parent
+			c, r = self.bound
+			s += 'const vec4 bound_' + self.name + ' = vec4(' + vec3_str(c) + ', ' + float_str(float(r)) + ');\n'
 		return s
 
-	def compiled(self, nested_refs):
-		new_refs = []
-		s = 'float de_' + self.name + '(vec4 p) {\n'
-		s += '\tvec4 o = p;\n'
-		s += '\tfloat d = 1e20;\n'
+	def runs(self):
+		#Split the chain into periodic runs of identical transforms as (start, period, count)
+		keys = []
 		for t in self.trans:
 			if hasattr(t, 'fold'):
-				s += t.glsl()
+				keys.append(t.glsl())
+			elif hasattr(t, 'orbit'):
+				keys.append(t.orbit())
+			else:
+				keys.append(id(t))
+		runs = []
+		i = 0
+		while i < len(keys):
+			best_period, best_count = 1, 1
+			for period in range(1, (len(keys) - i) // 2 + 1):
+				count = 1
+				while keys[i + count*period:i + (count + 1)*period] == keys[i:i + period]:
+					count += 1
+				if period * (count - 1) >= 2 and period * count > best_period * best_count:
+					best_period, best_count = period, count
+			runs.append((i, best_period, best_count))
+			i += best_period * best_count
+		return runs
+
+	def compiled_runs(self, emit, roll_loops):
+		#With a bailout, escaped points skip the remaining iterations of a run
+		if self.bailout is not None:
+			escaped = 'dot(p.xyz, p.xyz) > ' + float_str(float(self.bailout)**2)
+		s = ''
+		for start, period, count in self.runs():
+			if count > 1 and roll_loops:
+				s += '\tfor (int i = 0; i < ' + str(count) + '; ++i) {\n'
+				for t in self.trans[start:start + period]:
+					s += ''.join('\t' + line + '\n' for line in emit(t).splitlines())
+				if self.bailout is not None:
+					s += '\t\tif (' + escaped + ') { break; }\n'
+				s += '\t}\n'
+			elif count > 1 and self.bailout is not None:
+				for t in self.trans[start:start + period]:
+					s += emit(t)
+				for k in range(1, count):
+					s += '\tif (!(' + escaped + ')) {\n'
+					for t in self.trans[start + period*k:start + period*(k + 1)]:
+						s += ''.join('\t' + line + '\n' for line in emit(t).splitlines())
+					s += '\t}\n'
+			else:
+				for t in self.trans[start:start + period*count]:
+					s += emit(t)
+		return s
+
+	def compiled(self, nested_refs, roll_loops=None):
+		new_refs = []
+		def emit_de(t):
+			if hasattr(t, 'fold'):
+				return t.glsl()
 			elif hasattr(t, 'DE'):
-				s += '\td = min(d, ' + t.glsl() + ');\n'
 				if hasattr(t, 'forwared_decl') and t.name not in nested_refs:
 					nested_refs[t.name] = t
 					new_refs.append(t)
-			elif hasattr(t, 'orbit'): pass
+				if getattr(t, 'bound', None) is not None:
+					return '\tif (' + t.bound_glsl() + ' < d) { d = min(d, ' + t.glsl() + '); }\n'
+				return '\td = min(d, ' + t.glsl() + ');\n'
+			elif hasattr(t, 'orbit'):
+				return ''
 			else:
 				raise Exception("Invalid type in transformation queue")
+		def emit_col(t):
+			if hasattr(t, 'fold'):
+				return t.glsl()
+			elif getattr(t, 'bound', None) is not None:
+				s = '\tif (' + t.bound_glsl() + ' < col.w) {\n'
+				s += '\t\tnewCol = ' + t.glsl_col() + ';\n\t\tif (newCol.w < col.w) { col = newCol; }\n'
+				return s + '\t}\n'
+			elif hasattr(t, 'DE'):
+				return '\tnewCol = ' + t.glsl_col() + ';\n\tif (newCol.w < col.w) { col = newCol; }\n'
+			elif hasattr(t, 'orbit'):
+				return t.orbit()
+		s = 'float de_' + self.name + '(vec4 p) {\n'
+		s += '\tvec4 o = p;\n'
+		s += '\tfloat d = 1e20;\n'
+		s += self.compiled_runs(emit_de, self.roll_loops if roll_loops is None else roll_loops)
 		s += '\treturn d;\n'
 		s += '}\n'
 		s += 'vec4 col_' + self.name + '(vec4 p) {\n'
 		s += '\tvec4 o = p;\n'
 		s += '\tvec4 col = vec4(1e20);\n'
 		s += '\tvec4 newCol;\n'
-		for t in self.trans:
+		s += self.compiled_runs(emit_col, self.roll_loops if roll_loops is None else roll_loops)
+		s += '\treturn col;\n'
+		s += '}\n'
+		for obj in new_refs:
+			s += obj.compiled(nested_refs, roll_loops)
+		return s
+
+	def compiled_grad(self, nested_refs, roll_loops=None):
+		#Forward mode DE for analytic normals, column i of J is the gradient of p[i]
+		new_refs = []
+		def emit_grad(t):
 			if hasattr(t, 'fold'):
-				s += t.glsl()
+				return t.glsl_grad()
 			elif hasattr(t, 'DE'):
-				s += '\tnewCol = ' + t.glsl_col() + ';\n'
-				s += '\tif (newCol.w < col.w) { col = newCol; }\n'
+				if hasattr(t, 'forwared_decl') and t.name not in nested_refs:
+					nested_refs[t.name] = t
+					new_refs.append(t)
+				s = '\te = ' + t.glsl_grad() + ';\n\tif (e < d) { d = e; n = g; }\n'
+				if getattr(t, 'bound', None) is not None:
+					return '\tif (' + t.bound_glsl() + ' < d) {\n' + s.replace('\t', '\t\t') + '\t}\n'
+				return s
 			elif hasattr(t, 'orbit'):
-				s += t.orbit()
-		s += '\treturn col;\n'
+				return ''
+			else:
+				raise Exception("Invalid type in transformation queue")
+		s = 'float de_grad_' + self.name + '(vec4 p, mat4x3 J, out vec3 n) {\n'
+		s += '\tvec4 o = p;\n'
+		s += '\tmat4x3 oJ = J;\n'
+		s += '\tfloat d = 1e20;\n'
+		s += '\tfloat e;\n'
+		s += '\tvec3 g;\n'
+		s += '\tn = vec3(0.0);\n'
+		s += self.compiled_runs(emit_grad, self.roll_loops if roll_loops is None else roll_loops)
+		s += '\treturn d;\n'
 		s += '}\n'
 		for obj in new_refs:
-			s += obj.compiled(nested_refs)
+			s += obj.compiled_grad(nested_refs, roll_loops)
 		return s
+
+	def compiled_size(self):
+		#Source size in bytes with and without loop rolling
+		rolled = len(self.compiled({}, True))
+		unrolled = len(self.compiled({}, False))
+		return rolled, unrolled
@@ -0,0 +1,78 @@
+import math
+import re
+import numpy as np
+from collections import Counter
+from .util import *
+from .fold import *
+
+def is_const(x):
+	return type(x) is not str and len(get_sub_keys(x)) == 0
+
+def rotation_matrix(t):
+	if isinstance(t, FoldMatrix):
+		return t.m
+	if not isinstance(t, (FoldRotateX, FoldRotateY, FoldRotateZ)) or not is_const(t.a):
+		return None
+	s, c = math.sin(t.a), math.cos(t.a)
+	if isinstance(t, FoldRotateX):
+		return np.array([[1, 0, 0], [0, c, s], [0, -s, c]])
+	elif isinstance(t, FoldRotateY):
+		return np.array([[c, 0, -s], [0, 1, 0], [s, 0, c]])
+	else:
+		return np.array([[c, s, 0], [-s, c, 0], [0, 0, 1]])
+
+def is_scale_translate(t):
+	return isinstance(t, FoldScaleTranslate) and is_const(t.s) and is_const(t.t)
+
+def merge(a, b):
+	#Returns a single fold equivalent to applying a then b, or None
+	ma = rotation_matrix(a)
+	mb = rotation_matrix(b)
+	if ma is not None and mb is not None:
+		return FoldMatrix(np.dot(mb, ma))
+	if is_scale_translate(a) and is_scale_translate(b):
+		t = np.array(a.t, dtype=np.float64) * b.s + np.array(b.t, dtype=np.float64)
+		return FoldScaleTranslate(a.s * b.s, tuple(t))
+	return None
+
+def is_noop(t):
+	if isinstance(t, (FoldRotateX, FoldRotateY, FoldRotateZ)):
+		return is_const(t.a) and t.a == 0.0
+	elif isinstance(t, FoldMatrix):
+		return np.array_equal(t.m, np.identity(3))
+	elif isinstance(t, FoldScaleTranslate):
+		return is_scale_translate(t) and t.s == 1.0 and vec3_eq(t.t, (0,0,0))
+	return False
+
+def optimize(obj, report=None, visited=None):
+	#Rewrites obj.trans in place and returns a summary of the changes
+	if report is None:
+		report = Counter()
+	if visited is None:
+		visited = set()
+	visited.add(id(obj))
+	trans = []
+	for t in obj.trans:
+		if hasattr(t, 'forwared_decl') and id(t) not in visited:
+			optimize(t, report, visited)
+		merged = merge(trans[-1], t) if len(trans) > 0 and hasattr(t, 'fold') else None
+		if merged is not None:
+			report[type(trans[-1]).__name__ + ' + ' + type(t).__name__ + ' -> ' + type(merged).__name__] += 1
+			trans[-1] = merged
+		else:
+			trans.append(t)
+		if is_noop(trans[-1]):
+			report['removed no-op ' + type(trans[-1]).__name__] += 1
+			trans.pop()
+	obj.trans = trans
+	return ['%s (x%d)' % (k, report[k]) for k in report]
+
+def hoist_constants(code):
+	#Moves vec3 literals that appear more than once into shared constants
+	literals = Counter(re.findall(r'vec3\([-+0-9.e]+(?:,\s*[-+0-9.e]+){2}\)', code))
+	decl = ''
+	for i, lit in enumerate(k for k in literals if literals[k] > 1):
+		name = '_const' + str(i)
+		decl += 'const vec3 ' + name + ' = ' + lit + ';\n'
+		code = code.replace(lit, name)
+	return decl + code
@@ -0,0 +1,97 @@
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from .renderer import Renderer
+from .brickmap import load_brickmap
+
+#Per-process state, filled in once by the pool initializer
+_worker = {}
+
+def _init_worker(obj, cam, dtype, shm_name, shape, brickmap):
+	#Objects can also be given as a builder function such as tree_planet
+	if callable(obj):
+		obj = obj()
+	shm = shared_memory.SharedMemory(name=shm_name)
+	_worker['shm'] = shm
+	_worker['image'] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+	_worker['renderer'] = Renderer(obj, cam, dtype)
+	if brickmap is not None:
+		#Every worker maps the same file, so the bricks are only in memory once
+		_worker['renderer'].brickmap = load_brickmap(brickmap)
+
+def _render_tile(args):
+	global_vars, mat, prev_mat, size, rect = args
+	_worker['renderer'].obj.params.update(global_vars)
+	x0, y0, x1, y1 = rect
+	_worker['image'][y0:y1, x0:x1] = _worker['renderer'].render(mat, size, prev_mat, rect)
+	return rect
+
+def make_tiles(size, tile_size):
+	w, h = size
+	tiles = []
+	for y in range(0, h, tile_size):
+		for x in range(0, w, tile_size):
+			tiles.append((x, y, min(x + tile_size, w), min(y + tile_size, h)))
+	return tiles
+
+def estimate_cost(renderer, mat, size, tiles, scale=16):
+	#March one primary ray per scale x scale block and use its step count as the cost
+	w, h = size
+	lw, lh = max(w // scale, 1), max(h // scale, 1)
+	xs = (np.arange(lw) + 0.5) * (w / lw)
+	ys = h - (np.arange(lh) + 0.5) * (h / lh)
+	fx, fy = np.meshgrid(xs, ys)
+	frag = np.stack((fx.ravel(), fy.ravel()), axis=1).astype(renderer.dtype)
+	zero = np.zeros((2,), dtype=renderer.dtype)
+	p, ray, _ = renderer.camera_rays(mat, size, frag, zero, np.zeros((4,), dtype=renderer.dtype))
+	_, s, _, _ = renderer.ray_march(p, ray, 1.0, 0.0)
+	s = s.reshape((lh, lw))
+
+	cost = []
+	for x0, y0, x1, y1 in tiles:
+		bx0, bx1 = x0 * lw // w, max((x1 * lw + w - 1) // w, x0 * lw // w + 1)
+		by0, by1 = y0 * lh // h, max((y1 * lh + h - 1) // h, y0 * lh // h + 1)
+		cost.append(float(np.mean(s[by0:by1, bx0:bx1])) * (x1 - x0) * (y1 - y0))
+	return cost
+
+#Splits frames into tiles and renders them on a process pool into a shared framebuffer.
+class TiledRenderer:
+	def __init__(self, obj, cam, size, tile_size=64, processes=None, dtype=np.float32, brickmap=None):
+		self.cam = cam
+		self.size = size
+		self.tiles = make_tiles(size, tile_size)
+		self.prepass_scale = 16
+
+		#The main process keeps its own copy for the cost prepass
+		self.renderer = Renderer(obj() if callable(obj) else obj, cam, dtype)
+
+		shape = (size[1], size[0], 3)
+		self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+		self.image = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+		self.pool = multiprocessing.Pool(processes, _init_worker, (obj, cam, dtype, self.shm.name, shape, brickmap))
+
+	def render(self, mat, prev_mat=None):
+		order = self.tiles
+		if self.prepass_scale > 0:
+			cost = estimate_cost(self.renderer, mat, self.size, self.tiles, self.prepass_scale)
+			order = [self.tiles[i] for i in np.argsort(cost)[::-1]]
+
+		#Parameters may change between frames, so every tile carries the current values
+		global_vars = dict(self.renderer.obj.params.items())
+		args = [(global_vars, mat, prev_mat, self.size, rect) for rect in order]
+		for _ in self.pool.imap_unordered(_render_tile, args):
+			pass
+		return np.copy(self.image)
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+		self.image = None
+		self.shm.close()
+		self.shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
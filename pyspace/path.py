@@ -0,0 +1,110 @@
+import math
+import numpy as np
+
+#Vectorized camera path processing for recordings of 4x4 camera matrices.
+#Rotations are handled as unit quaternions (x, y, z, w) so that resampling
+#and smoothing never leave the space of rotations.
+
+def mat_to_quat(m):
+	m = np.asarray(m, dtype=np.float64)
+	q = np.empty(m.shape[:-2] + (4,), dtype=np.float64)
+	tr = (m[...,0,0], m[...,1,1], m[...,2,2])
+	q[...,0] = np.copysign(0.5 * np.sqrt(np.maximum(1.0 + tr[0] - tr[1] - tr[2], 0.0)), m[...,2,1] - m[...,1,2])
+	q[...,1] = np.copysign(0.5 * np.sqrt(np.maximum(1.0 - tr[0] + tr[1] - tr[2], 0.0)), m[...,0,2] - m[...,2,0])
+	q[...,2] = np.copysign(0.5 * np.sqrt(np.maximum(1.0 - tr[0] - tr[1] + tr[2], 0.0)), m[...,1,0] - m[...,0,1])
+	q[...,3] = 0.5 * np.sqrt(np.maximum(1.0 + tr[0] + tr[1] + tr[2], 0.0))
+	return normalize_quat(q)
+
+def quat_to_mat(q):
+	x, y, z, w = q[...,0], q[...,1], q[...,2], q[...,3]
+	m = np.empty(q.shape[:-1] + (3,3), dtype=q.dtype)
+	m[...,0,0] = 1 - 2*(y*y + z*z)
+	m[...,0,1] = 2*(x*y - z*w)
+	m[...,0,2] = 2*(x*z + y*w)
+	m[...,1,0] = 2*(x*y + z*w)
+	m[...,1,1] = 1 - 2*(x*x + z*z)
+	m[...,1,2] = 2*(y*z - x*w)
+	m[...,2,0] = 2*(x*z - y*w)
+	m[...,2,1] = 2*(y*z + x*w)
+	m[...,2,2] = 1 - 2*(x*x + y*y)
+	return m
+
+def normalize_quat(q):
+	return q / np.linalg.norm(q, axis=-1)[...,None]
+
+def make_continuous(q):
+	#q and -q are the same rotation, pick signs so neighbors are in the same hemisphere
+	flip = np.sum(q[1:] * q[:-1], axis=1) < 0.0
+	sign = np.concatenate(([1.0], np.where(np.cumsum(flip) % 2 == 1, -1.0, 1.0)))
+	return q * sign[:,None]
+
+def slerp(q0, q1, t):
+	d = np.sum(q0 * q1, axis=-1)
+	q1 = np.where((d < 0.0)[...,None], -q1, q1)
+	d = np.abs(d)
+	theta = np.arccos(np.minimum(d, 1.0))
+	sin_theta = np.sin(theta)
+	#Fall back to a normalized lerp where the angle is too small to divide by
+	near = sin_theta < 1e-6
+	safe = np.where(near, 1.0, sin_theta)
+	w0 = np.where(near, 1.0 - t, np.sin((1.0 - t) * theta) / safe)
+	w1 = np.where(near, t, np.sin(t * theta) / safe)
+	return normalize_quat(q0 * w0[...,None] + q1 * w1[...,None])
+
+def sample_times(times, new_times):
+	#Index of the sample before each new time and the blend factor towards the next one
+	ix = np.clip(np.searchsorted(times, new_times, side='right') - 1, 0, len(times) - 2)
+	dt = times[ix + 1] - times[ix]
+	t = np.clip((new_times - times[ix]) / np.where(dt > 0.0, dt, 1.0), 0.0, 1.0)
+	return ix, t
+
+def lerp_at(times, x, new_times):
+	ix, t = sample_times(times, new_times)
+	t = t.reshape(t.shape + (1,) * (x.ndim - 1))
+	return x[ix] * (1.0 - t) + x[ix + 1] * t
+
+def slerp_at(times, q, new_times):
+	ix, t = sample_times(times, new_times)
+	return slerp(q[ix], q[ix + 1], t)
+
+def smooth(x, decay):
+	#Exponential smoothing y[i] = decay*y[i-1] + (1-decay)*x[i] applied as a truncated
+	#FIR filter with an FFT convolution. The start is padded with the first sample.
+	if decay <= 0.0 or x.shape[0] < 2:
+		return np.copy(x)
+	k = max(int(math.ceil(math.log(1e-6) / math.log(decay))), 1)
+	kernel = (1.0 - decay) * decay ** np.arange(k)
+	kernel /= np.sum(kernel)
+	n = x.shape[0]
+	padded = np.concatenate((np.repeat(x[:1], k - 1, axis=0), x), axis=0)
+	size = 1 << int(math.ceil(math.log2(padded.shape[0] + k - 1)))
+	fx = np.fft.rfft(padded.reshape((padded.shape[0], -1)), size, axis=0)
+	fk = np.fft.rfft(kernel, size)
+	y = np.fft.irfft(fx * fk[:,None], size, axis=0)[k - 1:k - 1 + n]
+	return y.reshape(x.shape)
+
+def make_path(mats, keyvars, times, fps, smoothing=0.0):
+	#Resamples a recording to a fixed frame rate by timestamp. smoothing is the time constant
+	#of the exponential filter in seconds. Returns (mats, keyvars) as float32 arrays.
+	mats = np.asarray(mats, dtype=np.float64)
+	keyvars = np.asarray(keyvars, dtype=np.float64)
+	times = np.asarray(times, dtype=np.float64)
+	if times.shape[0] < 2:
+		return mats.astype(np.float32), keyvars.astype(np.float32)
+
+	new_times = np.arange(times[0], times[-1], 1.0 / fps)
+	pos = lerp_at(times, mats[:,3,:3], new_times)
+	quat = slerp_at(times, make_continuous(mat_to_quat(mats[:,:3,:3])), new_times)
+	new_vars = lerp_at(times, keyvars, new_times)
+
+	if smoothing > 0.0:
+		decay = math.exp(-1.0 / (fps * smoothing))
+		pos = smooth(pos, decay)
+		quat = normalize_quat(smooth(make_continuous(quat), decay))
+		new_vars = smooth(new_vars, decay)
+
+	out = np.zeros((new_times.shape[0], 4, 4), dtype=np.float32)
+	out[:,:3,:3] = quat_to_mat(quat)
+	out[:,3,:3] = pos
+	out[:,3,3] = 1.0
+	return out, new_vars.astype(np.float32)
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+from OpenGL.GL import *
+from .shader import Shader
+from .util import cone_stats
+
+#Renders the low resolution cone marching pass into a float texture that the
+#main shader samples as iConeDepth. Both programs share the scene's parameters.
+class ConePrepass:
+	def __init__(self, obj, cam, size, cache=None):
+		self.block = cam['CONE_PREPASS_BLOCK']
+		self.full_size = size
+		self.size = (int(math.ceil(size[0] / self.block)), int(math.ceil(size[1] / self.block)))
+
+		cone_cam = cam.copy()
+		cone_cam['CONE_PASS'] = True
+		self.shader = Shader(obj, cache=cache)
+		self.program = self.shader.compile(cone_cam)
+		self.version = None
+		self.uploaded = {}
+		self.mat_id = glGetUniformLocation(self.program, 'iMat')
+		self.res_id = glGetUniformLocation(self.program, 'iResolution')
+
+		self.texture = glGenTextures(1)
+		glBindTexture(GL_TEXTURE_2D, self.texture)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+		glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, self.size[0], self.size[1], 0, GL_RGBA, GL_FLOAT, None)
+		glBindTexture(GL_TEXTURE_2D, 0)
+
+		self.fbo = glGenFramebuffers(1)
+		glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+		glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+		if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+			raise Exception("Float framebuffers are not supported")
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+	def render(self, mat):
+		#Leaves the cone texture bound to unit 0 for the main pass, which has to be bound again
+		glUseProgram(self.program)
+		self.upload_params()
+		glUniformMatrix4fv(self.mat_id, 1, False, mat)
+		glUniform2fv(self.res_id, 1, np.array(self.full_size, dtype=np.float32))
+
+		glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+		glViewport(0, 0, self.size[0], self.size[1])
+		glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+		glViewport(0, 0, self.full_size[0], self.full_size[1])
+
+		glActiveTexture(GL_TEXTURE0)
+		glBindTexture(GL_TEXTURE_2D, self.texture)
+
+	def upload_params(self):
+		#The main shader clears the shared dirty flags, so remember what this program was given
+		params = self.shader.params
+		if params.version == self.version:
+			return
+		for k in self.shader.keys:
+			val = params[k]
+			if k not in self.uploaded or not np.array_equal(self.uploaded[k], val):
+				self.shader.upload(k)
+				self.uploaded[k] = val if type(val) is float else np.copy(val)
+		self.version = params.version
+
+	def stats(self):
+		#Reads back the cone buffer, every pixel of a block skips the steps of its cone
+		glBindTexture(GL_TEXTURE_2D, self.texture)
+		data = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+		cone = np.frombuffer(data, dtype=np.float32).reshape((self.size[1], self.size[0], 4))
+
+		#Blocks on the right and top edges may only be partially covered
+		w, h = self.full_size
+		bw = np.minimum(self.block, w - np.arange(self.size[0]) * self.block)
+		bh = np.minimum(self.block, h - np.arange(self.size[1]) * self.block)
+		return cone_stats(np.sum(cone[:,:,2]), np.sum(cone[:,:,1] * (bh[:,None] * bw[None,:])), w * h)
+
+	def close(self):
+		glDeleteFramebuffers(1, [self.fbo])
+		glDeleteTextures([self.texture])
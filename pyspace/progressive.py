@@ -0,0 +1,61 @@
+import numpy as np
+from OpenGL.GL import *
+from .util import halton_jitter
+
+#Averages one jittered sample per frame into a float framebuffer while the view is unchanged.
+#Each new sample is blended with weight 1/n, so the buffer always holds the running mean.
+class Accumulator:
+	def __init__(self, size, max_samples=256):
+		self.size = size
+		self.max_samples = max_samples
+		self.samples = 0
+		self.state = None
+
+		self.texture = glGenTextures(1)
+		glBindTexture(GL_TEXTURE_2D, self.texture)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+		glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+		glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, size[0], size[1], 0, GL_RGBA, GL_FLOAT, None)
+		glBindTexture(GL_TEXTURE_2D, 0)
+
+		self.fbo = glGenFramebuffers(1)
+		glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+		glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+		if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+			raise Exception("Float framebuffers are not supported")
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+	def update(self, mat, prev_mat, version):
+		#Any camera motion or parameter change starts over from a single sample
+		state = (np.asarray(mat).tobytes(), np.asarray(prev_mat).tobytes(), version)
+		if state != self.state:
+			self.state = state
+			self.samples = 0
+
+	def done(self):
+		return self.samples >= self.max_samples
+
+	def jitter(self):
+		return halton_jitter(self.samples)
+
+	def begin(self):
+		glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+		glEnable(GL_BLEND)
+		glBlendFunc(GL_CONSTANT_ALPHA, GL_ONE_MINUS_CONSTANT_ALPHA)
+		glBlendColor(0.0, 0.0, 0.0, 1.0 / (self.samples + 1))
+
+	def end(self):
+		glDisable(GL_BLEND)
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+		self.samples += 1
+
+	def present(self):
+		w, h = self.size
+		glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+		glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+		glBlitFramebuffer(0, 0, w, h, 0, 0, w, h, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+	def close(self):
+		glDeleteFramebuffers(1, [self.fbo])
+		glDeleteTextures([self.texture])
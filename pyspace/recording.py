@@ -0,0 +1,95 @@
+import struct
+import time
+import numpy as np
+
+#File layout: a fixed size header followed by packed records.
+#The record count in the header is only advanced after the records
+#it covers were flushed, so a crash loses at most the last interval.
+MAGIC = b'PYSR'
+VERSION = 1
+HEADER_FORMAT = '<4sIIQ'
+HEADER_SIZE = 64
+COUNT_OFFSET = 12
+
+def record_dtype(num_vars):
+	return np.dtype([('mat', '<f4', (4,4)), ('vars', '<f4', (num_vars,)), ('time', '<f8')])
+
+def read_header(fname):
+	with open(fname, 'rb') as f:
+		magic, version, num_vars, count = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+	if magic != MAGIC:
+		raise Exception("Not a recording file: " + fname)
+	if version != VERSION:
+		raise Exception("Unsupported recording version: " + str(version))
+	return num_vars, count
+
+def load_recording(fname):
+	#Returns a read-only structured array backed by the file, fields are zero-copy views
+	num_vars, count = read_header(fname)
+	dtype = record_dtype(num_vars)
+	if count == 0:
+		return np.zeros((0,), dtype=dtype)
+	return np.memmap(fname, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+#Appends camera records to a preallocated memory-mapped file that doubles when full.
+class Recorder:
+	def __init__(self, fname, num_vars=6, capacity=4096, flush_interval=1.0):
+		self.fname = fname
+		self.num_vars = num_vars
+		self.dtype = record_dtype(num_vars)
+		self.flush_interval = flush_interval
+		self.count = 0
+		self.start_time = time.perf_counter()
+		self.last_flush = self.start_time
+
+		self.f = open(fname, 'w+b')
+		self.f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, num_vars, 0).ljust(HEADER_SIZE, b'\0'))
+		self.f.flush()
+		self.records = None
+		self.resize(capacity)
+
+	def resize(self, capacity):
+		if self.records is not None:
+			self.records.flush()
+			self.records = None
+		self.capacity = capacity
+		self.f.truncate(HEADER_SIZE + capacity * self.dtype.itemsize)
+		self.records = np.memmap(self.f, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+
+	def append(self, mat, keyvars, t=None):
+		if self.count == self.capacity:
+			self.resize(self.capacity * 2)
+		rec = self.records[self.count]
+		rec['mat'] = mat
+		rec['vars'] = keyvars
+		rec['time'] = time.perf_counter() - self.start_time if t is None else t
+		self.count += 1
+
+		now = time.perf_counter()
+		if now - self.last_flush >= self.flush_interval:
+			self.flush()
+			self.last_flush = now
+
+	def flush(self):
+		self.records.flush()
+		self.f.seek(COUNT_OFFSET)
+		self.f.write(struct.pack('<Q', self.count))
+		self.f.flush()
+
+	def close(self):
+		if self.f is None:
+			return
+		self.flush()
+		self.records = None
+		self.f.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+		self.f.close()
+		self.f = None
+
+	def __len__(self):
+		return self.count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
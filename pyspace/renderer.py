@@ -0,0 +1,459 @@
+import math
+import numpy as np
+from .util import *
+
+#CPU reference renderer that mirrors frag.glsl using batched ray packets.
+class Renderer:
+	def __init__(self, obj, cam, dtype=np.float32):
+		self.obj = obj
+		self.cam = cam
+		self.dtype = dtype
+		self.packet_size = 16384
+		self.ipd = 0.04
+		self.cone_stats = None
+		self.brickmap = None
+
+	def DE(self, p):
+		if self.brickmap is None or not self.brickmap.matches(self.obj.params):
+			return self.obj.DE_batch(p) * self.cam['STEP_MULTIPLIER']
+		#The brick map's lower bound is used for far steps, only points near the surface get the exact DE
+		d = self.brickmap.DE_batch(p).astype(p.dtype)
+		near = d < self.brickmap.cell_size
+		if np.any(near):
+			d[near] = self.obj.DE_batch(p[near])
+		return d * self.cam['STEP_MULTIPLIER']
+
+	def COL(self, p):
+		return self.obj.COL_batch(p)
+
+	def ray_march(self, p, ray, sharpness, td):
+		cam = self.cam
+		max_marches = cam['MAX_MARCHES']
+		min_dist = cam['MIN_DIST']
+		max_dist = cam['MAX_DIST']
+		omega = cam['RELAXATION_OMEGA']
+		n = p.shape[0]
+		d = np.full((n,), min_dist, dtype=p.dtype)
+		s = np.full((n,), float(max_marches), dtype=p.dtype)
+		td = np.full((n,), td, dtype=p.dtype)
+		min_d = np.ones((n,), dtype=p.dtype)
+
+		#Only the rays that are still marching are kept in the packet
+		ix = np.arange(n)
+		pa = p.copy()
+		ra = np.broadcast_to(ray, p.shape)
+		tda = td.copy()
+		ma = min_d.copy()
+		wa = np.full((n,), omega, dtype=p.dtype)
+		step = np.zeros((n,), dtype=p.dtype)
+		prev_d = np.zeros((n,), dtype=p.dtype)
+		max_td = np.full((n,), max_dist, dtype=p.dtype)
+		skip_len = None
+		if self.obj.bound is not None and not cam['GLOW_ENABLED']:
+			#Only march the part of each ray inside the scene's bounding sphere,
+			#glow needs the closest approach of every ray so then all of them are marched
+			enter, exit = sphere_span(pa[:,:3], ra[:,:3], *self.obj.bound)
+			miss = enter > exit
+			d[miss] = 1e20
+			s[miss] = 0.0
+			td[miss] = max_dist
+			keep = ~miss
+			ix, pa, ra, tda, ma = ix[keep], pa[keep], ra[keep], tda[keep], ma[keep]
+			wa, step, prev_d = wa[keep], step[keep], prev_d[keep]
+			max_td = np.minimum(max_td[keep], tda + exit[keep])
+			skip_len = enter[keep]
+			skip_d = np.zeros_like(skip_len)
+			far = skip_len > 0.0
+			if np.any(far):
+				skip_d[far] = self.DE(pa[far])
+			tda += skip_len
+			pa += ra * skip_len[:,None]
+		skipped = np.zeros((ix.shape[0],), dtype=p.dtype)
+		for i in range(max_marches):
+			if ix.shape[0] == 0:
+				break
+			da = self.DE(pa)
+			if i == 0 and skip_len is not None:
+				#Ambient occlusion still counts the steps of the skipped part
+				skipped = skipped_steps(skip_d, da, skip_len, min_dist).astype(p.dtype)
+			if omega > 1.0:
+				#The unbounding spheres don't overlap, go back to a regular step
+				fail = (wa > 1.0) & (da + prev_d < step)
+				hit = (da < min_dist) & ~fail
+				done = hit | ((tda > max_td) & ~fail)
+			else:
+				hit = da < min_dist
+				done = hit | (tda > max_td)
+			if np.any(done):
+				#Rays that left the bounding sphere can't hit anything anymore
+				left = done & ~hit & (tda < max_dist)
+				da[left] = 1e20
+				tda[left] = max_dist
+				fx = ix[done]
+				d[fx] = da[done]
+				s[fx] = i + np.where(hit[done], da[done] / min_dist, 0.0) + skipped[done]
+				td[fx] = tda[done]
+				min_d[fx] = ma[done]
+				p[fx] = pa[done]
+				keep = ~done
+				ix, pa, ra, tda, ma, da = ix[keep], pa[keep], ra[keep], tda[keep], ma[keep], da[keep]
+				wa, step, prev_d, max_td, skipped = wa[keep], step[keep], prev_d[keep], max_td[keep], skipped[keep]
+				if omega > 1.0:
+					fail = fail[keep]
+			if omega > 1.0:
+				step = np.where(fail, step * (1.0 - wa), da * wa)
+				prev_d = np.where(fail, prev_d, da)
+				tda += step
+				pa += ra * step[:,None]
+				ok = ~fail
+				ma[ok] = np.minimum(ma[ok], sharpness * da[ok] / tda[ok])
+				wa[fail] = 1.0
+			else:
+				tda += da
+				pa += ra * da[:,None]
+				ma = np.minimum(ma, sharpness * da / tda)
+
+		#Rays that ran out of marches
+		if ix.shape[0] > 0:
+			d[ix] = da
+			s[ix] += skipped
+			td[ix] = tda
+			min_d[ix] = ma
+			p[ix] = pa
+		return d, s, td, min_d
+
+	def cone_march(self, p, ray, a, b):
+		#Neighbor rays stay within a + b*t of this ray, so steps only use the part of the
+		#distance estimate that is left after covering them
+		cam = self.cam
+		max_marches = cam['MAX_MARCHES']
+		min_dist = cam['MIN_DIST']
+		max_dist = cam['MAX_DIST']
+		n = p.shape[0]
+		td = np.zeros((n,), dtype=p.dtype)
+		cone_steps = np.full((n,), float(max_marches), dtype=p.dtype)
+
+		ix = np.arange(n)
+		pa = p.copy()
+		ra = ray
+		tda = td.copy()
+		for i in range(max_marches):
+			if ix.shape[0] == 0:
+				break
+			step = (self.DE(pa) - a - b*tda) / (1.0 + b)
+			done = (step < min_dist) | (tda > max_dist)
+			if np.any(done):
+				td[ix[done]] = tda[done]
+				cone_steps[ix[done]] = i
+				keep = ~done
+				ix, pa, ra, tda, step = ix[keep], pa[keep], ra[keep], tda[keep], step[keep]
+			tda += step
+			pa += ra * step[:,None]
+		td[ix] = tda
+
+		#Ambient occlusion depends on the step count, so count the steps of a regular march
+		s = np.full((n,), float(max_marches), dtype=p.dtype)
+		ix = np.arange(n)
+		pa = p.copy()
+		ra = ray
+		ta = np.zeros((n,), dtype=p.dtype)
+		for i in range(max_marches):
+			done = ta >= td[ix]
+			if np.any(done):
+				s[ix[done]] = i
+				keep = ~done
+				ix, pa, ra, ta = ix[keep], pa[keep], ra[keep], ta[keep]
+			if ix.shape[0] == 0:
+				break
+			d = self.DE(pa)
+			ta += d
+			pa += ra * d[:,None]
+		return td, s, cone_steps + s
+
+	def cone_prepass(self, mat, size, frag):
+		#Returns the start distance and step count for each fragment, or None if disabled
+		cam = self.cam
+		block = cam['CONE_PREPASS_BLOCK']
+		if block <= 0 or cam['ODS'] or cam['ORTHOGONAL_PROJECTION']:
+			return None
+		bix = np.floor(frag / block).astype(np.int64)
+		blocks, inverse = np.unique(bix, axis=0, return_inverse=True)
+		inverse = inverse.ravel()
+		zero = np.zeros((2,), dtype=self.dtype)
+		p, ray, _ = self.camera_rays(mat, size, ((blocks + 0.5) * block).astype(self.dtype), zero, np.zeros((4,), dtype=self.dtype))
+
+		focal_dist = 1.0 / math.tan(math.pi * cam['FIELD_OF_VIEW'] / 360.0)
+		a = cam['DEPTH_OF_FIELD_STRENGTH'] * math.sqrt(2.0) / size[0]
+		b = (block + 1) * math.sqrt(2.0) / (size[1] * focal_dist) + a / cam['DEPTH_OF_FIELD_DISTANCE']
+		td, s, cost = self.cone_march(p, ray, a, b)
+		start = np.stack((td[inverse], s[inverse]), axis=1)
+		self.cone_stats = cone_stats(np.sum(cost), np.sum(start[:,1]), frag.shape[0])
+		return start
+
+	def calc_normal(self, p, dx):
+		if self.cam['ANALYTIC_NORMALS']:
+			g = self.obj.DE_grad_batch(p)[1]
+			return g / np.maximum(np.linalg.norm(g, axis=1), 1e-30)[:,None]
+		k = np.array([[1,-1,-1,0], [-1,-1,1,0], [-1,1,-1,0], [1,1,1,0]], dtype=p.dtype)
+		n = p.shape[0]
+		q = (p[None,:,:] + k[:,None,:]*dx).reshape((4*n, 4))
+		d = self.DE(q).reshape((4, n))
+		g = np.dot(d.T, k[:,:3])
+		#Avoid NaNs where the gradient vanishes
+		return g / np.maximum(np.linalg.norm(g, axis=1), 1e-30)[:,None]
+
+	def scene(self, origin, ray, vignette, start=None):
+		cam = self.cam
+		light_dir = np.array(cam['LIGHT_DIRECTION'], dtype=origin.dtype)
+		light_col = np.array(cam['LIGHT_COLOR'], dtype=origin.dtype)
+		bg_col = np.array(cam['BACKGROUND_COLOR'], dtype=origin.dtype)
+
+		#Trace the ray, skipping the distance and steps already covered by the cone prepass
+		p = origin.copy()
+		td = 0.0
+		if start is not None:
+			td = start[:,0]
+			p += ray * td[:,None]
+		d, s, td, m = self.ray_march(p, ray, cam['GLOW_SHARPNESS'], td)
+		if start is not None:
+			s = s + start[:,1]
+
+		#Determine the color for each ray
+		col = np.zeros((p.shape[0], 3), dtype=origin.dtype)
+		min_dist = cam['MIN_DIST'] * np.maximum(td * cam['LOD_MULTIPLIER'], 1.0)
+		hit = d < min_dist
+		if np.any(hit):
+			ph = p[hit]
+			rh = ray[hit]
+			md = min_dist[hit][:,None]
+
+			#Get the surface normal
+			n = self.calc_normal(ph, cam['MIN_DIST'] * 10)
+			reflected = rh[:,:3] - 2.0*np.sum(rh[:,:3]*n, axis=1)[:,None] * n
+
+			#Get coloring
+			orig_col = np.clip(self.COL(ph)[:,:3], 0.0, 1.0)
+
+			#Get if this point is in shadow
+			k = np.ones((ph.shape[0],), dtype=origin.dtype)
+			if cam['SHADOWS_ENABLED']:
+				light_pt = ph.copy()
+				light_pt[:,:3] += n * md * 10
+				light_ray = np.append(light_dir, 0.0).astype(origin.dtype)
+				_, _, rm_td, rm_m = self.ray_march(light_pt, light_ray, cam['SHADOW_SHARPNESS'], 0.0)
+				k = rm_m * np.minimum(rm_td, 1.0)
+
+			#Get specular
+			if cam['SPECULAR_HIGHLIGHT'] > 0:
+				specular = np.maximum(np.dot(reflected, light_dir), 0.0)
+				specular = np.power(specular, cam['SPECULAR_HIGHLIGHT'])
+				col[hit] += (specular * k)[:,None] * light_col
+
+			#Get diffuse lighting
+			if cam['DIFFUSE_ENHANCED_ENABLED']:
+				k = np.minimum(k, cam['SHADOW_DARKNESS'] * 0.5 * (np.dot(n, light_dir) - 1.0) + 1.0)
+			elif cam['DIFFUSE_ENABLED']:
+				k = np.minimum(k, np.dot(n, light_dir))
+
+			#Don't make shadows entirely dark
+			k = np.maximum(k, 1.0 - cam['SHADOW_DARKNESS'])
+			ch = col[hit] + orig_col * light_col * k[:,None]
+
+			#Add small amount of ambient occlusion
+			a = 1.0 / (1.0 + s[hit] * cam['AMBIENT_OCCLUSION_STRENGTH'])
+			ch += (1.0 - a)[:,None] * np.array(cam['AMBIENT_OCCLUSION_COLOR_DELTA'], dtype=origin.dtype)
+
+			#Add fog effects
+			if cam['FOG_ENABLED']:
+				a = (td[hit] / cam['MAX_DIST'])[:,None]
+				ch = (1.0 - a) * ch + a * bg_col
+
+			#Set up the reflection
+			origin[hit] = ph
+			origin[hit,:3] += n * md * 100
+			ray[hit,:3] = reflected
+			ray[hit,3] = 0.0
+
+			#Apply vignette if needed
+			if cam['VIGNETTE_FOREGROUND']:
+				ch *= vignette[hit][:,None]
+			col[hit] = ch
+
+		miss = ~hit
+		if np.any(miss):
+			#Ray missed, start with solid background color
+			cm = np.tile(bg_col, (np.count_nonzero(miss), 1))
+
+			#Apply glow
+			if cam['GLOW_ENABLED']:
+				mm = m[miss][:,None]
+				cm += (1.0 - mm) * (1.0 - mm) * np.array(cam['GLOW_COLOR_DELTA'], dtype=origin.dtype)
+
+			cm *= vignette[miss][:,None]
+			#Background specular
+			if cam['SUN_ENABLED']:
+				sun_size = cam['SUN_SIZE']
+				sun_spec = np.dot(ray[miss,:3], light_dir) - 1.0 + sun_size
+				sun_spec = np.minimum(np.exp(sun_spec * cam['SUN_SHARPNESS'] / sun_size), 1.0)
+				cm += sun_spec[:,None] * light_col
+			col[miss] = cm
+		return col, td
+
+	def camera_rays(self, mat, size, frag, delta, dxy):
+		cam = self.cam
+		mat = np.asarray(mat, dtype=self.dtype)
+		res = np.array(size, dtype=self.dtype)
+		n = frag.shape[0]
+		if cam['ODS']:
+			#Get the normalized screen coordinate
+			ods_coord = frag * np.array([1.0, 2.0], dtype=self.dtype)
+			top = ods_coord[:,1] >= res[1]
+			ods_coord[top,1] -= res[1]
+			screen_pos = (ods_coord + delta) / res
+			scale = np.where(top, 0.5, -0.5) * self.ipd
+			theta = -2*math.pi*screen_pos[:,0]
+			phi = -0.5*math.pi + screen_pos[:,1]*math.pi
+			scale = scale * np.cos(phi)
+			zero = np.zeros((n,), dtype=self.dtype)
+			off = np.stack((np.cos(theta) * scale, zero, np.sin(theta) * scale, zero), axis=1)
+			p = mat[3] - np.dot(off, mat)
+			ray = np.stack((np.sin(theta)*np.cos(phi), np.sin(phi), np.cos(theta)*np.cos(phi), zero), axis=1)
+			ray = np.dot(ray, mat)
+		else:
+			#Get normalized screen coordinate
+			screen_pos = (frag + delta) / res
+			uv = 2*screen_pos - 1
+			uv[:,0] *= res[0] / res[1]
+			focal_dist = 1.0 / math.tan(math.pi * cam['FIELD_OF_VIEW'] / 360.0)
+
+			#Convert screen coordinate to 3d ray
+			if cam['ORTHOGONAL_PROJECTION']:
+				ray = np.dot(np.array([0.0, 0.0, -1.0, 0.0], dtype=self.dtype), mat)
+				ray = np.tile(ray, (n, 1))
+				off = np.zeros((n, 4), dtype=self.dtype)
+				off[:,:2] = uv
+				p = mat[3] + np.dot(off, mat) * cam['ORTHOGONAL_ZOOM']
+			else:
+				ray = np.zeros((n, 4), dtype=self.dtype)
+				ray[:,:2] = uv
+				ray[:,2] = -focal_dist
+				ray = normalize_batch(ray)
+				ray = normalize_batch(ray * cam['DEPTH_OF_FIELD_DISTANCE'] + dxy)
+				ray = np.dot(ray, mat)
+				p = np.tile(mat[3] - np.dot(dxy, mat), (n, 1))
+		vignette = 1.0 - cam['VIGNETTE_STRENGTH'] * np.linalg.norm(screen_pos - 0.5, axis=1)
+		return p.astype(self.dtype), ray.astype(self.dtype), vignette.astype(self.dtype)
+
+	def render_rays(self, p, ray, vignette, start=None):
+		cam = self.cam
+		if cam['REFLECTION_LEVEL'] > 0:
+			col = np.zeros((p.shape[0], 3), dtype=self.dtype)
+			ix = np.arange(p.shape[0])
+			ref_alpha = 1.0
+			td = None
+			for r in range(cam['REFLECTION_LEVEL'] + 1):
+				ref_alpha *= cam['REFLECTION_ATTENUATION']
+				prev_ray = ray.copy()
+				c, t = self.scene(p, ray, vignette, start)
+				start = None
+				col[ix] += ref_alpha * c
+				if td is None:
+					td = t
+				keep = np.any(ray != prev_ray, axis=1)
+				ix, p, ray, vignette = ix[keep], p[keep], ray[keep], vignette[keep]
+				if ix.shape[0] == 0:
+					break
+			return col, td
+		return self.scene(p, ray, vignette, start)
+
+	def frag_coords(self, size, rect):
+		#Fragment coordinates of pixel centers with the origin at the bottom-left
+		w, h = size
+		x0, y0, x1, y1 = rect if rect is not None else (0, 0, w, h)
+		xs = np.arange(x0, x1, dtype=self.dtype) + 0.5
+		ys = (h - np.arange(y0, y1, dtype=self.dtype)) - 0.5
+		fx, fy = np.meshgrid(xs, ys)
+		return np.stack((fx.ravel(), fy.ravel()), axis=1), (y1 - y0, x1 - x0)
+
+	def render_sample(self, mat, size, frag, delta, delta2, start=None):
+		#One sample for every fragment with a sub-pixel offset and a depth of field lens offset
+		col = np.empty((frag.shape[0], 3), dtype=self.dtype)
+		depth = np.empty((frag.shape[0],), dtype=self.dtype)
+		dxy = np.zeros((4,), dtype=self.dtype)
+		dxy[:2] = delta2 * self.cam['DEPTH_OF_FIELD_STRENGTH'] / size[0]
+		for b in range(0, frag.shape[0], self.packet_size):
+			p, ray, vignette = self.camera_rays(mat, size, frag[b:b+self.packet_size], delta, dxy)
+			st = None if start is None else start[b:b+self.packet_size]
+			col[b:b+self.packet_size], depth[b:b+self.packet_size] = self.render_rays(p, ray, vignette, st)
+		return col, depth
+
+	def render(self, mat, size, prev_mat=None, rect=None):
+		cam = self.cam
+		if prev_mat is None:
+			prev_mat = mat
+		mat = np.asarray(mat, dtype=self.dtype)
+		prev_mat = np.asarray(prev_mat, dtype=self.dtype)
+		frag, shape = self.frag_coords(size, rect)
+		start = self.cone_prepass(mat, size, frag)
+
+		aa = cam['ANTIALIASING_SAMPLES']
+		blur = cam['MOTION_BLUR_LEVEL']
+		col = np.zeros((frag.shape[0], 3), dtype=self.dtype)
+		depth = np.zeros((frag.shape[0],), dtype=self.dtype)
+		for k in range(blur + 1):
+			m = mat
+			if blur > 0:
+				a = cam['MOTION_BLUR_RATIO'] * float(k) / (blur + 1)
+				m = prev_mat*a + mat*(1.0 - a)
+			for i in range(aa):
+				for j in range(aa):
+					delta = np.array([i, j], dtype=self.dtype) / aa
+					delta2 = np.array([rand(i, 0, 1), rand(j + 0.1, 0, 1)], dtype=self.dtype)
+					#Only the unblurred sample matches the camera of the prepass
+					c, td = self.render_sample(m, size, frag, delta, delta2, start if k == 0 else None)
+					col += c
+					depth += td
+
+		samples = aa * aa * (blur + 1)
+		col = np.clip(col * (cam['EXPOSURE'] / samples), 0.0, 1.0)
+		self.depth = np.minimum(depth / (samples * cam['MAX_DIST']), 0.999).reshape(shape)
+		return col.reshape(shape + (3,))
+
+	def render_progressive(self, mat, size, max_samples=None, noise=0.0, min_samples=4, rect=None):
+		#Averages jittered samples like the GL accumulator until max_samples are taken or,
+		#when noise is given, until the mean standard error of the pixels drops below it
+		cam = self.cam
+		if max_samples is None:
+			max_samples = cam['PROGRESSIVE_MAX_SAMPLES']
+		mat = np.asarray(mat, dtype=self.dtype)
+		frag, shape = self.frag_coords(size, rect)
+		start = self.cone_prepass(mat, size, frag)
+
+		mean = np.zeros((frag.shape[0], 3), dtype=np.float64)
+		m2 = np.zeros((frag.shape[0], 3), dtype=np.float64)
+		depth = np.zeros((frag.shape[0],), dtype=np.float64)
+		self.noise = float('inf')
+		n = 0
+		while n < max_samples:
+			jitter = halton_jitter(n).astype(self.dtype)
+			c, td = self.render_sample(mat, size, frag, jitter[:2], jitter[2:], start)
+			c = np.clip(c * cam['EXPOSURE'], 0.0, 1.0)
+			n += 1
+
+			#Welford's running mean and variance
+			delta = c - mean
+			mean += delta / n
+			m2 += delta * (c - mean)
+			depth += (td - depth) / n
+			if n >= max(min_samples, 2):
+				self.noise = float(np.mean(np.sqrt(m2 / (n * (n - 1)))))
+				if self.noise <= noise:
+					break
+
+		self.samples = n
+		self.depth = np.minimum(depth / cam['MAX_DIST'], 0.999).reshape(shape).astype(self.dtype)
+		return mean.reshape(shape + (3,)).astype(self.dtype)
+
+def rand(s, min_v, max_v):
+	r = math.sin(s*s*27.12345 + 1000.9876 / (s*s + 1e-5))
+	return (r + 1.0) * 0.5 * (max_v - min_v) + min_v
@@ -1,53 +1,239 @@
 from ctypes import *
+from concurrent.futures import ThreadPoolExecutor
 from OpenGL.GL import *
-from .util import _PYSPACE_GLOBAL_VARS, to_vec3, to_str
-from . import camera
+from OpenGL.GL.KHR.parallel_shader_compile import glInitParallelShaderCompileKHR, glMaxShaderCompilerThreadsKHR, GL_COMPLETION_STATUS_KHR
+from .util import vec3_str, float_str
+from .optimize import optimize, hoist_constants
+from .cache import canonical
 import os
 
 class Shader:
-	def __init__(self, obj):
+	def __init__(self, obj, optimize=False, cache=None):
 		self.obj = obj
+		self.params = obj.params
 		self.keys = {}
+		self.optimize = optimize
+		self.optimized = False
+		self.cache = cache
+		self.program = None
+		self.locations = {}
+		self.variants = {}
+		self.pending = {}
+		self.toggles = {}
+		self.pool = None
+		self.parallel = None
 
 	def set(self, key, val):
-		if key in _PYSPACE_GLOBAL_VARS:
-			cur_val = _PYSPACE_GLOBAL_VARS[key]
-			if type(val) is float and type(cur_val) is not float:
-				val = to_vec3(val)
-		_PYSPACE_GLOBAL_VARS[key] = val
+		#Only records the value and the ones derived from it, changed uniforms are uploaded by flush()
+		self.params.set(key, val)
+
+	def get(self, key):
+		if key in self.params:
+			return self.params[key]
+		return None
+
+	def flush(self):
+		for key in self.params.dirty:
+			self.upload(key)
+		self.params.dirty.clear()
+
+	def upload(self, key):
 		if key in self.keys:
 			key_id = self.keys[key]
+			val = self.params[key]
 			if type(val) is float:
 				glUniform1f(key_id, val)
 			else:
 				glUniform3fv(key_id, 1, val)
 
-	def get(self, key):
-		if key in _PYSPACE_GLOBAL_VARS:
-			return _PYSPACE_GLOBAL_VARS[key]
-		return None
-
 	def compile(self, cam):
+		#Compiles the variant for cam right away and makes it the current program
+		program = self.variant(self.queue(cam, False))
+		self.bind(program)
+		return program
+
+	def source(self, cam):
 		#Open the shader source
 		vert_dir = os.path.join(os.path.dirname(__file__), 'vert.glsl')
 		frag_dir = os.path.join(os.path.dirname(__file__), 'frag.glsl')
 		v_shader = open(vert_dir).read()
 		f_shader = open(frag_dir).read()
 
+		#Check for previously generated code of an identical scene
+		key = None
+		cached = None
+		if self.cache is not None:
+			var_types = [(k, type(self.params[k]) is float) for k in sorted(self.params)]
+			key = self.cache.key(canonical(self.obj), canonical(cam.defines()), canonical(var_types),
+				str(self.optimize), v_shader, f_shader)
+			cached = self.cache.get(key, 'frag')
+		if cached is not None:
+			f_shader = cached.decode('utf-8')
+		else:
+			f_shader = self.generate(cam, f_shader)
+			if self.cache is not None:
+				self.cache.put(key, 'frag', f_shader.encode('utf-8'))
+
+		#Debugging the shader
+		#open('frag_gen.glsl', 'w').write(f_shader)
+		return key, v_shader, f_shader
+
+	def queue(self, cam, background=True):
+		#Simplify the fold chain before generating any code, the variants all share it
+		if not self.optimized:
+			if self.optimize:
+				for line in optimize(self.obj):
+					print("Optimized: " + line)
+			#The scene code is the same for every variant, so its size is only reported once
+			rolled, unrolled = self.obj.compiled_size()
+			print("Generated %d bytes of scene code (%d fully unrolled)" % (rolled if self.obj.roll_loops else unrolled, unrolled))
+			self.optimized = True
+		self.check_params(self.obj, set())
+
+		#Live camera params get their uniform slot and initial value from the camera
+		for k in cam.live:
+			if k not in self.params:
+				self.params.set(k, cam[k])
+
+		#Variants are told apart by their defines, which all come from the camera
+		var_key = canonical(cam.defines())
+		if var_key in self.variants:
+			return var_key
+		if var_key not in self.pending:
+			var_cam = cam.copy()
+			if background:
+				if self.pool is None:
+					self.pool = ThreadPoolExecutor(max_workers=1)
+				job = self.pool.submit(self.source, var_cam)
+			else:
+				job = self.source(var_cam)
+			self.pending[var_key] = [job, None]
+		return var_key
+
+	def check_params(self, obj, visited):
+		#Uniforms are declared and uploaded from the scene's store only, so keyed params of
+		#nested objects have to live in it as well
+		for t in obj.trans:
+			if hasattr(t, 'forwared_decl') and t.name not in visited:
+				visited.add(t.name)
+				if t.params is not self.params and len(t.params) > 0:
+					raise Exception("Nested object " + t.name + " has its own ParamStore, build it under the store of " + self.obj.name)
+				self.check_params(t, visited)
+
+	def prepare(self, cam, toggles):
+		#Generates and compiles in the background every variant that differs from cam in one
+		#of the toggled defines, e.g. {'SHADOWS_ENABLED': (True, False), 'REFLECTION_LEVEL': (0, 1, 2)}.
+		#The work is spread over the frames by pump().
+		self.toggles = toggles
+		for k in toggles:
+			for val in toggles[k]:
+				var_cam = cam.copy()
+				var_cam[k] = val
+				self.queue(var_cam)
+
+	def pump(self):
+		#Advances the pending variants, called once per frame from the thread that owns the
+		#context. At most one variant starts compiling per call, drivers without parallel
+		#compiles finish it right away and the rest wait until the driver reports them done.
+		if self.parallel is None:
+			self.parallel = bool(glInitParallelShaderCompileKHR())
+			if self.parallel:
+				glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+		started = False
+		for var_key in list(self.pending):
+			job, link = self.pending[var_key]
+			if link is None:
+				if started or (hasattr(job, 'done') and not job.done()):
+					continue
+				if hasattr(job, 'done'):
+					job = job.result()
+				self.pending[var_key][1] = link = self.start(*job)
+				started = True
+			if self.ready(link):
+				self.finish(var_key)
+
+	def switch(self, cam):
+		#Makes the variant for cam current, which only stalls if it isn't ready yet
+		program = self.variant(self.queue(cam))
+		self.bind(program)
+		glUseProgram(program)
+		self.flush()
+
+		#Start on the variants one toggle away from the new one
+		self.prepare(cam, self.toggles)
+		return program
+
+	def bind(self, program):
+		#Uniform locations differ between programs, so every value needs another upload
+		self.program = program
+		self.locations = {}
+		self.keys = {}
+		for k in self.params:
+			self.keys[k] = glGetUniformLocation(program, '_' + k);
+		self.params.dirty.update(self.keys)
+
+	def location(self, name):
+		#Location of a uniform outside the param store in the current program
+		if name not in self.locations:
+			self.locations[name] = glGetUniformLocation(self.program, name)
+		return self.locations[name]
+
+	def start(self, key, v_shader, f_shader):
+		#Compile program, reusing a linked binary when the driver allows it
+		bin_key = None
+		if key is not None and self.program_binary_supported():
+			bin_key = self.cache.key(key, glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION))
+			program = self.load_program_binary(bin_key)
+			if program is not None:
+				return program, [], None
+		program, shaders = self.start_program(v_shader, f_shader)
+		return program, shaders, bin_key
+
+	def ready(self, link):
+		program, shaders, bin_key = link
+		if not shaders or not self.parallel:
+			return True
+		status = c_int()
+		glGetProgramiv(program, GL_COMPLETION_STATUS_KHR, byref(status))
+		return bool(status.value)
+
+	def variant(self, var_key):
+		if var_key in self.variants:
+			return self.variants[var_key]
+		return self.finish(var_key)
+
+	def finish(self, var_key):
+		#Waits for a pending variant if it's still compiling
+		job, link = self.pending.pop(var_key)
+		if link is None:
+			link = self.start(*(job.result() if hasattr(job, 'done') else job))
+		program, shaders, bin_key = link
+		if shaders:
+			self.finish_program(program, shaders)
+			if bin_key is not None:
+				self.save_program_binary(bin_key, program)
+		self.variants[var_key] = program
+		return program
+
+	def generate(self, cam, f_shader):
 		#Create code for all defines
 		define_code = ''
-		for k in cam.params:
-			param = to_str(cam.params[k])
-			define_code += '#define ' + k + ' ' + param + '\n'
-		define_code += '#define DE de_' + self.obj.name + '\n'
+		defines = cam.defines()
+		for k in defines:
+			define_code += '#define ' + k + ' ' + defines[k] + '\n'
+		if self.obj.bound is not None:
+			c, r = self.obj.bound
+			define_code += '#define BOUNDING_SPHERE vec4(' + vec3_str(c) + ', ' + float_str(r) + ')\n'
+		define_code += '#define DE(p) (de_' + self.obj.name + '(p) * STEP_MULTIPLIER)\n'
 		define_code += '#define COL col_' + self.obj.name + '\n'
+		define_code += '#define DE_GRAD de_grad_' + self.obj.name + '\n'
 		split_ix = f_shader.index('// [/pydefine]')
 		f_shader = f_shader[:split_ix] + define_code + f_shader[split_ix:]
 
 		#Create code for all keys
 		var_code = ''
-		for k in _PYSPACE_GLOBAL_VARS:
-			typ = 'float' if type(_PYSPACE_GLOBAL_VARS[k]) is float else 'vec3'
+		for k in self.params:
+			typ = 'float' if type(self.params[k]) is float else 'vec3'
 			var_code += 'uniform ' + typ + ' _' + k + ';\n'
 
 		split_ix = f_shader.index('// [/pyvars]')
@@ -56,66 +242,99 @@ class Shader:
 		#Create code for all pyspace
 		nested_refs = {}
 		space_code = self.obj.compiled(nested_refs)
+		if cam.params['ANALYTIC_NORMALS']:
+			space_code += self.obj.compiled_grad({})
 
 		#Also add forward declarations
 		forwared_decl_code = ''
 		for k in nested_refs:
 			forwared_decl_code += nested_refs[k].forwared_decl()
 		space_code = forwared_decl_code + space_code
+		if self.optimize:
+			space_code = hoist_constants(space_code)
 
 		split_ix = f_shader.index('// [/pyspace]')
 		f_shader = f_shader[:split_ix] + space_code + f_shader[split_ix:]
+		return f_shader
 
-		#Debugging the shader
-		#open('frag_gen.glsl', 'w').write(f_shader)
-
-		#Compile program
-		program = self.compile_program(v_shader, f_shader)
-
-		#Get variable ids for each uniform
-		for k in _PYSPACE_GLOBAL_VARS:
-			self.keys[k] = glGetUniformLocation(program, '_' + k);
-
-		#Return the program
-		return program
-
-	def compile_shader(self, source, shader_type):
-		shader = glCreateShader(shader_type)
-		glShaderSource(shader, source)
-		glCompileShader(shader)
+	def program_binary_supported(self):
+		if not bool(glGetProgramBinary) or not bool(glProgramBinary):
+			return False
+		num_formats = c_int()
+		glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS, byref(num_formats))
+		return num_formats.value > 0
 
+	def load_program_binary(self, bin_key):
+		data = self.cache.get(bin_key, 'bin')
+		if data is None:
+			return None
+		fmt = int.from_bytes(data[:4], 'little')
+		program = glCreateProgram()
+		glProgramBinary(program, fmt, data[4:], len(data) - 4)
 		status = c_int()
-		glGetShaderiv(shader, GL_COMPILE_STATUS, byref(status))
+		glGetProgramiv(program, GL_LINK_STATUS, byref(status))
 		if not status.value:
-			self.print_log(shader)
-			glDeleteShader(shader)
-			raise ValueError('Shader compilation failed')
-		return shader
+			#The driver rejected the binary, so it gets rebuilt from source
+			glDeleteProgram(program)
+			return None
+		print("Loaded cached program binary")
+		return program
 
-	def compile_program(self, vertex_source, fragment_source):
-		vertex_shader = None
-		fragment_shader = None
+	def save_program_binary(self, bin_key, program):
+		length = c_int()
+		glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH, byref(length))
+		if length.value <= 0:
+			return
+		buf = create_string_buffer(length.value)
+		out_length = c_int()
+		fmt = c_uint()
+		glGetProgramBinary(program, length.value, byref(out_length), byref(fmt), buf)
+		self.cache.put(bin_key, 'bin', fmt.value.to_bytes(4, 'little') + buf.raw[:out_length.value])
+
+	def start_program(self, vertex_source, fragment_source):
+		#Compiling and linking may run in the driver's threads until the status is queried
+		shaders = []
 		program = glCreateProgram()
 
 		if vertex_source:
 			print("Compiling Vertex Shader...")
-			vertex_shader = self.compile_shader(vertex_source, GL_VERTEX_SHADER)
-			glAttachShader(program, vertex_shader)
+			shaders.append(self.start_shader(vertex_source, GL_VERTEX_SHADER))
 		if fragment_source:
 			print("Compiling Fragment Shader...")
-			fragment_shader = self.compile_shader(fragment_source, GL_FRAGMENT_SHADER)
-			glAttachShader(program, fragment_shader)
+			shaders.append(self.start_shader(fragment_source, GL_FRAGMENT_SHADER))
+		for shader in shaders:
+			glAttachShader(program, shader)
 
 		glBindAttribLocation(program, 0, "vPosition")
+		if self.cache is not None and bool(glProgramParameteri):
+			glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
 		glLinkProgram(program)
+		return program, shaders
 
-		if vertex_shader:
-			glDeleteShader(vertex_shader)
-		if fragment_shader:
-			glDeleteShader(fragment_shader)
-
+	def finish_program(self, program, shaders):
+		failed = None
+		for shader in shaders:
+			status = c_int()
+			glGetShaderiv(shader, GL_COMPILE_STATUS, byref(status))
+			if not status.value:
+				self.print_log(shader)
+				failed = shader
+		for shader in shaders:
+			glDeleteShader(shader)
+		if failed is not None:
+			glDeleteProgram(program)
+			raise ValueError('Shader compilation failed')
 		return program
 
+	def start_shader(self, source, shader_type):
+		shader = glCreateShader(shader_type)
+		glShaderSource(shader, source)
+		glCompileShader(shader)
+		return shader
+
+	def compile_program(self, vertex_source, fragment_source):
+		return self.finish_program(*self.start_program(vertex_source, fragment_source))
+
 	def print_log(self, shader):
 		length = c_int()
 		glGetShaderiv(shader, GL_INFO_LOG_LENGTH, byref(length))
@@ -1,14 +1,84 @@
+import math
 import numpy as np
 
 def normalize(x):
 	return x / np.linalg.norm(x)
 
+def normalize_safe(x):
+	n = np.linalg.norm(x)
+	return x / n if n > 0.0 else x
+
+def reciprocal(x):
+	return 1.0 / x if x != 0.0 else 0.0
+
+def normalize_batch(x):
+	return x / np.linalg.norm(x, axis=1)[:,None]
+
 def norm_sq(v):
 	return np.dot(v,v)
 
 def norm(v):
 	return np.linalg.norm(v)
 
+def to_batch(points, dtype=None):
+	points = np.asarray(points, dtype=dtype)
+	if points.dtype != np.float32 and points.dtype != np.float64:
+		points = points.astype(np.float64)
+	if points.ndim == 1:
+		points = points[None,:]
+	if points.shape[1] == 3:
+		points = np.concatenate((points, np.ones((points.shape[0], 1), dtype=points.dtype)), axis=1)
+	return points
+
+def de_grad(f, df, p, J):
+	#Distance f/w of a primitive and its gradient with respect to the origin of the chain,
+	#given the gradient df of f at p.xyz and the Jacobian J of p as (N,4,3)
+	d = f / p[:,3]
+	g = (np.einsum('ni,nij->nj', df, J[:,:3]) - d[:,None] * J[:,3]) / p[:,3][:,None]
+	return d, g
+
+def halton(i, base):
+	f, r = 1.0, 0.0
+	while i > 0:
+		f /= base
+		r += f * (i % base)
+		i //= base
+	return r
+
+def halton_jitter(i):
+	#Sub-pixel offset in xy and depth of field lens offset in zw for progressive sample i
+	return np.array([halton(i, 2), halton(i, 3), halton(i, 5), halton(i, 7)], dtype=np.float32)
+
+def cone_stats(prepass_steps, skipped_steps, pixels):
+	#Steps marched by the cone prepass against the steps it saved the pixels
+	return {
+		'prepass_steps': float(prepass_steps),
+		'skipped_steps': float(skipped_steps),
+		'saved_steps': float(skipped_steps - prepass_steps),
+		'saved_per_pixel': float(skipped_steps - prepass_steps) / pixels,
+	}
+
+def sphere_span(p, ray, c, r):
+	#Distances along unit rays where they enter and leave a sphere, enter > exit for a miss
+	oc = p - c
+	b = np.sum(oc * ray, axis=1)
+	h = b*b - np.sum(oc * oc, axis=1) + r*r
+	sq = np.sqrt(np.maximum(h, 0.0))
+	enter = np.maximum(-b - sq, 0.0)
+	exit = np.where(h < 0.0, -1.0, -b + sq)
+	return enter, exit
+
+def skipped_steps(d0, d1, length, min_dist):
+	#Estimates the steps a march takes over a length of ray with the DE linear between d0 and d1
+	d0 = np.maximum(d0, min_dist)
+	d1 = np.maximum(d1, min_dist)
+	g = (d0 - d1) / np.maximum(length, 1e-30)
+	flat = 2.0 * length / (d0 + d1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		steps = np.log(d1 / d0) / np.log(1.0 - g)
+	steps = np.where(g < 1e-3, flat, np.where(g >= 1.0, 1.0, steps))
+	return np.where(length > 0.0, steps, 0.0)
+
 def get_sub_keys(v):
 	if type(v) is not tuple and type(v) is not list:
 		return []
@@ -44,6 +114,32 @@ def vec3_str(v):
 	else:
 		return 'vec3(' + float_str(v[0]) + ',' + float_str(v[1]) + ',' + float_str(v[2]) + ')'
 
+def py_float(x, keys):
+	if type(x) is str:
+		if x not in keys:
+			keys[x] = '_g' + str(len(keys))
+		return keys[x]
+	else:
+		return repr(float(x))
+
+def py_vec3(v, keys):
+	if type(v) is str:
+		k = py_float(v, keys)
+		return [k + '_0', k + '_1', k + '_2']
+	elif isinstance(v, (float, int)):
+		return [py_float(v, keys)] * 3
+	else:
+		return [py_float(v[0], keys), py_float(v[1], keys), py_float(v[2], keys)]
+
+def py_globals(keys, params):
+	s = ''
+	for k in keys:
+		if type(params[k]) is float:
+			s += '\t' + keys[k] + ' = g[' + repr(k) + ']\n'
+		else:
+			s += '\t' + keys[k] + '_0, ' + keys[k] + '_1, ' + keys[k] + '_2 = g[' + repr(k) + '].tolist()\n'
+	return s
+
 def vec3_eq(v, val):
 	if type(v) is str:
 		return False
@@ -56,29 +152,127 @@ def smin(a, b, k):
 	h = min(max(0.5 + 0.5*(b - a)/k, 0.0), 1.0)
 	return b*(1 - h) + a*h - k*h*(1.0 - h)
 
+#Values computed on the CPU from a param whenever it changes, by the suffix of their key
+DERIVED = {
+	'sin': math.sin,
+	'cos': math.cos,
+	'inv': reciprocal,
+	'unit': normalize_safe,
+}
+
+#Typed parameter slots for one scene with a version counter and dirty flags.
+#Floats are stored as python floats, vec3s as float32 arrays updated in place.
+class ParamStore:
+	def __init__(self):
+		self.slots = {}
+		self.version = 0
+		self.dirty = set()
+		self.resolved = {}
+		self.derived = {}
+
+	def __contains__(self, k):
+		return k in self.slots
+
+	def __getitem__(self, k):
+		return self.slots[k]
+
+	def __setitem__(self, k, val):
+		self.set(k, val)
+
+	def __iter__(self):
+		return iter(self.slots)
+
+	def __len__(self):
+		return len(self.slots)
+
+	def __enter__(self):
+		_PYSPACE_ACTIVE_PARAMS.append(self)
+		return self
+
+	def __exit__(self, *args):
+		_PYSPACE_ACTIVE_PARAMS.pop()
+
+	def items(self):
+		return self.slots.items()
+
+	def update(self, vals):
+		for k in vals:
+			self.set(k, vals[k])
+
+	def add_float(self, k):
+		if k not in self.slots:
+			self.set(k, 0.0)
+
+	def add_vec3(self, k):
+		if k not in self.slots:
+			self.set(k, to_vec3((0,0,0)))
+
+	def set(self, k, val):
+		cur = self.slots.get(k)
+		if cur is None:
+			self.slots[k] = float(val) if isinstance(val, (float, int)) else to_vec3(val)
+		elif type(cur) is float:
+			val = float(val)
+			if val == cur:
+				return
+			self.slots[k] = val
+		else:
+			val = to_vec3(val)
+			if np.array_equal(cur, val):
+				return
+			cur[:] = val
+		self.version += 1
+		self.dirty.add(k)
+		for kind in self.derived.get(k, ()):
+			self.set(k + '_' + kind, DERIVED[kind](self.slots[k]))
+
+	def derive(self, k, kind):
+		#Adds the slot k_kind that follows k, so the shader gets it as its own uniform
+		#and neither the GPU nor the python DE has to recompute it per point
+		if kind not in self.derived.setdefault(k, []):
+			self.derived[k].append(kind)
+			self.set(k + '_' + kind, DERIVED[kind](self.slots[k]))
+		return k + '_' + kind
+
+	def resolve(self, k):
+		#Mixed tuples like ('0', 1, 2) are rebuilt only when a parameter changed
+		k = tuple(k)
+		cached = self.resolved.get(k)
+		if cached is None or cached[0] != self.version:
+			cached = (self.version, np.array([get_global(i) for i in k], dtype=np.float32))
+			self.resolved[k] = cached
+		return cached[1]
+
+def active_params():
+	return _PYSPACE_ACTIVE_PARAMS[-1]
+
 def get_global(k):
 	if type(k) is str:
-		return _PYSPACE_GLOBAL_VARS[k]
+		return _PYSPACE_ACTIVE_PARAMS[-1].slots[k]
 	elif type(k) is tuple or type(k) is list:
-		return np.array([get_global(i) for i in k], dtype=np.float32)
+		return _PYSPACE_ACTIVE_PARAMS[-1].resolve(k)
 	else:
 		return k
 
 def set_global_float(k):
 	if type(k) is str:
-		_PYSPACE_GLOBAL_VARS[k] = 0.0
+		active_params().add_float(k)
 	return k
 
+def set_global_derived(k, kind):
+	#Key of a value derived from param k, see ParamStore.derive()
+	return active_params().derive(k, kind)
+
 def set_global_vec3(k):
 	if type(k) is str:
-		_PYSPACE_GLOBAL_VARS[k] = to_vec3((0,0,0))
+		active_params().add_vec3(k)
 		return k
 	elif isinstance(k, (float, int)):
 		return to_vec3(k)
 	else:
 		sk = get_sub_keys(k)
 		for i in sk:
-			_PYSPACE_GLOBAL_VARS[i] = 0.0
+			active_params().add_float(i)
 		return to_vec3(k)
 
 def cond_offset(p):
@@ -99,4 +293,18 @@ def make_color(geo):
 	else:
 		raise Exception("Invalid coloring type")
 
-_PYSPACE_GLOBAL_VARS = {}
+def make_color_batch(geo, d, orbit):
+	#Batched make_color, rows are RGB and distance
+	if type(geo.color) is tuple or type(geo.color) is np.ndarray:
+		col = np.broadcast_to(np.asarray(get_global(geo.color), dtype=d.dtype), (d.shape[0], 3))
+	elif geo.color == 'orbit' or geo.color == 'o':
+		if orbit is None:
+			raise Exception("Orbit coloring needs an orbit initializer earlier in the chain")
+		col = orbit
+	else:
+		raise Exception("Invalid coloring type")
+	return np.concatenate((col, d[:,None]), axis=1)
+
+#Default store for scenes built outside of a 'with ParamStore():' block
+_PYSPACE_GLOBAL_VARS = ParamStore()
+_PYSPACE_ACTIVE_PARAMS = [_PYSPACE_GLOBAL_VARS]
@@ -9,7 +9,14 @@ from pyspace.fold import *
 from pyspace.geo import *
 from pyspace.object import *
 from pyspace.shader import Shader
+from pyspace.cache import ShaderCache
 from pyspace.camera import Camera
+from pyspace.recording import Recorder, load_recording
+from pyspace.path import make_path
+from pyspace.progressive import Accumulator
+from pyspace.prepass import ConePrepass
+from pyspace.lipschitz import analyze
+from pyspace.brickmap import cached_brickmap
 
 from ctypes import *
 from OpenGL.GL import *
@@ -24,6 +31,10 @@ win_size = (1280, 720)
 #Maximum frames per second
 max_fps = 30
 
+#Frame rate of rendered playback and the camera smoothing time in seconds
+playback_fps = 60
+playback_smoothing = 0.8
+
 #Forces an 'up' orientation when True, free-camera when False
 gimbal_lock = False
 
@@ -34,6 +45,18 @@ look_speed = 0.003
 auto_velocity = True
 auto_multiplier = 2.0
 
+#Slide along surfaces instead of slowing down when moving into them
+auto_slide = True
+
+#Use a baked brick map for collision probes far from the surface, see pyspace/brickmap.py
+#NOTE: Baking takes a while the first time, the result is cached in ~/.pyspace/brickmaps
+use_brickmap = False
+
+#Camera options switched at runtime, their shader variants are compiled in the background.
+#  'h' toggles SHADOWS_ENABLED, 'g' toggles GLOW_ENABLED, 'l' cycles REFLECTION_LEVEL
+variant_toggles = {'SHADOWS_ENABLED': (True, False), 'GLOW_ENABLED': (False, True), 'REFLECTION_LEVEL': (0, 1, 2)}
+variant_keys = {pygame.K_h: 'SHADOWS_ENABLED', pygame.K_g: 'GLOW_ENABLED', pygame.K_l: 'REFLECTION_LEVEL'}
+
 #Maximum velocity of the camera
 max_velocity = 2.0
 
@@ -179,15 +202,6 @@ def test_fractal():
 #----------------------------------------------
 #             Helper Utilities
 #----------------------------------------------
-def interp_data(x, f=2.0):
-	new_dim = int(x.shape[0]*f)
-	output = np.empty((new_dim,) + x.shape[1:], dtype=np.float32)
-	for i in range(new_dim):
-		a, b1 = math.modf(float(i) / f)
-		b2 = min(b1 + 1, x.shape[0] - 1)
-		output[i] = x[int(b1)]*(1-a) + x[int(b2)]*a
-	return output
-
 def make_rot(angle, axis_ix):
 	s = math.sin(angle)
 	c = math.cos(angle)
@@ -208,18 +222,48 @@ def reorthogonalize(mat):
 	u, s, v = np.linalg.svd(mat)
 	return np.dot(u, v)
 
+def load_playback(rec_file='recording.pysr', vars_file=None):
+	#Resamples the recording by timestamp and smooths the camera path
+	if vars_file is None:
+		rec = load_recording(rec_file)
+		mats, rec_vars, times = rec['mat'], rec['vars'], rec['time']
+	else:
+		#Older recordings were saved as a pair of .npy files without timestamps
+		mats, rec_vars = np.load(rec_file), np.load(vars_file)
+		times = np.arange(mats.shape[0]) / max_fps
+	return make_path(mats, rec_vars, times, playback_fps, playback_smoothing)
+
 # move the cursor back , only if the window is focused
 def center_mouse():
 	if pygame.key.get_focused():
 		pygame.mouse.set_pos(screen_center)
 
+#======================================================
+#               Change the fractal here
+#======================================================
+def make_fractal():
+	return tree_planet()
+
+#======================================================
+#             Change camera settings here
+# See pyspace/camera.py for all camera options
+#======================================================
+def make_camera():
+	camera = Camera()
+	camera['ANTIALIASING_SAMPLES'] = 1
+	camera['AMBIENT_OCCLUSION_STRENGTH'] = 0.01
+	#Live params can be tuned with shader.set() without recompiling, e.g.
+	#camera.set_live('EXPOSURE')
+	return camera
+
 #--------------------------------------------------
 #                  Video Recording
 #
 #    When you're ready to record a video, press 'r'
 # to start recording, and then move around.  The
 # camera's path and live '0' through '5' parameters
-# are recorded to a file.  Press 'r' when finished.
+# are streamed to 'recording.pysr'.  Press 'r' when
+# finished.
 #
 #    Now you can exit the program and turn up the
 # camera parameters for better rendering.  For
@@ -232,6 +276,10 @@ def center_mouse():
 # can import the image sequence to editing software
 # to convert it to a video.
 #
+#    To render without a window, for example at a
+# higher resolution on the CPU, run:
+#    python render_playback.py --help
+#
 #    You can press 's' anytime for a screenshot.
 #---------------------------------------------------
 
@@ -241,38 +289,55 @@ if __name__ == '__main__':
 	pygame.mouse.set_visible(False)
 	center_mouse()
 
-	#======================================================
-	#               Change the fractal here
-	#======================================================
-	obj_render = tree_planet()
-	#======================================================
-
-	#======================================================
-	#             Change camera settings here
-	# See pyspace/camera.py for all camera options
-	#======================================================
-	camera = Camera()
-	camera['ANTIALIASING_SAMPLES'] = 1
-	camera['AMBIENT_OCCLUSION_STRENGTH'] = 0.01
-	#======================================================
-
-	shader = Shader(obj_render)
-	program = shader.compile(camera)
+	obj_render = make_fractal()
+	camera = make_camera()
+
+	#Analyze and bound the fractal with the starting key variables, not the defaults it was built with
+	start_vars = [(str(i), keyvars[i]) for i in range(3)] + [('v', keyvars[3:6]), ('pos', start_pos)]
+	for k, val in start_vars:
+		if k in obj_render.params:
+			obj_render.params.set(k, val)
+
+	#Take larger steps if the fractal's DE provably allows it, unless the multiplier was set by hand
+	lipschitz = analyze(obj_render)
+	print(lipschitz)
+	if lipschitz.proven and camera['STEP_MULTIPLIER'] == 1.0:
+		camera['STEP_MULTIPLIER'] = lipschitz.multiplier
+
+	#Clip rays to a bounding sphere of the fractal, infinite scenes are left unbounded.
+	#NOTE: The bound is found for the current parameters, changing them a lot can move the surface outside.
+	if obj_render.bound is None:
+		obj_render.bound = obj_render.estimate_bound()
+		print("Bounding sphere:", obj_render.bound)
+
+	#The brick map's lower bound only holds with the fractal's real lipschitz bound
+	brickmap = None
+	if use_brickmap and auto_velocity and obj_render.bound is not None and lipschitz.proven:
+		brickmap = cached_brickmap(obj_render, lipschitz=max(lipschitz.bound, lipschitz.sampled or 0.0))
+		print("Brick map: %d bricks" % len(brickmap))
+
+	shader = Shader(obj_render, optimize=True, cache=ShaderCache())
+	shader.compile(camera)
+	prepass = None
+	if camera['CONE_PREPASS_BLOCK'] > 0:
+		prepass = ConePrepass(obj_render, camera, win_size, cache=ShaderCache())
+	shader.prepare(camera, variant_toggles)
 	print("Compiled!")
 
-	matID = glGetUniformLocation(program, "iMat")
-	prevMatID = glGetUniformLocation(program, "iPrevMat")
-	resID = glGetUniformLocation(program, "iResolution")
-	ipdID = glGetUniformLocation(program, "iIPD")
-
-	glUseProgram(program)
-	glUniform2fv(resID, 1, win_size)
-	glUniform1f(ipdID, 0.04)
+	def setup_program():
+		glUseProgram(shader.program)
+		glUniform2fv(shader.location("iResolution"), 1, win_size)
+		glUniform1f(shader.location("iIPD"), 0.04)
+	setup_program()
 
 	fullscreen_quad = np.array([-1.0, -1.0, 0.0, 1.0, -1.0, 0.0, -1.0, 1.0, 0.0, 1.0, 1.0, 0.0], dtype=np.float32)
 	glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, fullscreen_quad)
 	glEnableVertexAttribArray(0)
 
+	accum = None
+	if camera['PROGRESSIVE_ENABLED']:
+		accum = Accumulator(win_size, camera['PROGRESSIVE_MAX_SAMPLES'])
+
 	mat = np.identity(4, np.float32)
 	mat[3,:3] = np.array(start_pos)
 	prevMat = np.copy(mat)
@@ -280,7 +345,6 @@ if __name__ == '__main__':
 		shader.set(str(i), keyvars[i])
 
 	recording = None
-	rec_vars = None
 	playback = None
 	playback_vars = None
 	playback_ix = -1
@@ -293,10 +357,7 @@ if __name__ == '__main__':
 		global prevMat
 		if not os.path.exists('playback'):
 			os.makedirs('playback')
-		playback = np.load('recording.npy')
-		playback_vars = np.load('rec_vars.npy')
-		playback = interp_data(playback, 2)
-		playback_vars = interp_data(playback_vars, 2)
+		playback, playback_vars = load_playback()
 		playback_ix = 0
 		prevMat = playback[0]
 
@@ -309,25 +370,35 @@ if __name__ == '__main__':
 				if event.key == pygame.K_r:
 					if recording is None:
 						print("Recording...")
-						recording = []
-						rec_vars = []
+						recording = Recorder('recording.pysr', len(keyvars))
 					else:
-						np.save('recording.npy', np.array(recording, dtype=np.float32))
-						np.save('rec_vars.npy', np.array(rec_vars, dtype=np.float32))
+						recording.close()
 						recording = None
-						rec_vars = None
 						print("Finished Recording.")
 				elif event.key == pygame.K_p:
 					start_playback()
 				elif event.key == pygame.K_c:
 					pygame.image.save(window, 'screenshot.png')
+				elif event.key in variant_keys:
+					k = variant_keys[event.key]
+					vals = variant_toggles[k]
+					camera[k] = vals[(vals.index(camera[k]) + 1) % len(vals)]
+					print("%s = %s" % (k, camera[k]))
+					shader.switch(camera)
+					setup_program()
 				elif event.key == pygame.K_ESCAPE:
 					sys.exit(0)
 
 		mat[3,:3] += vel * (clock.get_time() / 1000)
 
 		if auto_velocity:
-			de = obj_render.DE(mat[3]) * auto_multiplier
+			#A map baked for other values of the keyed params is no longer a safe bound
+			de = -1.0
+			if brickmap is not None and brickmap.matches(obj_render.params):
+				de = brickmap.DE(mat[3]) * auto_multiplier
+			#The exact DE only matters once the camera is close enough to be slowed down
+			if de < max_velocity:
+				de = obj_render.DE_fast(mat[3]) * auto_multiplier
 			if not np.isfinite(de):
 				de = 0.0
 		else:
@@ -393,6 +464,10 @@ if __name__ == '__main__':
 				vel *= speed_decel # TODO
 			else:
 				vel += np.dot(mat[:3,:3].T, acc)
+				if auto_slide and de < max_velocity:
+					normal = mat[3,:3] - obj_render.NP(mat[3])
+					normal /= np.linalg.norm(normal) + 1e-12
+					vel -= min(np.dot(vel, normal), 0.0) * normal
 				vel_ratio = min(max_velocity, de) / (np.linalg.norm(vel) + 1e-12)
 				if vel_ratio < 1.0:
 					vel *= vel_ratio
@@ -400,8 +475,7 @@ if __name__ == '__main__':
 				vel *= 10.0
 
 			if recording is not None:
-				recording.append(np.copy(mat))
-				rec_vars.append(np.array(keyvars, dtype=np.float32))
+				recording.append(mat, keyvars)
 		else:
 			if playback_ix >= 0:
 				ix_str = '%04d' % playback_ix
@@ -410,8 +484,7 @@ if __name__ == '__main__':
 				playback = None
 				break
 			else:
-				mat = prevMat * 0.98 + playback[playback_ix] * 0.02
-				mat[:3,:3] = reorthogonalize(mat[:3,:3])
+				mat = np.copy(playback[playback_ix])
 				keyvars = playback_vars[playback_ix].tolist()
 				playback_ix += 1
 
@@ -419,13 +492,29 @@ if __name__ == '__main__':
 			shader.set(str(i), keyvars[i])
 		shader.set('v', np.array(keyvars[3:6]))
 		shader.set('pos', mat[3,:3])
-
-		glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-		glUniformMatrix4fv(matID, 1, False, mat)
-		glUniformMatrix4fv(prevMatID, 1, False, prevMat)
+		if accum is not None:
+			accum.update(mat, prevMat, (shader.params.version, shader.program))
+		if prepass is not None and (accum is None or not accum.done()):
+			prepass.render(mat)
+			glUseProgram(shader.program)
+		shader.pump()
+		shader.flush()
+
+		glUniformMatrix4fv(shader.location("iMat"), 1, False, mat)
+		glUniformMatrix4fv(shader.location("iPrevMat"), 1, False, prevMat)
 		prevMat = np.copy(mat)
 
-		glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+		if accum is None:
+			glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+			glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+		else:
+			#Still frames keep refining, the last image is shown once enough samples are in
+			if not accum.done():
+				glUniform4fv(shader.location("iJitter"), 1, accum.jitter())
+				accum.begin()
+				glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+				accum.end()
+			accum.present()
 		pygame.display.flip()
 		clock.tick(max_fps)
 		frame_num += 1
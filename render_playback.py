@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+#--------------------------------------------------
+#    Renders a recording made with ray_marcher_demo.py
+# on the CPU without opening a window.  The fractal,
+# camera settings and path smoothing are taken from
+# the demo, so change them there.
+#
+#    Frames are written as PNGs on background threads
+# while the next frame renders.  Frames that already
+# exist are skipped, so an interrupted job can simply
+# be started again.
+#--------------------------------------------------
+
+import argparse, os, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pygame
+
+import ray_marcher_demo as demo
+from pyspace.parallel import TiledRenderer
+
+def save_frame(image, fname):
+	pixels = (np.clip(image, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+	surf = pygame.surfarray.make_surface(np.transpose(pixels, (1, 0, 2)))
+	#Write to a temporary name first so a killed job never leaves a partial frame behind
+	tmp_fname = fname[:-4] + '.tmp.png'
+	pygame.image.save(surf, tmp_fname)
+	os.replace(tmp_fname, fname)
+
+def set_frame_params(params, mat, keyvars):
+	for i in range(3):
+		params[str(i)] = float(keyvars[i])
+	params['v'] = np.array(keyvars[3:6])
+	params['pos'] = mat[3,:3]
+
+def main():
+	parser = argparse.ArgumentParser(description='Render a recorded camera path without a display.')
+	parser.add_argument('--recording', default='recording.pysr')
+	parser.add_argument('--vars', default=None, help='keyvars file for recordings saved as .npy')
+	parser.add_argument('--out', default='playback')
+	parser.add_argument('--fractal', default='make_fractal', help='name of a fractal function in ray_marcher_demo.py')
+	parser.add_argument('--size', type=int, nargs=2, default=demo.win_size, metavar=('W', 'H'))
+	parser.add_argument('--start', type=int, default=0)
+	parser.add_argument('--end', type=int, default=None)
+	parser.add_argument('--tile-size', type=int, default=64)
+	parser.add_argument('--processes', type=int, default=None)
+	parser.add_argument('--encoders', type=int, default=2, help='number of PNG encoding threads')
+	parser.add_argument('--brickmap', default=None, help='brick map file baked with pyspace.brickmap for faster far steps')
+	args = parser.parse_args()
+
+	if not os.path.exists(args.out):
+		os.makedirs(args.out)
+
+	mats, rec_vars = demo.load_playback(args.recording, args.vars)
+	end = mats.shape[0] if args.end is None else min(args.end, mats.shape[0])
+	frames = [i for i in range(args.start, end)
+		if not os.path.exists(os.path.join(args.out, 'frame%04d.png' % i))]
+	print('Rendering %d of %d frames' % (len(frames), end - args.start))
+
+	size = tuple(args.size)
+	builder = getattr(demo, args.fractal)
+	with TiledRenderer(builder, demo.make_camera(), size, args.tile_size, args.processes, brickmap=args.brickmap) as renderer:
+		params = renderer.renderer.obj.params
+		pending = []
+		with ThreadPoolExecutor(args.encoders) as encoders:
+			for i in frames:
+				start_time = time.time()
+				set_frame_params(params, mats[i], rec_vars[i])
+				image = renderer.render(mats[i], mats[max(i - 1, 0)])
+				fname = os.path.join(args.out, 'frame%04d.png' % i)
+				pending.append(encoders.submit(save_frame, image, fname))
+
+				#Don't let finished frames pile up in memory if encoding falls behind
+				while len(pending) > args.encoders * 2:
+					pending.pop(0).result()
+				print('frame %d: %.2fs' % (i, time.time() - start_time))
+			for f in pending:
+				f.result()
+
+if __name__ == '__main__':
+	main()